@@ -1,38 +1,107 @@
 #!/usr/bin/python3
 import sys
+import threading
 from argparse import ArgumentParser
-from typing import Dict, Any, Optional, List
-from bitdiscovery.api import BitDiscoveryApi, try_multiple_times, get_lastid
-from bitdiscovery.cloud import get_provider, remove_matches, CloudProvider, AWSProvider
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests import RequestException
+from typing import Dict, Any, Callable, Optional, List, Set, Iterator, Tuple
+from bitdiscovery.api import BitDiscoveryApi, ApiError
+from bitdiscovery.ratelimit import RateLimiter, DEFAULT_READS_PER_SECOND, DEFAULT_WRITES_PER_SECOND
+from bitdiscovery.retry import default_policy
+from bitdiscovery.asyncapi import AsyncBitDiscoveryApi, run_sync
+from bitdiscovery.backends import BACKENDS
+from bitdiscovery.ipindex import IntervalIndex, ip_key, parse_range
+from bitdiscovery.cloud import get_provider, load_accounts, error_line, timed_call, CloudProvider, AWSProvider
+from bitdiscovery.mirror import InventoryMirror
+from bitdiscovery.journal import Journal
+from bitdiscovery.plan import ChangePlan, PlanExecutor, StageResult
+from bitdiscovery.reconcile import Reconciler, ReconciliationPlan
 
 parser = ArgumentParser(description="Add your cloud provider assets to your Bit Discovery inventory.")
 parser.add_argument('cloudprovider', metavar="PROVIDER", type=str, choices=['amazon-ec2', 'google-cloud', 'azure'],
-                    help="The cloud provider to add assets from, either amazon-ec2, google-cloud or azure.")
+                    nargs='?',
+                    help="The cloud provider to add assets from, either amazon-ec2, google-cloud or azure (not "
+                         "needed with --config or --apply).")
 parser.add_argument('apikey', metavar="APIKEY", type=str, help="Your Bit Discovery API key.")
+parser.add_argument('--config', type=str, metavar="FILE",
+                    help="Add the assets of every cloud account listed in this JSON file (see the README) in one run.")
+parser.add_argument('--backend', choices=BACKENDS, default='cli',
+                    help="Read the cloud provider through its command-line tool (cli) or its Python SDK (sdk), "
+                         "by default cli.")
+mode = parser.add_mutually_exclusive_group()
+mode.add_argument('--plan', type=str, metavar="FILE",
+                  help="Only write the changes to this plan file (gzipped JSON), without making them.")
+mode.add_argument('--apply', type=str, metavar="FILE",
+                  help="Make the changes of a plan file written with --plan, without reading the cloud provider.")
+parser.add_argument('--archive-stale', action='store_true',
+                    help="Also archive the assets and delete the IP sources in the provider's IP space that weren't "
+                         "found in your account.")
+parser.add_argument('--mirror', action='store_true',
+                    help="Read the inventory from a local copy, which is synced first. The IPs of existing assets "
+                         "are then not added again either.")
+parser.add_argument('--resume', action='store_true',
+                    help="Continue an interrupted or failed run with the same arguments where it stopped.")
 parser.add_argument('--env', choices=['dev', 'staging', 'prod'], default="dev",
                     help="The Bit Discovery environment (by default 'dev')")
 parser.add_argument('--offset', type=int, default=0, help="Offset to the API request data (by default 0).")
-parser.add_argument('--limit', type=int, default=5000, help="Limit to the API request data (by default 500).")
+parser.add_argument('--limit', type=int, default=5000, help="Limit to the API request data (by default 5000).")
+parser.add_argument('--batch-size', type=int, default=100,
+                    help="The number of assets archived with one API call (by default 100).")
+parser.add_argument('--concurrency', type=int, default=10,
+                    help="The number of API calls to run at the same time (by default 10).")
+parser.add_argument('--parallel-accounts', type=int, default=4,
+                    help="The number of cloud accounts read at the same time, each runs its own pool of CLI or SDK "
+                         "calls (by default 4).")
+parser.add_argument('--reads-per-second', type=float, default=DEFAULT_READS_PER_SECOND,
+                    help="Read API calls allowed per second and API key (by default 0, unlimited).")
+parser.add_argument('--writes-per-second', type=float, default=DEFAULT_WRITES_PER_SECOND,
+                    help="Write API calls allowed per second and API key (by default 0, unlimited).")
 args = parser.parse_args()
 
 APIKEY: str = args.apikey
-CLOUD_PROVIDER: str = args.cloudprovider
+CLOUD_PROVIDER: Optional[str] = args.cloudprovider
+CONFIG_FILE: Optional[str] = args.config
+BACKEND: str = args.backend
 APIURL: str = "https://bitdiscovery.com/api/1.0"
 OFFSET: int = args.offset
 LIMIT: int = args.limit
-
-
-# Takes two dicts and safely merges them into a copy
-def merge_two_dicts(x: Dict, y: Dict) -> Dict:
-    z = x.copy()  # start with x's keys and values
-    z.update(y)  # modifies z with y's keys and values & returns None
-    return z
+BATCH_SIZE: int = args.batch_size
+CONCURRENCY: int = args.concurrency
+PARALLEL_ACCOUNTS: int = max(args.parallel_accounts, 1)
+READS_PER_SECOND: float = args.reads_per_second
+WRITES_PER_SECOND: float = args.writes_per_second
+MIRROR: bool = args.mirror
+RESUME: bool = args.resume
+PLAN_FILE: Optional[str] = args.plan
+APPLY_FILE: Optional[str] = args.apply
+ARCHIVE_STALE: bool = args.archive_stale
+
+if [CLOUD_PROVIDER, CONFIG_FILE, APPLY_FILE].count(None) != 2:
+    parser.error("give either a PROVIDER, a --config or a plan file to --apply")
+
+providers: List[CloudProvider] = []
+if CONFIG_FILE is not None:
+    try:
+        providers = load_accounts(CONFIG_FILE, BACKEND)
+    except ValueError as e:
+        parser.error(str(e))
+elif CLOUD_PROVIDER is not None:
+    providers = [get_provider(CLOUD_PROVIDER, BACKEND)]
+
+applied_plan: Optional[ChangePlan] = None
+if APPLY_FILE is not None:
+    try:
+        applied_plan = ChangePlan.load(APPLY_FILE)
+    except ValueError as e:
+        parser.error(str(e))
 
 
 # Find all IPs belonging in Bit Discovery
 print("Initializing and pulling assets from Bit Discovery...")
 
-api = BitDiscoveryApi(APIURL, APIKEY)
+api = BitDiscoveryApi(APIURL, APIKEY, pool_size=CONCURRENCY,
+                      rate_limiter=RateLimiter(APIKEY, READS_PER_SECOND, WRITES_PER_SECOND))
+async_api = AsyncBitDiscoveryApi(api, CONCURRENCY)
 inventories_json: Dict[str, Any] = {}
 try:
     inventories_json = api.find_inventories(OFFSET, LIMIT)
@@ -43,115 +112,228 @@ except:
 # TODO: maybe remove iteration if we cannot add to multiple inventories
 inventories: Dict[str, str] = {inventories_json['actualInventory']['inventory_name']: APIKEY}
 
-for entityname in inventories:
-    jsondata = []
-    # TODO: this is never used, why do we have to keep this (merge_two_dicts too)
-    inventoryips = {}
-
-    print(f"Starting sources for: {entityname}.")
-
-    sourcesdata: List[Dict[str, Any]] = []
-
-    # Collect every source from Bit Discovery inventory with pagination
-    lastid: str = ''
-    offset: int = OFFSET
-    while True:
-        result: Optional[Dict[str, Any]] = try_multiple_times(
-            lambda: api.search_for_source(LIMIT, lastid, ""),
-            max_tries=5
-        )
-
-        if result is None:
+# Progress is journaled, so a failed run can be continued with --resume without reading or adding things again
+if applied_plan is not None:
+    journal = Journal('apply-plan', '\n'.join([APIKEY, applied_plan.digest()]), resume=RESUME)
+else:
+    journal = Journal('auto-add-assets', '\n'.join([APIKEY, str(CLOUD_PROVIDER), str(CONFIG_FILE), str(PLAN_FILE)]),
+                      resume=RESUME)
+if journal.resumed:
+    print("Resuming the previous run.")
+
+
+def discover(provider: CloudProvider, found: Callable[[CloudProvider, Dict[str, int]], None]) -> Tuple[int, List[str]]:
+    """
+    Read one cloud account.
+
+    :param provider: The provider of the account.
+    :param found: Called with every part of the IPs, as soon as it is read (e.g. per project).
+    :return: the number of IPs, and the S3 bucket URLs of AWS accounts.
+    """
+    count = 0
+    for ips in provider.iter_instance_ips():
+        found(provider, ips)
+        count += len(ips)
+    urls: List[str] = []
+    # If provider is AWS, then we can also retrieve the buckets (their regions are cached between runs)
+    if isinstance(provider, AWSProvider):
+        urls = list(provider.find_s3_urls(provider.find_s3_buckets()).values())
+    return count, urls
+
+
+def plan_changes(entityname: str) -> ChangePlan:
+    """
+    Compare every cloud account with the inventory, without making any write.
+
+    :param entityname: The name of the inventory.
+    :return: the changes to make.
+    """
+    # Get the IP ranges of every provider once, to check that the discovered IPs really are in its IP space
+    provider_names: List[str] = sorted({provider.name for provider in providers})
+    print(f"\tWe're on {', '.join(provider_names)}, so processing accordingly")
+    spaces: Dict[str, IntervalIndex] = {}
+    for provider in providers:
+        if provider.name in spaces:
+            continue
+        print(f"\t\tGetting and parsing all of {provider.name}'s public IP space")
+        try:
+            spaces[provider.name] = IntervalIndex.from_prefixes(provider.get_ip_prefixes())
+        except (RequestException, ValueError) as e:
+            print(f"\t\tCouldn't get {provider.name}'s public IP space, continuing without it ({str(e)}).")
+    # Only IPs in the provider's IP space can be stale, otherwise every other IP source would be
+    provider_space: Optional[IntervalIndex] = None
+    if spaces:
+        provider_space = IntervalIndex()
+        for space in spaces.values():
+            for (start, end) in zip(space.starts, space.ends):
+                provider_space.add(start, end)
+        provider_space.build()
+    reconciler = Reconciler(scope=provider_space)
+
+    # Bring the local mirror up to date, only the changes since the last run are downloaded
+    mirror: Optional[InventoryMirror] = None
+    if MIRROR:
+        print("\t\tSyncing the local copy of the inventory")
+        mirror = InventoryMirror(api)
+        try:
+            (newassets, newsources) = mirror.sync(LIMIT)
+        except ApiError:
             print("\tAPI call failed too many times. Try again later.")
             exit(1)
-
-        sourcesdata.append(result)
-        lastid = get_lastid(result)
-        offset += LIMIT
-        total: int = int(sourcesdata[0]['total'])
-
-        if offset > total:
-            break
-
-    # Collect all source IPs that aren't CIDRs
-    sourceips: Dict[str, int] = {}
-    for sources in sourcesdata:
-        for source in sources.get('searches', []):
+        print(f"\t\tDownloaded {newassets} assets and {newsources} sources.")
+        reconciler.add_inventory_ips(str(asset['bd.ip_address']) for asset in mirror.assets())
+
+    # Stream every source from Bit Discovery inventory, and collect the IP, CIDR and range sources
+    # The keywords of every page are journaled with the cursor of the next one, so a resumed scan continues there
+    sourcekeywords: Set[str] = set(journal.done('sourcekeywords'))
+    # The source IDs of single IPs, to delete the stale ones
+    ipsource_ids: Dict[int, str] = {}
+
+    def add_ipsource(source_id: str, keyword: str):
+        reconciler.add_source(keyword)
+        span = parse_range(keyword)
+        if span is not None and span[0] == span[1]:
+            ipsource_ids[span[0]] = source_id
+
+    for ipsource in journal.done('ipsources'):
+        add_ipsource(*ipsource.split(' ', 1))
+    pagekeywords: List[str] = []
+    pageipsources: List[str] = []
+
+    def next_page(cursor: str, offset: int, total: int):
+        journal.mark_done('sourcekeywords', pagekeywords)
+        journal.mark_done('ipsources', pageipsources)
+        if cursor:
+            journal.set_cursor('sources', cursor)
+        pagekeywords.clear()
+        pageipsources.clear()
+
+    if mirror is not None:
+        sources: Iterator[Dict[str, Any]] = mirror.sources()
+    else:
+        sources = api.iter_sources(LIMIT, "", journal.cursor('sources'), on_page=next_page, max_tries=5)
+    try:
+        for source in sources:
+            keyword = str(source.get('keyword', '')).lower()
+            sourcekeywords.add(keyword)
+            pagekeywords.append(keyword)
             if 'search_type' in source and source['search_type'] == 'iprange':
-                ipcandidate = source['keyword'].lower()
-                if '-' in ipcandidate or '/' in ipcandidate:
-                    continue
-                else:
-                    # Number 2 indicates it's a source, not an asset
-                    sourceips[ipcandidate] = 2
-
-    # TODO: if inventoryips is to be deleted this can be removed as well
-    superset: Dict[str, int] = merge_two_dicts(sourceips, inventoryips)
-    for ips in superset:
-        if ips in sourceips and ips in inventoryips:
-            # Number 3 saying the IP address is found in both
-            superset[ips] = 3
-
-    # Find all IPs in cloud
-    addednum = 0
-
-    provider: CloudProvider = get_provider(CLOUD_PROVIDER)
-
-    # Get provider IP ranges from the provider
-    # TODO: why is this read? we don't use this for anything
-    print(f"\tWe're on {provider.name}, so processing accordingly")
-    print(f"\t\tGetting and parsing all of {provider.name}'s public IP space")
-    prefixes: Dict[str, int] = provider.get_ip_ranges()
-
-    # Get your ips from the provider
-    print("\t\tGetting and parsing your public IPs")
-    ips: Dict[str, int] = provider.get_instance_ips()
-
-    # If IPs in cloud match Bit Discovery remove them from list to do further checks on (they haven't changed)
+                add_ipsource(str(source['id']), keyword)
+                pageipsources.append(f"{source['id']} {keyword}")
+    except ApiError:
+        print("\tAPI call failed too many times. Try again later.")
+        exit(1)
+
+    # Get your ips from every account at the same time, and merge them into one set
+    print(f"\t\tGetting and parsing your public IPs from {len(providers)} accounts")
+    bucket_urls: Set[str] = set()
+    failed_accounts: List[str] = []
+    incomplete_accounts: List[str] = []
+    outside: Dict[str, int] = {}
+    # The accounts stream their IPs in from the worker threads
+    reconciler_lock = threading.Lock()
+
+    def found(provider: CloudProvider, ips: Dict[str, int]):
+        with reconciler_lock:
+            reconciler.add_cloud_ips(ips)
+            if provider.name in spaces:
+                ip_list = list(ips)
+                for (ip, inside) in zip(ip_list, spaces[provider.name].contains_many(ip_list)):
+                    if not inside:
+                        outside[provider.name] = outside.get(provider.name, 0) + 1
+
+    # Every account reads its regions, projects or subscriptions in a pool of its own, so only a few run at once
+    with ThreadPoolExecutor(max_workers=min(len(providers), PARALLEL_ACCOUNTS)) as executor:
+        futures = {executor.submit(timed_call, discover, provider, found): provider for provider in providers}
+        for future in as_completed(futures):
+            provider = futures[future]
+            (result, seconds, error) = future.result()
+            if error is not None:
+                print(f"\t\t\t{provider.label} failed after {seconds:.1f}s: {error_line(error)}")
+                failed_accounts.append(provider.label)
+                continue
+            if provider.incomplete:
+                incomplete_accounts.append(provider.label)
+            (count, urls) = result
+            print(f"\t\t\t{provider.label}: {count} IPs and {len(urls)} buckets in {seconds:.1f}s")
+            bucket_urls.update(urls)
+
+    for name in outside:
+        # E.g. bring your own IP ranges, these are still added
+        print(f"\t\t{outside[name]} of your IPs are outside of {name}'s published IP space.")
+    if len(failed_accounts) == len(providers):
+        print("\tCouldn't read any of your accounts. Try again later.")
+        exit(1)
+
+    # If IPs in cloud match Bit Discovery, or are inside a range source, they don't have to be added again
     print("\t\tIgnorning assets that haven't changed.")
-    ips_new, old_ips = remove_matches(superset, inventoryips, sourceips, ips)
-
-    # If IPs are not in Bit Discovery but they are in cloud add them
-    print("\t\tAdding new IPs")
-    for new_ip in ips_new:
-        # Try to add the new IPs to the Bit Discovery inventory
-        result: Optional[bool] = try_multiple_times(
-            lambda: api.add_ip(new_ip),
-            max_tries=5
-        )
-
-        if result is None:
-            print("\tAPI call failed too many times. Try again later.")
-            exit(1)
-
-        # Increment added count
-        addednum += 1
-
-    print(f"\tAdded a total of {str(addednum)} {provider.name} IPs.")
-
-    # If provider is AWS, then we can also retrieve the buckets
-    if type(provider) == AWSProvider:
-        print("\t\tFinding s3 buckets.")
-        buckets = AWSProvider().find_s3_buckets()
-
-        print("\t\tAdding s3 buckets.")
-        addedbucket = 0
-        for bucket in buckets:
-            url = AWSProvider().find_s3_region(bucket)
-
-            # Try to add bucket URLs to the Bit Discovery inventory
-            success: Optional[bool] = try_multiple_times(
-                lambda: api.add_source(url),
-                max_tries=5
-            )
-
-            if result is None:
+    plan: ReconciliationPlan = reconciler.plan()
+    print(f"\t\t{len(plan.unchanged)} IPs are already in the inventory, {len(plan.covered)} are inside range sources.")
+    changes = ChangePlan(entityname, ', '.join(provider_names), add_ips=plan.to_add)
+    # Buckets that are already sources are skipped
+    changes.add_sources = sorted(url for url in bucket_urls if url.lower() not in sourcekeywords)
+
+    if plan.stale and provider_space is not None:
+        print(f"\t\t{len(plan.stale)} IP sources in {changes.provider}'s IP space weren't found in your accounts.")
+        if ARCHIVE_STALE and (failed_accounts or incomplete_accounts):
+            # Their IPs may just be in the accounts that couldn't be read
+            print("\t\tNot archiving them, as some accounts couldn't be read completely.")
+        elif ARCHIVE_STALE:
+            print("\t\tFinding the assets of the stale IPs.")
+            changes.delete_sources = [ipsource_ids[ip_key(ip)] for ip in plan.stale if ip_key(ip) in ipsource_ids]
+            # Searched for even with the mirror, where the IP of an asset may have changed since the last full sync
+            stale_assets: Dict[str, Optional[List[str]]] = run_sync(async_api.map(
+                lambda ip: [str(asset['id']) for asset in api.iter_ip_matches(ip, LIMIT)], plan.stale, 1))
+            if None in stale_assets.values():
                 print("\tAPI call failed too many times. Try again later.")
                 exit(1)
+            changes.archive_assets = [asset_id for ip in plan.stale for asset_id in stale_assets[ip]]
 
-            # Increment bucket count
-            addedbucket += 1
+    # The new sources are picked up by the next sync, as the source count changed
+    if mirror is not None:
+        mirror.close()
+    return changes
 
-        print("\tAdded a total of " + str(addedbucket) + " S3 buckets.")
 
+for entityname in inventories:
+    print(f"Starting sources for: {entityname}.")
+
+    if applied_plan is not None:
+        if applied_plan.inventory != entityname:
+            print(f"\tThe plan was made for the inventory {applied_plan.inventory}, not {entityname}.")
+            exit(1)
+        changes: ChangePlan = applied_plan
+    else:
+        changes = plan_changes(entityname)
+
+    print(f"\t\tThe plan adds {len(changes.add_ips)} IPs and {len(changes.add_sources)} other sources, archives "
+          f"{len(changes.archive_assets)} assets and deletes {len(changes.delete_sources)} sources.")
+    if PLAN_FILE is not None:
+        changes.save(PLAN_FILE)
+        print(f"\tWrote the plan to {PLAN_FILE}.")
+        continue
+
+    # If IPs are not in Bit Discovery but they are in cloud add them, and remove the stale ones if asked to
+    print("\t\tMaking the changes")
+    results: List[StageResult] = PlanExecutor(api, async_api, BATCH_SIZE, journal).apply(changes)
+    for result in results:
+        if result.done or result.failed:
+            print(f"\t\t{result.name}: {result.done} done in {result.seconds:.1f}s ({result.rate:.1f}/s).")
+
+    if any(result.failed for result in results):
+        print("\tAPI call failed too many times. Try again later.")
+        exit(1)
+
+    done: Dict[str, int] = {result.name: result.done for result in results}
+    print(f"\tAdded a total of {done['add_ips']} {changes.provider} IPs.")
+    if changes.add_sources:
+        print("\tAdded a total of " + str(done['add_sources']) + " S3 buckets.")
+
+journal.finish()
+async_api.close()
+stats = api.connection_stats()
+print(f"\t{stats['requests']} API requests over {stats['connections']} connections ({stats['reused']} reused).")
+for (endpoint, retries) in default_policy.summary().items():
+    print(f"\t{endpoint}: {retries['retries']} retries ({retries['waited']}s waited), {retries['failures']} failures.")
+api.close()
 print("Done.")
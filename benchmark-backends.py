@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+import time
+from argparse import ArgumentParser
+from typing import Dict, List
+from bitdiscovery.backends import BACKENDS
+from bitdiscovery.cloud import get_provider
+
+parser = ArgumentParser(description="Compare how fast the cli and sdk backends read your cloud provider IPs.")
+parser.add_argument('cloudprovider', metavar="PROVIDER", type=str, choices=['amazon-ec2', 'google-cloud', 'azure'],
+                    help="The cloud provider to read, either amazon-ec2, google-cloud or azure.")
+parser.add_argument('--repeat', type=int, default=3, help="The number of runs per backend (by default 3).")
+parser.add_argument('--backend', choices=BACKENDS, action='append',
+                    help="A backend to benchmark, can be given more than once (by default every backend).")
+args = parser.parse_args()
+
+CLOUD_PROVIDER: str = args.cloudprovider
+REPEAT: int = args.repeat
+SELECTED: List[str] = args.backend or BACKENDS
+
+results: Dict[str, Dict[str, int]] = {}
+for backend in SELECTED:
+    print(f"Benchmarking the {backend} backend.")
+    provider = get_provider(CLOUD_PROVIDER, backend)
+    timings: List[float] = []
+    for i in range(REPEAT):
+        start = time.monotonic()
+        results[backend] = provider.get_instance_ips()
+        timings.append(time.monotonic() - start)
+
+    print(f"\t{len(results[backend])} IPs, best {min(timings):.2f}s, mean {sum(timings) / len(timings):.2f}s.")
+
+# The backends should agree on the IPs they found
+if len(results) > 1:
+    found = [set(ips) for ips in results.values()]
+    if all(ips == found[0] for ips in found):
+        print("Every backend found the same IPs.")
+    else:
+        for backend in results:
+            others = set().union(*[set(results[other]) for other in results if other != backend])
+            print(f"Only found by {backend}: {', '.join(sorted(set(results[backend]) - others)) or '-'}")
@@ -1,26 +1,38 @@
+import json
+import threading
 import requests
-from typing import Any, Callable, Dict, Optional, List
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from bitdiscovery.ratelimit import RateLimiter
+from bitdiscovery.retry import HttpStatusError, RetryPolicy, default_policy, endpoint_name, parse_retry_after
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, List, Set, Tuple
 
 
-def try_multiple_times(fn: Callable[..., Any], max_tries: int) -> Optional[Any]:
+# The statuses of a request with invalid data, e.g. an ID that can't be archived
+REJECTED_STATUSES: Tuple[int, ...] = (400, 422)
+
+
+class ApiError(Exception):
+    """
+    Raised when an API call keeps failing after every retry.
+    """
+    pass
+
+
+def try_multiple_times(fn: Callable[..., Any], max_tries: int, policy: Optional[RetryPolicy] = None) -> Optional[Any]:
     """
-    Retry a function multiple times if it fails.
+    Retry a function multiple times if it fails, backing off between tries (see RetryPolicy).
 
     :param fn: The function to run (it should return on success, throw on failure)
     :param max_tries: The number of times after failure is registered, and None returned.
+    :param policy: The retry policy to use, by default the one shared by the whole process.
     :return: Either the returned value on success, or None on failure.
     """
-    result = None
-    i = 0
-    while result is None and i < max_tries:
-        try:
-            result = fn()
-        except Exception as e:
-            print("ERROR: " + str(e))
-            result = None
-        i += 1
-
-    return result
+    try:
+        return (policy if policy is not None else default_policy).call(fn, max_tries)
+    except Exception as e:
+        print("ERROR: " + str(e))
+        return None
 
 
 def get_lastid(assets: Dict[str, List[Dict[str, str]]]) -> str:
@@ -41,86 +53,306 @@ def get_lastid(assets: Dict[str, List[Dict[str, str]]]) -> str:
 class BitDiscoveryApi:
     """
     Initializes an object to call the Bit Discovery API with a base URL and API key.
+
+    Every call goes through one pooled keep-alive session, so pages and writes reuse open connections instead of
+    paying a new TCP and TLS handshake each. Use it as a context manager (or call close) to release the pool.
     """
     apiurl: str
     apikey: str
+    timeout: Tuple[float, float]
+    session: requests.Session
+    requests_sent: int
+    rate_limiter: Optional[RateLimiter]
 
-    def __init__(self, apiurl: str, apikey: str):
+    def __init__(self, apiurl: str, apikey: str, pool_size: int = 10, timeout: Tuple[float, float] = (10.0, 120.0),
+                 keep_alive: bool = True, compress: bool = True, rate_limiter: Optional[RateLimiter] = None):
+        """
+        :param apiurl: The base URL of the API.
+        :param apikey: The inventory API key.
+        :param pool_size: The number of connections kept open to the API host.
+        :param timeout: The (connect, read) timeouts in seconds for every request.
+        :param keep_alive: Whether connections are kept open between requests.
+        :param compress: Whether to negotiate gzip compressed responses.
+        :param rate_limiter: The read and write budget of the API key (None for unlimited).
+        """
         self.apiurl = apiurl
         self.apikey = apikey
+        self.timeout = timeout
+        self.requests_sent = 0
+        self.rate_limiter = rate_limiter
+        self._counter_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate' if compress else 'identity',
+            'Authorization': self.apikey,
+            'Connection': 'keep-alive' if keep_alive else 'close',
+        })
+
+    def __enter__(self) -> 'BitDiscoveryApi':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close every pooled connection.
+        """
+        self.session.close()
+
+    def connection_stats(self) -> Dict[str, int]:
+        """
+        Count the requests sent and the connections opened, to confirm connections are being reused.
+
+        :return: a dictionary with the requests, connections and reused counts.
+        """
+        connections = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+        return {
+            'requests': self.requests_sent,
+            'connections': connections,
+            'reused': max(self.requests_sent - connections, 0),
+        }
+
+    def _request(self, method: str, path: str, data: Optional[str] = None, kind: str = 'read') -> requests.Response:
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(kind)
+        headers = {'Content-Type': 'application/json'} if method == 'POST' else None
+        with self._counter_lock:
+            self.requests_sent += 1
+        r = self.session.request(method, f'{self.apiurl}{path}', data=data, headers=headers, timeout=self.timeout)
+        if r.status_code >= 400:
+            raise HttpStatusError(r.status_code, endpoint_name(path), parse_retry_after(r.headers.get('Retry-After')))
+        return r
+
+    def _iter_pages(self, fetch: Callable[[str], Dict[str, Any]], key: str, after: str, limit: int,
+                    offset_cursor: bool, on_page: Optional[Callable[[str, int, int], None]],
+                    max_tries: int) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the records of every page one by one, while the next page is already being fetched in the background.
+
+        :param fetch: Fetches one page by its cursor.
+        :param key: The key of the record list in the page.
+        :param after: The cursor to start from ('' for the first page).
+        :param limit: The page size, a shorter page is the last one of an ID cursor.
+        :param offset_cursor: Whether the cursor is the numeric offset (True) or the last asset ID (False).
+        :param on_page: Called with (next cursor, offset, total) once every record of a page was consumed, the total
+                        is 0 when the progress isn't known.
+        :param max_tries: The number of tries for each page.
+        """
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = executor.submit(try_multiple_times, lambda cursor=after: fetch(cursor), max_tries)
+            # The total counts every record, so the progress of an ID cursor is only known when it starts from the
+            # beginning, as the number of records before a resumed cursor isn't
+            known_progress = offset_cursor or after == ''
+            offset = int(after) if offset_cursor and after != '' else 0
+            total: Optional[int] = None
+            while True:
+                page: Optional[Dict[str, Any]] = future.result()
+                if page is None:
+                    raise ApiError("API call failed too many times.")
+
+                if total is None:
+                    total = int(page.get('total', 0)) if known_progress else 0
+                records: List[Dict[str, Any]] = page.get(key, [])
+                offset += len(records)
+                if offset_cursor:
+                    # The server may return fewer records than asked for, the next page starts after the last one
+                    after = str(offset)
+                    more = offset < total and len(records) > 0
+                else:
+                    after = get_lastid(page)
+                    more = len(records) >= limit and after != ''
+
+                # Prefetch the next page while the caller works through this one
+                if more:
+                    future = executor.submit(try_multiple_times, lambda cursor=after: fetch(cursor), max_tries)
+
+                for record in records:
+                    yield record
+
+                if on_page is not None:
+                    on_page(after, min(offset, total) if total else offset, total)
+                if not more:
+                    break
+        finally:
+            executor.shutdown(wait=False)
+
+    def iter_inventory(self, limit: int, after: str = '', on_page: Optional[Callable[[str, int, int], None]] = None,
+                       max_tries: int = 5) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over every asset in the inventory, one page in memory at a time.
+
+        :param limit: The page size.
+        :param after: The asset ID to continue after ('' to start from the beginning).
+        :param on_page: Called with (next cursor, offset, total) once every asset of a page was consumed (total 0 when
+                        continuing after an ID).
+        :param max_tries: The number of tries for each page, ApiError is raised when all fail.
+        :return: an iterator of assets.
+        """
+        return self._iter_pages(lambda cursor: self.search_inventory(limit, cursor), 'assets', after, limit, False,
+                                on_page, max_tries)
+
+    def iter_sources(self, limit: int, search: str = '', after: str = '',
+                     on_page: Optional[Callable[[str, int, int], None]] = None,
+                     max_tries: int = 5) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over every source matching the search, one page in memory at a time.
+
+        :param limit: The page size.
+        :param search: The search keyword ('' for every source).
+        :param after: The offset to continue from ('' to start from the beginning).
+        :param on_page: Called with (next cursor, offset, total) once every source of a page was consumed.
+        :param max_tries: The number of tries for each page, ApiError is raised when all fail.
+        :return: an iterator of sources.
+        """
+        return self._iter_pages(lambda cursor: self.search_for_source(limit, cursor, search), 'searches', after,
+                                limit, True, on_page, max_tries)
+
+    def iter_ip_matches(self, ip: str, limit: int, after: str = '',
+                        on_page: Optional[Callable[[str, int, int], None]] = None,
+                        max_tries: int = 5) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the assets with exactly the given IP address, one page in memory at a time.
+
+        :param ip: The IP address to look for.
+        :param limit: The page size.
+        :param after: The asset ID to continue after ('' to start from the beginning).
+        :param on_page: Called with (next cursor, offset, total) once every asset of a page was consumed (total 0 when
+                        continuing after an ID).
+        :param max_tries: The number of tries for each page, ApiError is raised when all fail.
+        :return: an iterator of assets with id and bd.ip_address.
+        """
+        assets = self._iter_pages(lambda cursor: self.search_for_ip_address(limit, cursor, ip), 'assets', after,
+                                  limit, False, on_page, max_tries)
+        return (asset for asset in assets if str(asset.get('bd.ip_address', '')) == ip)
 
     def find_inventories(self, offset: int, limit: int) -> Dict[str, Any]:
-        url = f'{self.apiurl}/inventories/list?offset={str(offset)}&limit={str(limit)}&forcescreenshots=false'
-        headers = {'Accept': 'application/json', 'Authorization': self.apikey}
-        r = requests.get(url, headers=headers)
+        r = self._request('GET', f'/inventories/list?offset={str(offset)}&limit={str(limit)}&forcescreenshots=false')
         return r.json()
 
     def get_dashboard(self, querytypes: str) -> Dict[str, Any]:
-        url = f'{self.apiurl}/dashboard?columns={str(querytypes)}'
         payload = '[ { "column": "bd.original_hostname", "type": "ends with", "value": "" } ]'
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Authorization': self.apikey}
-
-        r = requests.post(url, data=payload, headers=headers)
+        r = self._request('POST', f'/dashboard?columns={str(querytypes)}', payload)
         return r.json()
 
     def search_inventory(self, limit: int, after: str) -> Dict[str, Any]:
         payload = '[ { "column": "bd.original_hostname", "type": "ends with", "value": "" } ]'
 
         if after == '':
-            url = f'{self.apiurl}/inventory?limit={str(limit)}&offset=0&sortorder=true&inventory=false'
+            path = f'/inventory?limit={str(limit)}&offset=0&sortorder=true&inventory=false'
         else:
-            url = f'{self.apiurl}/inventory?limit={str(limit)}&after={str(after)}&sortorder=true&inventory=false'
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Authorization': self.apikey}
+            path = f'/inventory?limit={str(limit)}&after={str(after)}&sortorder=true&inventory=false'
 
-        r = requests.post(url, data=payload, headers=headers)
+        r = self._request('POST', path, payload)
         return r.json()
 
     def search_for_ip_address(self, limit: int, after: str, ip: str) -> Dict[str, Any]:
         payload = '[ {"column": "bd.ip_address", "type": "is", "value": "' + str(ip) + '" } ]'
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Authorization': self.apikey}
 
         if after == '':
-            url = f'{self.apiurl}/inventory?limit={limit}&sortorder=true&columns=id,bd.ip_address'
+            path = f'/inventory?limit={limit}&sortorder=true&columns=id,bd.ip_address'
         else:
-            url = f'{self.apiurl}/inventory?limit={limit}&after={after}&sortorder=true&columns=id,bd.ip_address'
+            path = f'/inventory?limit={limit}&after={after}&sortorder=true&columns=id,bd.ip_address'
 
-        r = requests.post(url, data=payload, headers=headers)
+        r = self._request('POST', path, payload)
         return r.json()
 
     def search_for_source(self, limit: int, after: str, search: str) -> Dict[str, Any]:
-        headers = {'Accept': 'application/json', 'Authorization': self.apikey}
-
         if after == '':
-            url = f'{self.apiurl}/sources?offset=0&limit={limit}&search={search}'
+            path = f'/sources?offset=0&limit={limit}&search={search}'
         else:
-            url = f'{self.apiurl}/sources?offset=0&offset={after}&limit={limit}&search={search}'
+            path = f'/sources?offset=0&offset={after}&limit={limit}&search={search}'
 
-        r = requests.get(url, headers=headers)
+        r = self._request('GET', path)
         return r.json()
 
     def add_ip(self, new_ip: str) -> bool:
         payload = '{ "ip": "' + str(new_ip) + '" }'
-        url = f'{self.apiurl}/source/ip/add'
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Authorization': self.apikey}
-        requests.post(url, data=payload, headers=headers)
+        self._request('POST', '/source/ip/add', payload, kind='write')
         return True
 
     def add_source(self, new_source: str) -> bool:
         payload = '{ "keyword": "' + str(new_source) + '" }'
-        url = f'{self.apiurl}/source/add?as_subdomain=true&dont_discover=true'
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Authorization': self.apikey}
-        requests.post(url, data=payload, headers=headers)
+        self._request('POST', '/source/add?as_subdomain=true&dont_discover=true', payload, kind='write')
         return True
 
     def archive_ip(self, old_id: str) -> bool:
         payload = '[ {"id": "' + old_id + '", "hidden": true } ]'
-        url = f'{self.apiurl}/asset/hide'
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Authorization': self.apikey}
-        requests.post(url, data=payload, headers=headers)
+        self._request('POST', '/asset/hide', payload, kind='write')
         return True
 
+    def _archive_batch(self, ids: List[str], max_tries: int) -> List[str]:
+        # Archive the batch in one request, and if the server rejects it split it in halves to find the failing IDs
+        payload = json.dumps([{'id': old_id, 'hidden': True} for old_id in ids])
+        try:
+            default_policy.call(lambda: self._request('POST', '/asset/hide', payload, kind='write'), max_tries)
+            return []
+        except Exception as e:
+            print("ERROR: " + str(e))
+            # Only a rejected ID is worth looking for, outages or an invalid API key would fail every half the same way
+            if len(ids) == 1 or not isinstance(e, HttpStatusError) or e.status not in REJECTED_STATUSES:
+                return ids
+        half = len(ids) // 2
+        return self._archive_batch(ids[:half], max_tries) + self._archive_batch(ids[half:], max_tries)
+
+    def archive_assets(self, ids: Iterable[str], batch_size: int = 100, workers: int = 1, max_tries: int = 5,
+                       on_batch: Optional[Callable[[List[str], List[str]], None]] = None) -> Tuple[int, List[str]]:
+        """
+        Archive many assets with one request per batch. The IDs are consumed lazily, so batches are sent while an
+        iterator (e.g. iter_ip_matches) is still paginating.
+
+        :param ids: The IDs of the assets to archive.
+        :param batch_size: The number of assets in one request.
+        :param workers: The number of batches sent at the same time.
+        :param max_tries: The number of tries for each request.
+        :param on_batch: Called with the IDs of every finished batch and those of them that failed.
+        :return: the number of archived assets, and the IDs that could not be archived.
+        """
+        archived = 0
+        failed: List[str] = []
+        pending: Set[Future] = set()
+
+        def collect(done: Iterable[Future]):
+            nonlocal archived
+            for future in done:
+                (batch, batch_failed) = future.result()
+                archived += len(batch) - len(batch_failed)
+                failed.extend(batch_failed)
+                if on_batch is not None:
+                    on_batch(batch, batch_failed)
+
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        try:
+            batch: List[str] = []
+            for old_id in ids:
+                batch.append(str(old_id))
+                if len(batch) < batch_size:
+                    continue
+                # Only keep a couple of batches queued, so a fast iterator doesn't buffer every ID in memory
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(lambda b=batch: (b, self._archive_batch(b, max_tries))))
+                batch = []
+            if batch:
+                pending.add(executor.submit(lambda b=batch: (b, self._archive_batch(b, max_tries))))
+            collect(wait(pending).done)
+        finally:
+            executor.shutdown(wait=True)
+        return archived, failed
+
     def delete_source(self, old_source_id: str) -> bool:
-        url = f'{self.apiurl}/source/{old_source_id}/delete'
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Authorization': self.apikey}
-        requests.post(url, headers=headers)
+        self._request('POST', f'/source/{old_source_id}/delete', kind='write')
         return True
@@ -0,0 +1,144 @@
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+from bitdiscovery.api import BitDiscoveryApi, try_multiple_times
+
+T = TypeVar('T')
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """
+    Run a coroutine to completion from synchronous code on a fresh event loop.
+
+    :param coro: The coroutine to run.
+    :return: The value returned by the coroutine.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class AsyncBitDiscoveryApi:
+    """
+    Asyncio counterpart of BitDiscoveryApi that runs up to `concurrency` calls at once.
+
+    The calls are dispatched to the pooled synchronous client on a worker thread each, so the wrapped client should
+    be created with a pool_size of at least `concurrency`.
+    """
+    api: BitDiscoveryApi
+    concurrency: int
+
+    def __init__(self, api: BitDiscoveryApi, concurrency: int = 10):
+        self.api = api
+        self.concurrency = max(1, concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def close(self) -> None:
+        """
+        Stop the worker threads (the wrapped client stays open).
+        """
+        self._executor.shutdown(wait=True)
+
+    async def _call(self, fn: Callable[..., T], *args: Any) -> T:
+        # The semaphore is bound to the loop it is used in, so every new loop (see run_sync) gets its own
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        async with self._semaphore:
+            return await loop.run_in_executor(self._executor, lambda: fn(*args))
+
+    async def _iter(self, records: Iterator[Dict[str, Any]], chunk: int) -> AsyncIterator[Dict[str, Any]]:
+        # The synchronous iterator is advanced on a worker thread about a page at a time, so its requests don't block
+        # the event loop
+        while True:
+            taken: List[Dict[str, Any]] = await self._call(lambda: list(itertools.islice(records, chunk)))
+            if not taken:
+                return
+            for record in taken:
+                yield record
+
+    async def map(self, fn: Callable[[str], T], values: Iterable[str], max_tries: int = 5,
+                  on_result: Optional[Callable[[str, Optional[T]], None]] = None) -> Dict[str, Optional[T]]:
+        """
+        Call a client method once per value concurrently, retrying each call with try_multiple_times.
+
+        :param fn: The client method to call, e.g. api.add_ip.
+        :param values: The values to call it with (duplicates are only called once).
+        :param max_tries: The number of tries for each call.
+        :param on_result: Called with every value and its result as soon as its call finished.
+        :return: a dictionary of every value and its result, which is None if every try failed.
+        """
+        async def call(value: str) -> Optional[T]:
+            result = await self._call(try_multiple_times, (lambda: fn(value)), max_tries)
+            if on_result is not None:
+                on_result(value, result)
+            return result
+
+        keys = list(dict.fromkeys(values))
+        results = await asyncio.gather(*[call(value) for value in keys])
+        return dict(zip(keys, results))
+
+    def iter_inventory(self, limit: int, after: str = '', on_page: Optional[Callable[[str, int, int], None]] = None,
+                       max_tries: int = 5) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Iterate over every asset in the inventory (see BitDiscoveryApi.iter_inventory).
+        """
+        return self._iter(self.api.iter_inventory(limit, after, on_page, max_tries), limit)
+
+    def iter_sources(self, limit: int, search: str = '', after: str = '',
+                     on_page: Optional[Callable[[str, int, int], None]] = None,
+                     max_tries: int = 5) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Iterate over every source matching the search (see BitDiscoveryApi.iter_sources).
+        """
+        return self._iter(self.api.iter_sources(limit, search, after, on_page, max_tries), limit)
+
+    def iter_ip_matches(self, ip: str, limit: int, after: str = '',
+                        on_page: Optional[Callable[[str, int, int], None]] = None,
+                        max_tries: int = 5) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Iterate over the assets with exactly the given IP address (see BitDiscoveryApi.iter_ip_matches).
+        """
+        return self._iter(self.api.iter_ip_matches(ip, limit, after, on_page, max_tries), limit)
+
+    async def find_inventories(self, offset: int, limit: int) -> Dict[str, Any]:
+        return await self._call(self.api.find_inventories, offset, limit)
+
+    async def get_dashboard(self, querytypes: str) -> Dict[str, Any]:
+        return await self._call(self.api.get_dashboard, querytypes)
+
+    async def search_inventory(self, limit: int, after: str) -> Dict[str, Any]:
+        return await self._call(self.api.search_inventory, limit, after)
+
+    async def search_for_ip_address(self, limit: int, after: str, ip: str) -> Dict[str, Any]:
+        return await self._call(self.api.search_for_ip_address, limit, after, ip)
+
+    async def search_for_source(self, limit: int, after: str, search: str) -> Dict[str, Any]:
+        return await self._call(self.api.search_for_source, limit, after, search)
+
+    async def add_ip(self, new_ip: str) -> bool:
+        return await self._call(self.api.add_ip, new_ip)
+
+    async def add_source(self, new_source: str) -> bool:
+        return await self._call(self.api.add_source, new_source)
+
+    async def archive_ip(self, old_id: str) -> bool:
+        return await self._call(self.api.archive_ip, old_id)
+
+    async def archive_assets(self, ids: Iterable[str], batch_size: int = 100, workers: int = 1, max_tries: int = 5,
+                             on_batch: Optional[Callable[..., None]] = None) -> Tuple[int, List[str]]:
+        """
+        Archive many assets with one request per batch (see BitDiscoveryApi.archive_assets), on_batch is called from
+        a worker thread.
+        """
+        return await self._call(self.api.archive_assets, ids, batch_size, workers, max_tries, on_batch)
+
+    async def delete_source(self, old_source_id: str) -> bool:
+        return await self._call(self.api.delete_source, old_source_id)
+
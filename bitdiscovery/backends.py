@@ -0,0 +1,333 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+# The backends a provider can use: 'cli' shells out to the provider's command-line tool, 'sdk' calls the provider's
+# Python SDK in-process (the SDK packages are only imported when the backend is chosen)
+BACKENDS: List[str] = ['cli', 'sdk']
+
+_sh_lock = threading.Lock()
+
+
+def sh_command(name: str) -> Any:
+    """
+    Returns a command of the sh package. The import is locked, as the import hook of sh isn't thread safe and the
+    CLI backends are called from worker threads.
+    """
+    with _sh_lock:
+        import sh
+        return sh.Command(name)
+
+
+class AWSCliBackend:
+    """
+    Reads AWS through the AWS CLI.
+    """
+
+    def __init__(self, profile: Optional[str] = None):
+        """
+        :param profile: The AWS CLI profile to use, by default the default profile.
+        """
+        self.profile = profile
+        self.options: List[str] = ['--profile', profile] if profile else []
+
+    def regions(self) -> List[str]:
+        aws = sh_command('aws')
+        cmd = aws('ec2', 'describe-regions', '--output', 'json', *self.options)
+        regions: Dict[str, List[Dict[str, str]]] = json.loads(str(cmd))
+        return [r['RegionName'] for r in regions['Regions']]
+
+    def elastic_ips(self, region: str) -> Dict[str, int]:
+        aws = sh_command('aws')
+        ips: Dict[str, int] = {}
+        cmd = aws('ec2', 'describe-addresses', '--region', region, '--output', 'json', *self.options)
+        iplist: Dict[str, List[Dict[str, str]]] = json.loads(str(cmd))
+        for addresses in iplist['Addresses']:
+            ips[addresses['PublicIp']] = 1
+        return ips
+
+    def dynamic_ips(self, region: str) -> Dict[str, int]:
+        aws = sh_command('aws')
+        ips: Dict[str, int] = {}
+        cmd = aws('ec2', 'describe-instances', '--region', region, '--query',
+                  'Reservations[*].Instances[*].[PublicIpAddress]', '--output', 'json', *self.options)
+        iplist: List[List[List[str]]] = json.loads(str(cmd))
+        # This is required to unravel the list within list within list that AWS responds with
+        for innerlist in iplist:
+            for theips in innerlist:
+                # Stopped instances have no public IP
+                if theips[0]:
+                    ips[theips[0]] = 1
+        return ips
+
+    def s3_buckets(self) -> Dict[str, int]:
+        aws = sh_command('aws')
+        buckets = {}
+        cmd = aws('s3api', 'list-buckets', '--query', "Buckets[].Name", '--output', 'json', *self.options)
+        bucketjson: List[str] = json.loads(str(cmd))
+        for i in bucketjson:
+            buckets[i] = 1
+        return buckets
+
+    def s3_bucket_region(self, bucket: str) -> Optional[str]:
+        aws = sh_command('aws')
+        cmd = aws('s3api', 'get-bucket-location', '--bucket', str(bucket), '--output', 'json', *self.options)
+        regs: Dict[str, Optional[str]] = json.loads(str(cmd))
+        return regs['LocationConstraint']
+
+    def account(self) -> str:
+        aws = sh_command('aws')
+        cmd = aws('sts', 'get-caller-identity', '--output', 'json', *self.options)
+        acc: Dict[str, str] = json.loads(str(cmd))
+        return str(acc['Account'])
+
+
+class AWSSdkBackend:
+    """
+    Reads AWS in-process through boto3, with one pooled client per region and service.
+    """
+
+    def __init__(self, session: Any = None, max_pool_connections: int = 16, profile: Optional[str] = None):
+        """
+        :param session: The boto3 session to use (e.g. for mocks), by default a new one.
+        :param max_pool_connections: The connection pool size of every client.
+        :param profile: The AWS profile of the new session, by default the default profile.
+        """
+        import boto3
+        from botocore.config import Config
+        self.session = session if session is not None else boto3.session.Session(profile_name=profile)
+        self.config = Config(max_pool_connections=max_pool_connections, retries={'mode': 'adaptive'})
+        self._clients: Dict[Any, Any] = {}
+        # boto3 sessions aren't thread safe, but the clients made from them are
+        self._lock = threading.Lock()
+
+    def client(self, service: str, region: Optional[str] = None) -> Any:
+        with self._lock:
+            if (service, region) not in self._clients:
+                self._clients[(service, region)] = self.session.client(service, region_name=region,
+                                                                       config=self.config)
+            return self._clients[(service, region)]
+
+    def regions(self) -> List[str]:
+        regions = self.client('ec2', self.session.region_name or 'us-east-1').describe_regions()
+        return [r['RegionName'] for r in regions['Regions']]
+
+    def elastic_ips(self, region: str) -> Dict[str, int]:
+        addresses = self.client('ec2', region).describe_addresses()
+        return {address['PublicIp']: 1 for address in addresses['Addresses'] if 'PublicIp' in address}
+
+    def dynamic_ips(self, region: str) -> Dict[str, int]:
+        ips: Dict[str, int] = {}
+        paginator = self.client('ec2', region).get_paginator('describe_instances')
+        for page in paginator.paginate():
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    if instance.get('PublicIpAddress'):
+                        ips[instance['PublicIpAddress']] = 1
+        return ips
+
+    def s3_buckets(self) -> Dict[str, int]:
+        return {bucket['Name']: 1 for bucket in self.client('s3').list_buckets()['Buckets']}
+
+    def s3_bucket_region(self, bucket: str) -> Optional[str]:
+        return self.client('s3').get_bucket_location(Bucket=bucket)['LocationConstraint']
+
+    def account(self) -> str:
+        return str(self.client('sts').get_caller_identity()['Account'])
+
+
+def is_external(scheme: str) -> bool:
+    """
+    Whether a Google Cloud load balancing scheme has a public address (EXTERNAL and EXTERNAL_MANAGED).
+    """
+    return not scheme or scheme.startswith('EXTERNAL')
+
+
+class GoogleCloudCliBackend:
+    """
+    Reads Google Cloud through the gcloud CLI, as JSON.
+    """
+
+    def __init__(self, project: Optional[str] = None):
+        """
+        :param project: The project to read, by default every project the credentials can list.
+        """
+        self.project = project
+
+    def projects(self) -> List[str]:
+        if self.project:
+            return [self.project]
+        gcloud = sh_command('gcloud')
+        cmd = gcloud('projects', 'list', '--format=json(projectId)')
+        return [project['projectId'] for project in json.loads(str(cmd))]
+
+    def list(self, project: str, resource: str) -> List[Dict[str, Any]]:
+        gcloud = sh_command('gcloud')
+        cmd = gcloud('compute', resource, 'list', '--project', project, '--format=json')
+        return json.loads(str(cmd))
+
+    def project_ips(self, project: str) -> Dict[str, int]:
+        """
+        Returns the external IPv4 and IPv6 addresses of the instances (every network interface), the forwarding rules
+        and the reserved addresses of a project.
+        """
+        ips: Dict[str, int] = {}
+        for instance in self.list(project, 'instances'):
+            for interface in instance.get('networkInterfaces', []):
+                for config in interface.get('accessConfigs', []):
+                    if config.get('natIP'):
+                        ips[config['natIP']] = 1
+                for config in interface.get('ipv6AccessConfigs', []):
+                    if config.get('externalIpv6'):
+                        ips[config['externalIpv6']] = 1
+        for rule in self.list(project, 'forwarding-rules'):
+            if rule.get('IPAddress') and is_external(rule.get('loadBalancingScheme', '')):
+                ips[rule['IPAddress'].split('/')[0]] = 1
+        for address in self.list(project, 'addresses'):
+            if address.get('address') and address.get('addressType', 'EXTERNAL') == 'EXTERNAL':
+                ips[address['address']] = 1
+        return ips
+
+
+class GoogleCloudSdkBackend:
+    """
+    Reads Google Cloud in-process through the google-cloud-compute package, using the default credentials.
+    """
+
+    def __init__(self, project: Optional[str] = None):
+        """
+        :param project: The project to read, by default every project the credentials can find (with the
+                        google-cloud-resource-manager package, otherwise the project of the default credentials).
+        """
+        import google.auth
+        from google.cloud import compute_v1
+        (self.credentials, self.default_project) = google.auth.default()
+        self.project = project
+        self.instances = compute_v1.InstancesClient(credentials=self.credentials)
+        self.forwarding_rules = compute_v1.ForwardingRulesClient(credentials=self.credentials)
+        self.global_forwarding_rules = compute_v1.GlobalForwardingRulesClient(credentials=self.credentials)
+        self.addresses = compute_v1.AddressesClient(credentials=self.credentials)
+        self.global_addresses = compute_v1.GlobalAddressesClient(credentials=self.credentials)
+
+    def projects(self) -> List[str]:
+        if self.project:
+            return [self.project]
+        try:
+            from google.cloud import resourcemanager_v3
+        except ImportError:
+            return [self.default_project]
+        client = resourcemanager_v3.ProjectsClient(credentials=self.credentials)
+        return [project.project_id for project in client.search_projects(request={'query': 'state:ACTIVE'})]
+
+    def project_ips(self, project: str) -> Dict[str, int]:
+        """
+        Returns the external IPv4 and IPv6 addresses of the instances (every network interface), the forwarding rules
+        and the reserved addresses of a project.
+        """
+        ips: Dict[str, int] = {}
+        # The aggregated lists page through every region and zone
+        for (_, scoped) in self.instances.aggregated_list(project=project):
+            for instance in scoped.instances:
+                for interface in instance.network_interfaces:
+                    for config in interface.access_configs:
+                        if config.nat_i_p:
+                            ips[config.nat_i_p] = 1
+                    for config in interface.ipv6_access_configs:
+                        if config.external_ipv6:
+                            ips[config.external_ipv6] = 1
+
+        rules = [rule for (_, scoped) in self.forwarding_rules.aggregated_list(project=project)
+                 for rule in scoped.forwarding_rules]
+        for rule in rules + list(self.global_forwarding_rules.list(project=project)):
+            if rule.I_p_address and is_external(rule.load_balancing_scheme):
+                ips[rule.I_p_address.split('/')[0]] = 1
+
+        addresses = [address for (_, scoped) in self.addresses.aggregated_list(project=project)
+                     for address in scoped.addresses]
+        for address in addresses + list(self.global_addresses.list(project=project)):
+            if address.address and address.address_type == 'EXTERNAL':
+                ips[address.address] = 1
+        return ips
+
+
+class AzureCliBackend:
+    """
+    Reads Azure through the az CLI.
+    """
+
+    def __init__(self, subscription: Optional[str] = None):
+        """
+        :param subscription: The subscription to read, by default every enabled subscription.
+        """
+        self.subscription = subscription
+
+    def subscriptions(self) -> List[str]:
+        if self.subscription:
+            return [self.subscription]
+        az = sh_command('az')
+        cmd = az('account', 'list', '--query', "[?state=='Enabled'].id", '--output', 'tsv')
+        return [line.strip() for line in str(cmd).splitlines() if line.strip()]
+
+    def subscription_ips(self, subscription: str) -> Dict[str, int]:
+        """
+        Returns the addresses of the public IP resources of a subscription, which VMs and load balancers get their
+        public IPs from. The output is read line by line as az writes it, so large subscriptions aren't buffered.
+        """
+        az = sh_command('az')
+        ips: Dict[str, int] = {}
+        for line in az('network', 'public-ip', 'list', '--subscription', subscription, '--query', '[].ipAddress',
+                       '--output', 'tsv', _iter=True, _bg_exc=False):
+            # Unallocated dynamic IPs have an empty address
+            ip = line.strip()
+            if ip:
+                ips[ip] = 1
+        return ips
+
+
+class AzureSdkBackend:
+    """
+    Reads Azure in-process through the azure-mgmt-network package, using the default credentials.
+    """
+
+    def __init__(self, subscription: Optional[str] = None):
+        """
+        :param subscription: The subscription to read, by default $AZURE_SUBSCRIPTION_ID or every enabled
+                             subscription.
+        """
+        from azure.identity import DefaultAzureCredential
+        self.credential = DefaultAzureCredential()
+        self.subscription = subscription or os.environ.get('AZURE_SUBSCRIPTION_ID')
+
+    def subscriptions(self) -> List[str]:
+        if self.subscription:
+            return [self.subscription]
+        from azure.mgmt.resource import SubscriptionClient
+        return [s.subscription_id for s in SubscriptionClient(self.credential).subscriptions.list()
+                if s.state == 'Enabled']
+
+    def subscription_ips(self, subscription: str) -> Dict[str, int]:
+        from azure.mgmt.network import NetworkManagementClient
+        client = NetworkManagementClient(self.credential, subscription)
+        # Public IP resources cover the addresses of VMs and load balancers alike, and the pager streams them
+        return {address.ip_address: 1 for address in client.public_ip_addresses.list_all() if address.ip_address}
+
+
+def get_backend(provider: str, backend: str = 'cli', account: Optional[str] = None) -> Any:
+    """
+    Returns the backend of a provider.
+
+    :param provider: the provider name, either 'amazon-ec2', 'google-cloud' or 'azure'
+    :param backend: the backend name, either 'cli' or 'sdk'
+    :param account: the AWS profile, Google Cloud project or Azure subscription to read, by default the default one
+    :return: a new backend object
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
+    if provider == 'amazon-ec2':
+        return AWSCliBackend(account) if backend == 'cli' else AWSSdkBackend(profile=account)
+    elif provider == 'google-cloud':
+        return GoogleCloudCliBackend(account) if backend == 'cli' else GoogleCloudSdkBackend(account)
+    elif provider == 'azure':
+        return AzureCliBackend(account) if backend == 'cli' else AzureSdkBackend(account)
+    raise ValueError(f"Unknown provider: {provider}")
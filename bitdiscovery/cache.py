@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+from typing import Any, Optional
+
+
+def default_cache_dir() -> str:
+    """
+    Returns the directory for the caches kept between runs: $BITDISCOVERY_CACHE_DIR, or bitdiscovery in the user's
+    cache directory.
+    """
+    if os.environ.get('BITDISCOVERY_CACHE_DIR'):
+        return os.environ['BITDISCOVERY_CACHE_DIR']
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'bitdiscovery')
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """
+    Write a file so that readers (and a crash half way through) only ever see the old or the new content.
+
+    :param path: The file to write, its directory is created if needed.
+    :param data: The new content.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    (fd, tmp) = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def load_json(path: str) -> Optional[Any]:
+    """
+    :return: the parsed JSON file, or None if it is missing or unreadable.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_json(path: str, data: Any) -> None:
+    write_atomic(path, json.dumps(data, separators=(',', ':')).encode())
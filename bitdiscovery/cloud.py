@@ -1,29 +1,29 @@
 import requests
 import json
-import urllib.request
-from typing import List, Dict, Callable
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Iterable, Iterator, List, Dict, Callable, Optional, Tuple
+from bitdiscovery.backends import get_backend
+from bitdiscovery.cache import default_cache_dir, load_json, save_json
+from bitdiscovery.feeds import RangeFeedCache, format_prefix
 
 
 # Attempts to remove any matches from a super set of all IPs and sources in Bit Discovery that are still correct
+# (kept for compatibility, bitdiscovery.reconcile.Reconciler also handles range sources)
 def remove_matches(superset: Dict[str, int], bit_discovery_ips: Dict[str, int], bit_discovery_sources: Dict[str, int],
                    cloud_ips: Dict[str, int]) -> (Dict[str, int], Dict[str, int]):
-    for theiplist in cloud_ips.copy().items():
-        # theiplist is basically just a two column list, and the first is the IP and the second is the source 1,2,3
-        ip = theiplist[0]
-        if ip in superset:
-            if superset[ip] == 1 or superset[ip] == 3:
-                del superset[ip]
-                del bit_discovery_ips[ip]
-                del cloud_ips[ip]
-            if superset[ip] == 2 or superset[ip] == 3:
-                del superset[ip]
-                del bit_discovery_sources[ip]
-                del cloud_ips[ip]
+    # The superset values are 1 for assets, 2 for sources and 3 for both
+    for ip in set(cloud_ips) & set(superset):
+        del superset[ip]
+        del cloud_ips[ip]
+        bit_discovery_ips.pop(ip, None)
+        bit_discovery_sources.pop(ip, None)
 
     old_ips = {}
     for ip in superset:
-        if ip not in cloud_ips:
-            old_ips[ip] = 1
+        old_ips[ip] = 1
 
     return cloud_ips, old_ips
 
@@ -34,6 +34,33 @@ class CloudProvider:
     """
     name: str
     sh: Callable
+    backend: Any
+    # The AWS profile, Google Cloud project or Azure subscription that is read, None for the default one
+    account: Optional[str] = None
+    # Set when the last read skipped a part of the account (e.g. a region) that failed
+    incomplete: bool = False
+    # The IP range feed cache, by default the one in the cache directory
+    feed_cache: Optional[RangeFeedCache] = None
+
+    @property
+    def label(self) -> str:
+        """
+        The name of the provider and the account, to tell accounts apart in the output.
+        """
+        return f"{self.name} ({self.account})" if self.account else self.name
+
+    def get_feed_cache(self) -> RangeFeedCache:
+        if self.feed_cache is None:
+            self.feed_cache = RangeFeedCache()
+        return self.feed_cache
+
+    def get_ip_prefixes(self) -> List[Tuple[int, int]]:
+        """
+        Retrieve every CIDR that a given cloud provider owns, from the cached range feed.
+
+        :return: a list of (network key, prefix length) pairs (see bitdiscovery.feeds).
+        """
+        return []
 
     def get_ip_ranges(self) -> Dict[str, int]:
         """
@@ -42,6 +69,8 @@ class CloudProvider:
         :return: a dictionary with the keys as the IPs.
         """
         prefixes = {}
+        for prefix in self.get_ip_prefixes():
+            prefixes[format_prefix(prefix)] = 1
         return prefixes
 
     def get_instance_ips(self) -> Dict[str, int]:
@@ -53,91 +82,194 @@ class CloudProvider:
         ips = {}
         return ips
 
+    def iter_instance_ips(self) -> Iterator[Dict[str, int]]:
+        """
+        Retrieve the same IPs as get_instance_ips, in parts as soon as each is read (e.g. one per project).
+
+        :return: an iterator of dictionaries with the keys as the IPs.
+        """
+        yield self.get_instance_ips()
+
+    def iter_parts(self, read: Callable[[str], Dict[str, int]], parts: List[str],
+                   max_workers: int) -> Iterator[Dict[str, int]]:
+        """
+        Read the parts of an account (e.g. projects) at the same time, and hand out the IPs of each as soon as it is
+        done. A failing part is reported and skipped, and marks the provider incomplete.
+
+        :param read: Reads the IPs of one part.
+        :param parts: The names of the parts.
+        :param max_workers: The number of parts read at the same time.
+        :return: an iterator of dictionaries with the keys as the IPs.
+        """
+        failed: List[str] = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(timed_call, read, part): part for part in parts}
+            for future in as_completed(futures):
+                part = futures[future]
+                (ipdict, seconds, error) = future.result()
+                if error is not None:
+                    print(f"\t\t\t{part} failed after {seconds:.1f}s: {error_line(error)}")
+                    failed.append(part)
+                    continue
+                print(f"\t\t\t{part}: {len(ipdict)} IPs in {seconds:.1f}s")
+                yield ipdict
+
+        self.incomplete = len(failed) > 0
+        if failed:
+            print(f"\t\t\tCouldn't read every IP from: {', '.join(sorted(failed))}")
+
+
+def timed_call(fn: Callable[..., Any], *args: Any) -> Tuple[Optional[Any], float, Optional[Exception]]:
+    """
+    Run a function, catching its error so one failing call in a worker pool doesn't stop the others.
+
+    :return: the result (None on failure), the seconds it took and the error (None on success).
+    """
+    start = time.monotonic()
+    try:
+        return fn(*args), time.monotonic() - start, None
+    except Exception as e:
+        return None, time.monotonic() - start, e
+
+
+def error_line(error: Exception) -> str:
+    """
+    Returns the first line of an error message (CLI errors include the whole output), or the error type.
+    """
+    lines = str(error).strip().splitlines()
+    return lines[0] if lines else type(error).__name__
+
+
+def s3_url(bucket: str, region: Optional[str]) -> str:
+    """
+    Returns the URL of an S3 bucket in a region, as reported by get-bucket-location.
+    """
+    # Buckets in us-east-1 have no location constraint, and the oldest eu-west-1 buckets report 'EU'
+    if not region:
+        region = 'us-east-1'
+    elif region == 'EU':
+        region = 'eu-west-1'
+    return str(bucket) + '.s3.' + str(region) + '.amazonaws.com'
+
+
+# Accounts read at the same time share the bucket region cache file
+s3_regions_lock = threading.Lock()
+
 
 class AWSProvider(CloudProvider):
-    def __init__(self):
+    max_workers: int
+
+    def __init__(self, max_workers: int = 16, backend: Any = 'cli', profile: Optional[str] = None):
+        """
+        :param max_workers: The number of AWS calls run at the same time.
+        :param backend: The backend name ('cli' or 'sdk'), or a backend object (see bitdiscovery.backends).
+        :param profile: The AWS profile to read, by default the default profile.
+        """
         self.name = "AWS"
+        self.account = profile
+        self.max_workers = max_workers
+        self.backend = get_backend('amazon-ec2', backend, profile) if isinstance(backend, str) else backend
 
-    def get_ip_ranges(self) -> Dict[str, int]:
-        prefixes = {}
-        url = 'https://ip-ranges.amazonaws.com/ip-ranges.json'
-        response = urllib.request.urlopen(url)
-        data = json.loads(response.read())
-        for ips in data['prefixes']:
-            prefixes[ips['ip_prefix']] = 1
-        return prefixes
+    def get_ip_prefixes(self) -> List[Tuple[int, int]]:
+        def parse(r: requests.Response) -> List[str]:
+            data = r.json()
+            return [ips['ip_prefix'] for ips in data['prefixes']] + \
+                   [ips['ipv6_prefix'] for ips in data.get('ipv6_prefixes', [])]
+
+        return self.get_feed_cache().fetch('aws', 'https://ip-ranges.amazonaws.com/ip-ranges.json', parse)
 
     # Finds all of Amazon's various regions
     def find_aws_regions(self) -> List[str]:
-        from sh import aws
-        cmd = aws('ec2', 'describe-regions', '--output', 'json')
-        regions: Dict[str, List[Dict[str, str]]] = json.loads(str(cmd))
-        return [r['RegionName'] for r in regions['Regions']]
+        return self.backend.regions()
 
     # Gets all of the Elastic (static) IPs from AWS
     def find_aws_elastic_ips(self, region: str) -> Dict[str, int]:
-        from sh import aws
-        ips: Dict[str, int] = {}
-        cmd = aws('ec2', 'describe-addresses', '--region', region, '--output', 'json')
-        iplist: Dict[str, List[Dict[str, str]]] = json.loads(str(cmd))
-        for addresses in iplist['Addresses']:
-            ips[addresses['PublicIp']] = 1
-        return ips
+        return self.backend.elastic_ips(region)
 
     # Gets all of the dynamic IPs from AWS's various regions
     def find_aws_dynamic_ips(self, region: str) -> Dict[str, int]:
-        from sh import aws
-        ips: Dict[str, int] = {}
-        cmd = aws('ec2', 'describe-instances', '--region', region, '--query',
-                  'Reservations[*].Instances[*].[PublicIpAddress]', '--output', 'json')
-        iplist: List[List[List[str]]] = json.loads(str(cmd))
-        # This is required to unravel the list within list within list that AWS responds with
-        for innerlist in iplist:
-            for theips in innerlist:
-                ips[theips[0]] = 1
-        return ips
+        return self.backend.dynamic_ips(region)
 
     def get_instance_ips(self) -> Dict[str, int]:
         regions = self.find_aws_regions()
         ips: Dict[str, int] = {}
-        for region in regions:
-            # First get dynamic IPs
-            print("\t\t\t" + str(region))
-            ipdict = self.find_aws_dynamic_ips(region)
-            for ip in ipdict:
-                ips[ip] = 1
-
-            # Then get elastic IPs
-            ipdict = self.find_aws_elastic_ips(region)
-            for ip in ipdict:
-                ips[ip] = 1
+        failed: List[str] = []
+
+        # Query the dynamic and the elastic IPs of every region at the same time
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            for region in regions:
+                futures[executor.submit(timed_call, self.find_aws_dynamic_ips, region)] = (region, 'dynamic')
+                futures[executor.submit(timed_call, self.find_aws_elastic_ips, region)] = (region, 'elastic')
+
+            for future in as_completed(futures):
+                (region, kind) = futures[future]
+                (ipdict, seconds, error) = future.result()
+                if error is not None:
+                    print(f"\t\t\t{region} ({kind}) failed after {seconds:.1f}s: {error_line(error)}")
+                    failed.append(region)
+                    continue
+                print(f"\t\t\t{region} ({kind}): {len(ipdict)} IPs in {seconds:.1f}s")
+                for ip in ipdict:
+                    ips[ip] = 1
+
+        self.incomplete = len(failed) > 0
+        if failed:
+            print(f"\t\t\tCouldn't read every IP from: {', '.join(sorted(set(failed)))}")
 
         return ips
 
     def find_s3_buckets(self) -> Dict[str, int]:
         """
-        Retrieve all running S3 buckets that the logged-in user owns (extracted from AWS CLI).
+        Retrieve all running S3 buckets that the logged-in user owns.
 
         :return: a dictionary with the buckets as keys.
         """
-        from sh import aws
-        buckets = {}
-        cmd = aws('s3api', 'list-buckets', '--query', "Buckets[].Name", '--output', 'json')
-        bucketjson: List[str] = json.loads(str(cmd))
-        for i in bucketjson:
-            buckets[i] = 1
-        return buckets
+        return self.backend.s3_buckets()
 
     def find_s3_region(self, bucket: str) -> str:
         """
-        Returns the URL for an S3 bucket (extracted from AWS CLI).
+        Returns the URL for an S3 bucket.
 
         :return: the URL string.
         """
-        from sh import aws
-        cmd = aws('s3api', 'get-bucket-location', '--bucket', str(bucket), '--output', 'json')
-        regs: Dict[str, str] = json.loads(str(cmd))
-        return str(bucket) + '.s3.' + str(regs['LocationConstraint']) + '.amazonaws.com'
+        return s3_url(bucket, self.backend.s3_bucket_region(bucket))
+
+    def find_s3_urls(self, buckets: Iterable[str], cache_path: Optional[str] = None) -> Dict[str, str]:
+        """
+        Returns the URLs of many S3 buckets. Bucket regions never change, so they are cached on disk and only new
+        buckets are looked up, at the same time.
+
+        :param buckets: The bucket names.
+        :param cache_path: The bucket region cache file, by default s3-regions.json in the cache directory.
+        :return: a dictionary with the buckets as keys and their URLs as values (failed lookups are left out).
+        """
+        buckets = list(buckets)
+        cache_path = cache_path or os.path.join(default_cache_dir(), 's3-regions.json')
+        with s3_regions_lock:
+            regions: Dict[str, Optional[str]] = load_json(cache_path) or {}
+        missing = [bucket for bucket in buckets if bucket not in regions]
+
+        if missing:
+            print(f"\t\t\tLooking up the region of {len(missing)} new buckets.")
+            found: Dict[str, Optional[str]] = {}
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(timed_call, self.backend.s3_bucket_region, bucket): bucket
+                           for bucket in missing}
+                for future in as_completed(futures):
+                    (region, seconds, error) = future.result()
+                    if error is not None:
+                        print(f"\t\t\t{futures[future]} failed: {error_line(error)}")
+                        continue
+                    found[futures[future]] = region
+            regions.update(found)
+            # Merge into the file as it is now, other accounts may have saved their buckets in the meantime
+            with s3_regions_lock:
+                saved = load_json(cache_path) or {}
+                saved.update(found)
+                save_json(cache_path, saved)
+
+        return {bucket: s3_url(bucket, regions[bucket]) for bucket in buckets if bucket in regions}
 
     def find_aws_acct(self) -> str:
         """
@@ -146,84 +278,126 @@ class AWSProvider(CloudProvider):
 
         :return: the account string
         """
-        from sh import aws
-        cmd = aws('sts', 'get-caller-identity', '--output', 'json')
-        acc: Dict[str, str] = json.loads(str(cmd))
-        return 'AWS_ACCT_ID:' + str(acc['Account'])
+        return 'AWS_ACCT_ID:' + self.backend.account()
 
 
 class GoogleCloudProvider(CloudProvider):
-    def __init__(self):
-        self.name = "Google Cloud"
+    max_workers: int
 
-    def get_ip_ranges(self) -> Dict[str, int]:
-        prefixes = {}
-        url = 'https://www.gstatic.com/ipranges/cloud.json'
-        response = requests.get(url).text
-        data = json.loads(response)
-        for ips in data['prefixes']:
-            if ips.__contains__('ip4Prefix'):
-                prefixes[ips['ip4Prefix']] = 1
-            if ips.__contains__('ip6Prefix'):
-                prefixes[ips['ip6Prefix']] = 1
-        return prefixes
+    def __init__(self, backend: Any = 'cli', project: Optional[str] = None, max_workers: int = 8):
+        """
+        :param backend: The backend name ('cli' or 'sdk'), or a backend object (see bitdiscovery.backends).
+        :param project: The project to read, by default every project the credentials can list.
+        :param max_workers: The number of projects read at the same time.
+        """
+        self.name = "Google Cloud"
+        self.account = project
+        self.max_workers = max_workers
+        self.backend = get_backend('google-cloud', backend, project) if isinstance(backend, str) else backend
+
+    def get_ip_prefixes(self) -> List[Tuple[int, int]]:
+        def parse(r: requests.Response) -> List[str]:
+            prefixes = []
+            for ips in r.json()['prefixes']:
+                if 'ip4Prefix' in ips:
+                    prefixes.append(ips['ip4Prefix'])
+                if 'ip6Prefix' in ips:
+                    prefixes.append(ips['ip6Prefix'])
+            return prefixes
+
+        return self.get_feed_cache().fetch('google-cloud', 'https://www.gstatic.com/ipranges/cloud.json', parse)
 
     def get_instance_ips(self) -> Dict[str, int]:
-        from sh import gcloud
-        ips = {}
-        ipscmd = gcloud('compute', 'instances', 'list')
-        thislist = [y for y in (x.strip() for x in ipscmd.splitlines()) if y]
-
-        skipfirst = 0
-        for addresses in thislist:
-            if skipfirst == 0:
-                skipfirst = 1
-                continue
-            ips[addresses[68:83].rstrip()] = 1
-
+        ips: Dict[str, int] = {}
+        for found in self.iter_instance_ips():
+            ips.update(found)
         return ips
 
+    def iter_instance_ips(self) -> Iterator[Dict[str, int]]:
+        return self.iter_parts(self.backend.project_ips, self.backend.projects(), self.max_workers)
+
 
 class AzureProvider(CloudProvider):
-    def __init__(self):
+    max_workers: int
+
+    def __init__(self, backend: Any = 'cli', subscription: Optional[str] = None, max_workers: int = 8):
+        """
+        :param backend: The backend name ('cli' or 'sdk'), or a backend object (see bitdiscovery.backends).
+        :param subscription: The subscription to read, by default every enabled subscription.
+        :param max_workers: The number of subscriptions read at the same time.
+        """
         self.name = "Azure"
+        self.account = subscription
+        self.max_workers = max_workers
+        self.backend = get_backend('azure', backend, subscription) if isinstance(backend, str) else backend
+
+    def get_ip_prefixes(self) -> List[Tuple[int, int]]:
+        def parse(r: requests.Response) -> List[str]:
+            thejson = r.json()
+            return [ip for i in thejson for ip in thejson[i]]
 
-    def get_ip_ranges(self) -> Dict[str, int]:
-        prefixes = {}
         payload = '{ "region":  "all", "request":  "dcip" }'
-        url = 'https://azuredcip.azurewebsites.net/api/azuredcipranges'
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
-        r = requests.post(url, data=payload, headers=headers)
-        thejson = r.json()
-        for i in thejson:
-            for ip in thejson[i]:
-                prefixes[ip] = 1
-        return prefixes
+        return self.get_feed_cache().fetch('azure', 'https://azuredcip.azurewebsites.net/api/azuredcipranges', parse,
+                                           method='POST', data=payload)
 
     def get_instance_ips(self) -> Dict[str, int]:
-        from sh import az
-        ips = {}
-        ipscmd = az('vm', 'list-ip-addresses', '--output', 'yaml')
+        ips: Dict[str, int] = {}
+        for found in self.iter_instance_ips():
+            ips.update(found)
+        return ips
 
-        thislist = [y for y in (x.strip() for x in ipscmd.splitlines()) if y]
-        for i in thislist:
-            if 'ipAddress' in i:
-                arra = i.split()
-                ips[arra[1].rstrip()] = 1
+    def iter_instance_ips(self) -> Iterator[Dict[str, int]]:
+        return self.iter_parts(self.backend.subscription_ips, self.backend.subscriptions(), self.max_workers)
 
-        return ips
+
+# The key that names the account of each provider in a config file
+ACCOUNT_KEYS: Dict[str, str] = {'amazon-ec2': 'profile', 'google-cloud': 'project', 'azure': 'subscription'}
 
 
-def get_provider(provider: str) -> CloudProvider:
+def get_provider(provider: str, backend: str = 'cli', account: Optional[str] = None) -> CloudProvider:
     """
     Returns the provider based on the argument string.
 
     :param provider: the provider name, either 'amazon-ec2', 'google-cloud' or 'azure'
+    :param backend: how the provider is read, either 'cli' (command-line tools) or 'sdk' (Python SDKs)
+    :param account: the AWS profile, Google Cloud project or Azure subscription to read, by default the default one
     :return: a new CloudProvider object
     """
     if provider == 'amazon-ec2':
-        return AWSProvider()
+        return AWSProvider(backend=backend, profile=account)
     elif provider == 'google-cloud':
-        return GoogleCloudProvider()
+        return GoogleCloudProvider(backend=backend, project=account)
     elif provider == 'azure':
-        return AzureProvider()
+        return AzureProvider(backend=backend, subscription=account)
+
+
+def load_accounts(path: str, backend: str = 'cli') -> List[CloudProvider]:
+    """
+    Returns the providers of every account in a JSON config file, e.g.:
+
+        {"accounts": [{"provider": "amazon-ec2", "profile": "production", "backend": "sdk"},
+                      {"provider": "google-cloud", "project": "my-project"},
+                      {"provider": "azure", "subscription": "00000000-0000-0000-0000-000000000000"}]}
+
+    An account without a profile, project or subscription is the default one of its provider.
+
+    :param path: The config file.
+    :param backend: The backend of the accounts that don't set one.
+    :return: a new CloudProvider object per account
+    """
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Can't read the config {path}: {str(e)}")
+    accounts = config.get('accounts') if isinstance(config, dict) else None
+    if not isinstance(accounts, list) or not accounts:
+        raise ValueError(f"The config {path} has no accounts")
+
+    providers: List[CloudProvider] = []
+    for account in accounts:
+        if account.get('provider') not in ACCOUNT_KEYS:
+            raise ValueError(f"Unknown provider in {path}: {account.get('provider')}")
+        providers.append(get_provider(account['provider'], account.get('backend', backend),
+                                      account.get(ACCOUNT_KEYS[account['provider']])))
+    return providers
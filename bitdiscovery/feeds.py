@@ -0,0 +1,139 @@
+import os
+import struct
+import time
+import requests
+from typing import Callable, Iterable, List, Optional, Tuple
+from bitdiscovery.cache import default_cache_dir, load_json, save_json, write_atomic
+from bitdiscovery.ipindex import IPV6_FLAG, key_to_ip, parse_range
+
+# Snapshot file layout: the magic, the prefix count, then per prefix the IP version, the prefix length and the
+# network address (4 or 16 bytes)
+MAGIC: bytes = b'BDRF1'
+
+
+def pack_prefixes(prefixes: Iterable[Tuple[int, int]]) -> bytes:
+    """
+    Pack (network key, prefix length) pairs into the compact snapshot format.
+    """
+    records = []
+    for (key, length) in prefixes:
+        if key & IPV6_FLAG:
+            records.append(struct.pack('>BB', 6, length) + (key ^ IPV6_FLAG).to_bytes(16, 'big'))
+        else:
+            records.append(struct.pack('>BB', 4, length) + key.to_bytes(4, 'big'))
+    return MAGIC + struct.pack('>I', len(records)) + b''.join(records)
+
+
+def unpack_prefixes(data: bytes) -> List[Tuple[int, int]]:
+    """
+    Unpack a snapshot to (network key, prefix length) pairs.
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a range feed snapshot")
+    (count,) = struct.unpack_from('>I', data, len(MAGIC))
+    prefixes: List[Tuple[int, int]] = []
+    offset = len(MAGIC) + 4
+    for _ in range(count):
+        (version, length) = struct.unpack_from('>BB', data, offset)
+        size = 4 if version == 4 else 16
+        key = int.from_bytes(data[offset + 2:offset + 2 + size], 'big')
+        prefixes.append((key | IPV6_FLAG if version == 6 else key, length))
+        offset += 2 + size
+    return prefixes
+
+
+def parse_prefixes(cidrs: Iterable[str]) -> List[Tuple[int, int]]:
+    """
+    Parse CIDR strings to (network key, prefix length) pairs, skipping anything that isn't a CIDR.
+    """
+    prefixes: List[Tuple[int, int]] = []
+    for cidr in cidrs:
+        span = parse_range(cidr) if '/' in cidr else None
+        if span is not None:
+            prefixes.append((span[0], int(cidr.rsplit('/', 1)[1])))
+    return prefixes
+
+
+def format_prefix(prefix: Tuple[int, int]) -> str:
+    """
+    Format a (network key, prefix length) pair as a CIDR string.
+    """
+    return f'{key_to_ip(prefix[0])}/{prefix[1]}'
+
+
+class RangeFeedCache:
+    """
+    Keeps the last good snapshot of every provider IP range feed on disk.
+
+    A snapshot younger than `ttl` seconds is used as it is. Older ones are revalidated with ETag and
+    If-Modified-Since, and used as they are if the feed is unchanged or can't be downloaded.
+    """
+    directory: str
+    ttl: float
+
+    def __init__(self, directory: Optional[str] = None, ttl: float = 24 * 60 * 60):
+        """
+        :param directory: Where the snapshots are kept, by default range-feeds in the cache directory.
+        :param ttl: The number of seconds a snapshot is used without revalidating it.
+        """
+        self.directory = directory or os.path.join(default_cache_dir(), 'range-feeds')
+        self.ttl = ttl
+
+    def fetch(self, name: str, url: str, parse: Callable[[requests.Response], Iterable[str]], method: str = 'GET',
+              data: Optional[str] = None) -> List[Tuple[int, int]]:
+        """
+        Returns the prefixes of a feed, downloading and parsing it only when it changed.
+
+        :param name: The name of the snapshot files.
+        :param url: The URL of the feed.
+        :param parse: Extracts the CIDR strings from the feed response.
+        :param method: The HTTP method of the feed.
+        :param data: The JSON body to send to the feed.
+        :return: a list of (network key, prefix length) pairs.
+        """
+        snapshot_path = os.path.join(self.directory, f'{name}.bin')
+        meta_path = os.path.join(self.directory, f'{name}.json')
+        meta = load_json(meta_path) or {}
+        snapshot: Optional[List[Tuple[int, int]]] = None
+        try:
+            with open(snapshot_path, 'rb') as f:
+                snapshot = unpack_prefixes(f.read())
+        except (OSError, ValueError, struct.error):
+            meta = {}
+
+        if snapshot is not None and time.time() - meta.get('checked', 0) < self.ttl:
+            return snapshot
+
+        headers = {'Accept': 'application/json', 'Accept-Encoding': 'gzip'}
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+        if snapshot is not None and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if snapshot is not None and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            r = requests.request(method, url, data=data, headers=headers, timeout=60)
+            if r.status_code == 304 and snapshot is not None:
+                meta['checked'] = time.time()
+                save_json(meta_path, meta)
+                return snapshot
+            r.raise_for_status()
+            try:
+                prefixes = parse_prefixes(parse(r))
+            except (KeyError, TypeError) as e:
+                # The feed changed its format, which the callers handle like unparsable JSON
+                raise ValueError(f"Unexpected format of the {name} IP ranges: {e!r}") from e
+        except (requests.RequestException, ValueError) as e:
+            if snapshot is None:
+                raise
+            print(f"\t\tCouldn't update the {name} IP ranges, using the last snapshot ({str(e)}).")
+            return snapshot
+
+        write_atomic(snapshot_path, pack_prefixes(prefixes))
+        save_json(meta_path, {
+            'checked': time.time(),
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+        })
+        return prefixes
@@ -0,0 +1,192 @@
+import socket
+from bisect import bisect_right
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy
+except ImportError:
+    # Batch lookups fall back to one binary search per IP
+    numpy = None
+
+# IPv6 keys get this bit set, so IPv4 and IPv6 addresses never collide in one key space
+IPV6_FLAG: int = 1 << 128
+
+
+def ip_key(ip: str) -> Optional[int]:
+    """
+    Convert an IPv4 or IPv6 address to an integer key without building ipaddress objects.
+
+    :param ip: The IP address string.
+    :return: the integer key, or None if it isn't an IP address.
+    """
+    ip = ip.strip()
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except OSError:
+        pass
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big') | IPV6_FLAG
+    except OSError:
+        return None
+
+
+def key_to_ip(key: int) -> str:
+    """
+    Convert an integer key back to the IP address string.
+    """
+    if key & IPV6_FLAG:
+        return socket.inet_ntop(socket.AF_INET6, (key ^ IPV6_FLAG).to_bytes(16, 'big'))
+    return socket.inet_ntop(socket.AF_INET, key.to_bytes(4, 'big'))
+
+
+def parse_range(text: str) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single IP, a CIDR ('10.0.0.0/24') or a dash range ('10.0.0.1-10.0.0.9' or '10.0.0.1-9') to the first
+    and last integer keys it covers.
+
+    :param text: The IP, CIDR or range string.
+    :return: the (first, last) keys, or None if it isn't an IP, CIDR or range.
+    """
+    text = text.strip()
+    if '/' in text:
+        (network, _, length) = text.partition('/')
+        start = ip_key(network)
+        if start is None or not length.isdigit():
+            return None
+        bits = 128 if start & IPV6_FLAG else 32
+        length = int(length)
+        if length > bits:
+            return None
+        size = 1 << (bits - length)
+        start &= ~(size - 1)
+        return start, start + size - 1
+    if '-' in text:
+        (first, _, last) = text.partition('-')
+        start = ip_key(first)
+        if start is None:
+            return None
+        end = ip_key(last)
+        if end is None and last.strip().isdigit() and not start & IPV6_FLAG:
+            # Short form where only the last octet is given
+            end = ip_key(first.rsplit('.', 1)[0] + '.' + last.strip())
+        if end is None or end < start:
+            return None
+        return start, end
+    key = ip_key(text)
+    return (key, key) if key is not None else None
+
+
+class IntervalIndex:
+    """
+    A set of IP ranges stored as sorted, merged integer intervals, answering membership by binary search.
+
+    Batch lookups of IPv4 addresses are vectorized with numpy when it is installed.
+    """
+    starts: List[int]
+    ends: List[int]
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self._pending: List[Tuple[int, int]] = []
+        self._v4_starts = None
+        self._v4_ends = None
+
+    @classmethod
+    def from_prefixes(cls, prefixes: Iterable[Tuple[int, int]]) -> 'IntervalIndex':
+        """
+        Build an index from (network key, prefix length) pairs, as returned by CloudProvider.get_ip_prefixes.
+        """
+        index = cls()
+        for (key, length) in prefixes:
+            size = 1 << ((128 if key & IPV6_FLAG else 32) - length)
+            index.add(key, key + size - 1)
+        return index.build()
+
+    @classmethod
+    def from_ranges(cls, ranges: Iterable[str]) -> 'IntervalIndex':
+        """
+        Build an index from IP, CIDR and dash range strings, skipping anything else.
+        """
+        index = cls()
+        for text in ranges:
+            span = parse_range(text)
+            if span is not None:
+                index.add(span[0], span[1])
+        return index.build()
+
+    def add(self, start: int, end: int) -> None:
+        self._pending.append((start, end))
+
+    def build(self) -> 'IntervalIndex':
+        """
+        Sort and merge the added ranges, this has to be called before querying the index.
+        """
+        intervals = sorted(list(zip(self.starts, self.ends)) + self._pending)
+        self._pending = []
+        self.starts = []
+        self.ends = []
+        for (start, end) in intervals:
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+        # IPv4 intervals sort first and fit into 64 bits, so they can be searched as numpy arrays
+        if numpy is not None:
+            v4 = bisect_right(self.starts, (1 << 32) - 1)
+            self._v4_starts = numpy.array(self.starts[:v4], dtype=numpy.uint64)
+            self._v4_ends = numpy.array(self.ends[:v4], dtype=numpy.uint64)
+        return self
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def contains_key(self, key: int) -> bool:
+        i = bisect_right(self.starts, key) - 1
+        return i >= 0 and key <= self.ends[i]
+
+    def covers(self, start: int, end: int) -> bool:
+        """
+        :return: whether the whole range from start to end is inside the index.
+        """
+        i = bisect_right(self.starts, start) - 1
+        return i >= 0 and end <= self.ends[i]
+
+    def contains(self, ip: str) -> bool:
+        key = ip_key(ip)
+        return key is not None and self.contains_key(key)
+
+    def contains_keys(self, keys: Sequence[int]) -> List[bool]:
+        """
+        Look up many integer keys at once.
+
+        :param keys: The integer keys (see ip_key).
+        :return: whether each key is inside the index, in the same order.
+        """
+        if self._v4_starts is None or len(keys) == 0:
+            return [self.contains_key(key) for key in keys]
+
+        result = [False] * len(keys)
+        v4 = [i for (i, key) in enumerate(keys) if 0 <= key < (1 << 32)]
+        if v4 and len(self._v4_starts) > 0:
+            queries = numpy.array([keys[i] for i in v4], dtype=numpy.uint64)
+            positions = numpy.searchsorted(self._v4_starts, queries, side='right') - 1
+            found = (positions >= 0) & (queries <= self._v4_ends[numpy.maximum(positions, 0)])
+            for (i, hit) in zip(v4, found.tolist()):
+                result[i] = hit
+        for (i, key) in enumerate(keys):
+            if key >= (1 << 32):
+                result[i] = self.contains_key(key)
+        return result
+
+    def contains_many(self, ips: Iterable[str]) -> List[bool]:
+        """
+        Look up many IP address strings at once, invalid addresses are never inside the index.
+
+        :return: whether each IP is inside the index, in the same order.
+        """
+        keys = [ip_key(ip) for ip in ips]
+        found = self.contains_keys([key if key is not None else -1 for key in keys])
+        return [hit and key is not None for (hit, key) in zip(found, keys)]
@@ -0,0 +1,166 @@
+import atexit
+import hashlib
+import json
+import os
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+from bitdiscovery.cache import default_cache_dir
+
+
+class Journal:
+    """
+    An append-only checkpoint file of a long run: the last safe pagination cursor of every stage, and the items of
+    every stage whose writes completed.
+
+    Records are buffered and fsynced in batches (every `sync_every` records or `sync_interval` seconds), and when
+    the interpreter exits. A crash loses at most the last batch, whose writes are then simply done again, so every
+    journaled write has to be idempotent.
+    """
+    path: str
+    resumed: bool
+
+    def __init__(self, name: str, key: str, resume: bool = False, directory: Optional[str] = None,
+                 sync_every: int = 100, sync_interval: float = 5.0):
+        """
+        :param name: The name of the run, e.g. the script name.
+        :param key: Identifies the work of the run (API key and arguments), a journal is only resumed by the same work.
+        :param resume: Whether to continue from the existing journal, otherwise it is started over.
+        :param directory: Where the journals are kept, by default journals in the cache directory.
+        :param sync_every: The number of records written before fsyncing.
+        :param sync_interval: The number of seconds after which buffered records are fsynced anyway.
+        """
+        directory = directory or os.path.join(default_cache_dir(), 'journals')
+        os.makedirs(directory, exist_ok=True)
+        # Named by a hash so the API key isn't written to disk
+        keyhash = hashlib.sha256(key.encode()).hexdigest()[:16]
+        self.path = os.path.join(directory, f'{name}-{keyhash}.jsonl')
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.cursors: Dict[str, str] = {}
+        self.completed: Dict[str, Set[str]] = {}
+        self.resumed = resume and os.path.exists(self.path)
+        if self.resumed:
+            self._replay()
+        self._file = open(self.path, 'a' if self.resumed else 'w')
+        self._buffered = 0
+        self._last_sync = time.monotonic()
+        atexit.register(self.close)
+
+    def _replay(self) -> None:
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A record torn by a crash, everything before it is intact
+                    break
+                if 'c' in record:
+                    self.cursors[record['s']] = record['c']
+                else:
+                    self.completed.setdefault(record['s'], set()).update(record['d'])
+
+    def _write(self, record: Dict) -> None:
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._buffered += 1
+        if self._buffered >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffered = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def finish(self) -> None:
+        """
+        Remove the journal once the run completed, so the next run starts from the beginning.
+        """
+        self._file.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def cursor(self, stage: str) -> str:
+        """
+        :return: the last journaled cursor of a stage, or '' to start from the beginning.
+        """
+        return self.cursors.get(stage, '')
+
+    def set_cursor(self, stage: str, cursor: str) -> None:
+        self.cursors[stage] = cursor
+        self._write({'s': stage, 'c': cursor})
+
+    def done(self, stage: str) -> Set[str]:
+        """
+        :return: the items of a stage that completed, in this run or the resumed ones.
+        """
+        return self.completed.setdefault(stage, set())
+
+    def mark_done(self, stage: str, items: Iterable[str]) -> None:
+        items = [str(item) for item in items]
+        if items:
+            self.done(stage).update(items)
+            self._write({'s': stage, 'd': items})
+
+
+class PageCheckpoint:
+    """
+    Journals the cursor of a paginated scan whose items are written out of order (e.g. in concurrent batches).
+
+    The cursor after a page is only journaled once every item of that page and the pages before it was written, so a
+    resumed scan never skips an item that wasn't written yet.
+    """
+
+    def __init__(self, journal: Journal, stage: str):
+        """
+        :param journal: The journal to write to.
+        :param stage: The stage of the cursor and the written items.
+        """
+        self.journal = journal
+        self.stage = stage
+        self.page = 0
+        self.pending: Dict[str, int] = {}
+        self.open = Counter()
+        self.cursors: Deque[Tuple[int, str]] = deque()
+
+    def add(self, item: str) -> None:
+        """
+        Register an item read in the current page, which still has to be written.
+        """
+        self.pending[item] = self.page
+        self.open[self.page] += 1
+
+    def page_done(self, cursor: str) -> None:
+        """
+        Mark the end of the current page, to be called with the cursor of the next one (see the on_page of the
+        BitDiscoveryApi iterators).
+        """
+        self.cursors.append((self.page, cursor))
+        self.page += 1
+        self._advance()
+
+    def complete(self, items: List[str]) -> None:
+        """
+        Mark items as written.
+        """
+        for item in items:
+            page = self.pending.pop(item, None)
+            if page is not None:
+                self.open[page] -= 1
+        self.journal.mark_done(self.stage, items)
+        self._advance()
+
+    def _advance(self) -> None:
+        cursor = ''
+        while self.cursors and self.open[self.cursors[0][0]] == 0:
+            # The last page can end without a cursor, the one before it is kept then
+            cursor = self.cursors.popleft()[1] or cursor
+        if cursor:
+            self.journal.set_cursor(self.stage, cursor)
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from bitdiscovery.api import ApiError, BitDiscoveryApi, try_multiple_times
+from bitdiscovery.cache import default_cache_dir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (id TEXT PRIMARY KEY, ip TEXT, hostname TEXT);
+CREATE INDEX IF NOT EXISTS assets_ip ON assets (ip);
+CREATE TABLE IF NOT EXISTS sources (id TEXT PRIMARY KEY, keyword TEXT, search_type TEXT);
+CREATE INDEX IF NOT EXISTS sources_keyword ON sources (keyword);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class InventoryMirror:
+    """
+    A local SQLite copy of the assets and sources of one inventory, answering lookups without API calls.
+
+    Assets are synced incrementally from the last stored ID cursor, so only new assets are downloaded. Assets that
+    changed, and sources, are caught up by a full sync once the last one is older than `max_age` seconds (sources
+    also as soon as their count changes). Writes made through the scripts are applied to the mirror right away.
+    """
+    path: str
+    max_age: float
+
+    def __init__(self, api: BitDiscoveryApi, directory: Optional[str] = None, max_age: float = 24 * 60 * 60):
+        """
+        :param api: The client of the inventory to mirror.
+        :param directory: Where the database is kept, by default mirrors in the cache directory.
+        :param max_age: The number of seconds after which a full sync is done.
+        """
+        self.api = api
+        self.max_age = max_age
+        directory = directory or os.path.join(default_cache_dir(), 'mirrors')
+        os.makedirs(directory, exist_ok=True)
+        # One database per API key, named by a hash so the key isn't written to disk
+        keyhash = hashlib.sha256(api.apikey.encode()).hexdigest()[:16]
+        self.path = os.path.join(directory, f'inventory-{keyhash}.sqlite')
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> 'InventoryMirror':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def get_meta(self, key: str, default: str = '') -> str:
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def set_meta(self, key: str, value: str) -> None:
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def is_stale(self, kind: str) -> bool:
+        return time.time() - float(self.get_meta(f'{kind}_full_sync', '0')) > self.max_age
+
+    def sync_assets(self, limit: int, full: bool = False) -> int:
+        """
+        Download the assets added since the last sync (or every asset on a full sync).
+
+        :param limit: The page size.
+        :param full: Whether to download every asset again.
+        :return: the number of assets downloaded.
+        """
+        full = full or self.is_stale('assets')
+        cursor = '' if full else self.get_meta('assets_cursor')
+        if full:
+            self.db.execute('DELETE FROM assets')
+            self.set_meta('assets_full_sync', str(time.time()))
+
+        rows: List[Tuple[str, str, str]] = []
+        count = 0
+
+        def store_page(next_cursor: str, offset: int, total: int):
+            # Commit every page with its cursor, so an interrupted sync continues from there
+            self.db.executemany('INSERT OR REPLACE INTO assets (id, ip, hostname) VALUES (?, ?, ?)', rows)
+            if next_cursor:
+                self.set_meta('assets_cursor', next_cursor)
+            self.db.commit()
+            rows.clear()
+
+        for asset in self.api.iter_inventory(limit, cursor, on_page=store_page):
+            rows.append((str(asset['id']), str(asset.get('bd.ip_address') or ''),
+                         str(asset.get('bd.original_hostname') or asset.get('bd.hostname') or '')))
+            count += 1
+        self.db.commit()
+        return count
+
+    def sync_sources(self, limit: int, full: bool = False) -> int:
+        """
+        Download every source again, if their count changed or the last full sync is too old.
+
+        :param limit: The page size.
+        :param full: Whether to download the sources even if nothing seems to have changed.
+        :return: the number of sources downloaded.
+        """
+        probe = try_multiple_times(lambda: self.api.search_for_source(1, '', ''), max_tries=5)
+        if probe is None:
+            raise ApiError("API call failed too many times.")
+        total = int(probe.get('total', 0))
+        local = self.db.execute('SELECT COUNT(*) FROM sources').fetchone()[0]
+        if not full and total == local and not self.is_stale('sources'):
+            return 0
+
+        rows = [(str(source['id']), str(source.get('keyword', '')).lower(), str(source.get('search_type', '')))
+                for source in self.api.iter_sources(limit, '')]
+        self.db.execute('DELETE FROM sources')
+        self.db.executemany('INSERT OR REPLACE INTO sources (id, keyword, search_type) VALUES (?, ?, ?)', rows)
+        self.set_meta('sources_full_sync', str(time.time()))
+        self.db.commit()
+        return len(rows)
+
+    def sync(self, limit: int, full: bool = False) -> Tuple[int, int]:
+        """
+        :return: the number of assets and sources downloaded.
+        """
+        return self.sync_assets(limit, full), self.sync_sources(limit, full)
+
+    def asset_ids_for_ip(self, ip: str) -> List[str]:
+        return [row[0] for row in self.db.execute('SELECT id FROM assets WHERE ip = ?', (ip,))]
+
+    def assets(self) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over every asset, with the same keys as the API returns them.
+        """
+        for (asset_id, ip, hostname) in self.db.execute('SELECT id, ip, hostname FROM assets'):
+            yield {'id': asset_id, 'bd.ip_address': ip, 'bd.original_hostname': hostname}
+
+    def sources(self, search: str = '') -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the sources containing the search keyword, with the same keys as the API returns them.
+        """
+        query = 'SELECT id, keyword, search_type FROM sources WHERE instr(keyword, ?) > 0'
+        for (source_id, keyword, search_type) in self.db.execute(query, (search.lower(),)):
+            yield {'id': source_id, 'keyword': keyword, 'search_type': search_type}
+
+    def remove_assets(self, ids: Iterable[str]) -> None:
+        self.db.executemany('DELETE FROM assets WHERE id = ?', [(str(asset_id),) for asset_id in ids])
+        self.db.commit()
+
+    def remove_sources(self, ids: Iterable[str]) -> None:
+        self.db.executemany('DELETE FROM sources WHERE id = ?', [(str(source_id),) for source_id in ids])
+        self.db.commit()
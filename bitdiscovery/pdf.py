@@ -1,13 +1,116 @@
+import copy
+import hashlib
+import io
+import math
 import os
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Sequence, Tuple, Union
 from fpdf import FPDF, HTMLMixin
+from fpdf.image_parsing import get_img_info, load_image
+
+
+BAR_COLORS: List[Tuple[int, int, int]] = [(60, 132, 193), (93, 195, 199), (83, 176, 6), (238, 174, 104), (221, 96, 105)]
+TABLE_HEADER_COLOR: Tuple[int, int, int] = (243, 244, 245)
+TABLE_STRIPE_COLOR: Tuple[int, int, int] = (240, 250, 250)
 
 
 class HTML2PDF(FPDF, HTMLMixin):
     pass
 
 
+def chart_ticks(top: float, max_ticks: int = 8) -> Tuple[float, List[float]]:
+    """
+    Pick round values for the ticks of a chart axis starting at 0, with a step of 1, 2, 2.5 or 5 times a power of ten.
+
+    :param top: The highest value on the axis.
+    :param max_ticks: The maximum number of ticks above 0.
+    :return: the step between the ticks, and the ticks up to the top.
+    """
+    raw = top / max_ticks
+    magnitude = 10 ** math.floor(math.log10(raw))
+    step = next(m * magnitude for m in (1, 2, 2.5, 5, 10) if m * magnitude >= raw)
+    return step, [i * step for i in range(int(top / step + 1e-9) + 1)]
+
+
+def table_rows(data: List[Dict[str, Any]]) -> List[Tuple[str, int]]:
+    """
+    The rows of the table of a dashboard aggregation, with the assets that have no value (the '__missing__' row, and
+    the empty name) added up in the last row.
+
+    :param data: The aggregation (as a list of dictionaries with name and value keys).
+    :return: the names and their counts.
+    """
+    missing: Optional[int] = None
+    rows: List[Tuple[str, int]] = []
+    for row in data:
+        if str(row['name']) in ("__missing__", ''):
+            # The empty name fixes a UI bug with how the table is rendered
+            missing = (missing or 0) + int(row['value'])
+        else:
+            rows.append((str(row['name']), int(row['value'])))
+    if missing is not None:
+        rows.append(("__missing__", missing))
+    return rows
+
+
+class ResourceCache:
+    """
+    Fonts and images parsed once per process and shared by every PdfBuilder.
+
+    fpdf parses a font's metrics, and decodes an image, every time a document adds them. The cache keeps the parsed
+    entries and hands each document its own shallow copy: the metrics and the decoded pixels are shared, while the
+    per-document state (object numbers, the character subset of a font) stays separate.
+    """
+    fonts: Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]]
+    images: Dict[str, Dict[str, Any]]
+
+    def __init__(self):
+        self.fonts = {}
+        self.images = {}
+
+    def add_font(self, pdf: FPDF, family: str, path: str) -> None:
+        """
+        Add a TrueType font to a document, as FPDF.add_font does.
+        """
+        fontkey = family.lower()
+        cached = self.fonts.get(fontkey + path)
+        if cached is None:
+            pdf.add_font(family, fname=path)
+            # Keep the subset as it is before any text is written, every document starts from it
+            cached = (dict(pdf.fonts[fontkey], subset=copy.deepcopy(pdf.fonts[fontkey]['subset'])),
+                      dict(pdf.font_files[fontkey]))
+            self.fonts[fontkey + path] = cached
+            return
+        (font, font_file) = cached
+        pdf.fonts[fontkey] = dict(font, i=len(pdf.fonts) + 1, subset=copy.deepcopy(font['subset']))
+        pdf.font_files[fontkey] = dict(font_file)
+
+    def image(self, pdf: FPDF, path: str, x: Optional[float] = None, y: Optional[float] = None, w: float = 0,
+              h: float = 0) -> None:
+        """
+        Place an image file in a document, as FPDF.image does. An image with the same content as one already in the
+        document (even under another path) is embedded once.
+        """
+        info = self.images.get(path)
+        if info is None:
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            info = dict(get_img_info(load_image(path), pdf.image_filter), digest=digest)
+            self.images[path] = info
+
+        name = next((name for (name, embedded) in pdf.images.items() if embedded.get('digest') == info['digest']),
+                    None)
+        if name is None:
+            # fpdf finds it registered under this name, and only counts its usage
+            name = path
+            pdf.images[name] = dict(info, i=len(pdf.images) + 1, usages=0)
+        pdf.image(name, x, y, w, h)
+
+
+# Shared by every PdfBuilder of the process
+resources = ResourceCache()
+
+
 class PdfPage:
     """
     A page of a pdf, which holds the necessary data: the key, the name and the description of the page.
@@ -30,13 +133,20 @@ class PdfBuilder:
     title: str
     resource_directory: str
 
-    def __init__(self, title: str, resource_directory: str):
+    def __init__(self, title: str, resource_directory: str, cache: Optional[ResourceCache] = None):
+        """
+        :param title: The name of the inventory.
+        :param resource_directory: The directory of the fonts and images.
+        :param cache: Where parsed fonts and images are kept, by default the cache shared by the whole process.
+        """
         self.pdf = HTML2PDF('P', 'mm', 'A4')
         self.pdf.set_auto_page_break(0, margin=0.0)
         self.title = title
         self.resource_directory = resource_directory
-        self.pdf.add_font('Avenir Book', fname=self.get_resource('avenir-book.ttf'), uni=True)
-        self.pdf.add_font('Avenir Black', fname=self.get_resource('avenir-black.ttf'), uni=True)
+        self.cache = cache if cache is not None else resources
+        self.char_widths: Dict[str, Dict[str, float]] = {}
+        self.cache.add_font(self.pdf, 'Avenir Book', self.get_resource('avenir-book.ttf'))
+        self.cache.add_font(self.pdf, 'Avenir Black', self.get_resource('avenir-black.ttf'))
 
     def get_resource(self, res: str) -> str:
         return os.path.join(self.resource_directory, res)
@@ -57,8 +167,8 @@ class PdfBuilder:
         self.pdf.text(30, 100, txt=str(self.title)[:20])
 
         self.pdf.set_font('Avenir Book', '', 18)
-        self.pdf.image(self.get_resource('footer-img.png'), 0, 180, 240)
-        self.pdf.image(self.get_resource('bd2020logowhite.png'), 166, 278, 33)
+        self.cache.image(self.pdf, self.get_resource('footer-img.png'), 0, 180, 240)
+        self.cache.image(self.pdf, self.get_resource('bd2020logowhite.png'), 166, 278, 33)
         self.pdf.set_text_color(230, 199, 204)
         self.pdf.cell(0, 315, txt=str(datetime.now().strftime('%B %Y')), align='R')
 
@@ -92,13 +202,67 @@ class PdfBuilder:
                 """
         self.pdf.write_html(html)
 
-    def add_graph_page(self, page: PdfPage, data: List[Dict[str, Any]], image: str, totalsize: int):
+    def add_bar_chart(self, values: Sequence[int], w: float = 180, h: float = 100):
         """
-        Add analysing page with an image and a table.
+        Draw a bar chart with vector lines and shapes at the current position, laid out like the matplotlib charts of
+        the report (a grid behind the bars, the y axis labelled 'Assets').
+
+        :param values: The height of every bar.
+        :param w: The width of the chart.
+        :param h: The height of the chart.
+        """
+        x = self.pdf.get_x()
+        y = self.pdf.get_y()
+        # The plot area, with room on the left for the tick labels and the axis label
+        left = x + w * 0.125
+        right = x + w * 0.9
+        top = y + h * 0.12
+        bottom = y + h * 0.89
+
+        # 5% headroom above the highest bar, and 5% on both sides of the bars (each 0.8 wide)
+        ymax = max(max(values, default=0), 0) * 1.05 or 1.0
+        (step, ticks) = chart_ticks(ymax)
+        decimals = 0
+        while abs(round(step, decimals) - step) > step * 1e-6:
+            decimals += 1
+        span = max(len(values) - 1, 0) + 0.8
+        xmin = -0.4 - span * 0.05
+        xscale = (right - left) / (span * 1.1)
+        yscale = (bottom - top) / ymax
+
+        with self.pdf.local_context():
+            for (i, value) in enumerate(values):
+                if value > 0:
+                    self.pdf.set_fill_color(*BAR_COLORS[i % len(BAR_COLORS)])
+                    self.pdf.rect(left + (i - 0.4 - xmin) * xscale, bottom - value * yscale, 0.8 * xscale,
+                                  value * yscale, 'F')
+
+            self.pdf.set_draw_color(176, 176, 176)
+            self.pdf.set_line_width(0.22)
+            self.pdf.set_font('Avenir Book', '', 8)
+            self.pdf.set_text_color(0, 0, 0)
+            for tick in ticks:
+                ty = bottom - tick * yscale
+                self.pdf.line(left, ty, right, ty)
+                label = f'{tick:.{decimals}f}'
+                self.pdf.text(left - 1.5 - self.pdf.get_string_width(label), ty + 1.0, txt=label)
+
+            label_x = x + w * 0.04
+            label_y = (top + bottom) / 2 + self.pdf.get_string_width('Assets') / 2
+            with self.pdf.rotation(90, label_x, label_y):
+                self.pdf.text(label_x, label_y, txt='Assets')
+
+        self.pdf.set_xy(x, y + h)
+
+    def add_graph_page(self, page: PdfPage, data: List[Dict[str, Any]], image: Optional[Union[str, io.BytesIO]],
+                       totalsize: int):
+        """
+        Add analysing page with a chart and a table.
 
         :param page: PdfPage object which holds the necessary key, title and description.
         :param data: the data to show as a table (as a dictionary with name and value keys)
-        :param image: the URL of an image (should be relative to the resource directory).
+        :param image: the path of a chart image (relative to the resource directory, or absolute), or the image itself,
+                      or None to draw the bars of the data with add_bar_chart.
         :param totalsize: the total number of assets.
         """
         self.pdf.add_page()
@@ -107,70 +271,119 @@ class PdfBuilder:
         self.pdf.text(10, 20, txt=page.title)
         description = f"<br><br><p><font face='Helvetica' size=11>{page.description}</font></p><br>"
         self.pdf.write_html(description)
-        table = f"""
-                <font face="Helvetica" size=11><table width="100%" border="1" align="center">
-                    <thead>
-                        <tr>
-                            <th bgcolor="#F3F4F5" width="70%">{page.title}</th>
-                            <th bgcolor="#F3F4F5" width="15%">Count</th>
-                            <th bgcolor="#F3F4F5" width="15%">Percent</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                """
+        if image is None:
+            self.add_bar_chart([int(row['value']) for row in data if str(row['name']) != "__missing__"])
+        elif isinstance(image, str):
+            self.cache.image(self.pdf, self.get_resource(image), w=180)
+        else:
+            self.pdf.image(image, w=180)
+        # self.pdf.write_html('<center><font face="Helvetica" size=10>Assets by ' + str(page.title) + '</font></center>')
 
         if len(data) > 0:
-            missingrow: Dict[str, Any] = {}
-            foundmissing: bool = False
-            empty: int = 0
-            rows: List[Tuple[str, int]] = []
-
-            for row in data:
-                if str(row['name']) == "__missing__":
-                    missingrow = row
-                    foundmissing = True
-                else:
-                    if str(row['name']) == '':
-                        # Fixes a UI bug with how the table is rendered
-                        empty = int(row['value'])
-                        foundmissing = True
-                        continue
-
-                    rows.append((str(row['name']), int(row['value'])))
-
-            # If there is a missing row, add its value to the end
-            if foundmissing:
-                rows.append((str(missingrow['name']), int(missingrow['value'] + empty)))
-
-            if not foundmissing and empty > 0:
-                rows.append(("__missing__", empty))
-
-            # Generate rows
-            for (i, (name, value)) in enumerate(rows):
-                # Truncate long strings, and calculate percentage
-                name = name[:75] + '...' if len(name) > 75 else name
-                percent = round((float(value) / float(totalsize)) * 100, 2)
-                # Add row to the table
-                if i % 2 == 0:
-                    table += f"<tr><td>{name}</td><td>{str(value)}</td><td>{str(percent)}%</td></tr>"
-                else:
-                    table += f"<tr><td bgcolor='#f0fafa'>{name}</td><td bgcolor='#f0fafa'>{str(value)}</td><td bgcolor='#f0fafa'>{str(percent)}%</td></tr>"
-
-            table += "</tbody></table></font>"
+            self.add_table(page.title, table_rows(data), totalsize)
+        else:
+            self.pdf.set_font('Helvetica', '', 11)
+            self.pdf.cell(0, 7, txt='No data found.')
+        self.add_logo()
+
+    def add_logo(self):
+        """
+        Add the logo to the bottom of the current page.
+        """
+        self.cache.image(self.pdf, self.get_resource('bd2020logoblue.png'), 166, 278, 33)
+
+    def fit_text(self, text: str, width: float, max_length: int = 75) -> str:
+        """
+        Truncate a text to `max_length` characters, and to the width in the current font, adding '...' if it was cut.
+        """
+        if len(text) > max_length:
+            text = text[:max_length] + '...'
+        # The width of every character is measured once per font
+        font = f'{self.pdf.font_family}{self.pdf.font_style}{self.pdf.font_size_pt}'
+        widths = self.char_widths.setdefault(font, {})
+        for char in text + '...':
+            if char not in widths:
+                widths[char] = self.pdf.get_string_width(char)
 
+        if sum(widths[char] for char in text) <= width:
+            return text
+        used = sum(widths[char] for char in '...')
+        for (i, char) in enumerate(text):
+            used += widths[char]
+            if used > width:
+                return text[:i] + '...'
+        return text
+
+    def add_table(self, title: str, rows: List[Tuple[str, int]], totalsize: int, row_height: float = 7.0,
+                  bottom: float = 270.0):
+        """
+        Add a table of names, counts and percentages at the current position. It continues on new pages, with the
+        header repeated, when it reaches the bottom of the page.
+
+        :param title: The header of the name column.
+        :param rows: The names and their counts (see table_rows).
+        :param totalsize: The total the percentages are calculated from.
+        :param row_height: The height of every row.
+        :param bottom: Where the rows stop on every page (above the logo).
+        """
+        width = self.pdf.w - self.pdf.l_margin - self.pdf.r_margin
+        widths = (width * 0.7, width * 0.15, width * 0.15)
+
+        # Cut the names and format the numbers once, before drawing
+        self.pdf.set_font('Helvetica', 'B', 11)
+        header = (self.fit_text(title, widths[0] - 2 * self.pdf.c_margin), 'Count', 'Percent')
+        self.pdf.set_font('Helvetica', '', 11)
+        cells = [
+            (self.fit_text(name, widths[0] - 2 * self.pdf.c_margin), str(value),
+             f'{round(value / totalsize * 100, 2) if totalsize else 0.0}%')
+            for (name, value) in rows
+        ]
+
+        def add_header():
+            self.pdf.set_font('Helvetica', 'B', 11)
+            self.pdf.set_fill_color(*TABLE_HEADER_COLOR)
+            for (w, txt) in zip(widths, header):
+                self.pdf.cell(w, row_height, txt=txt, border=1, align='C', fill=True)
+            self.pdf.ln(row_height)
+            self.pdf.set_font('Helvetica', '', 11)
+            self.pdf.set_fill_color(*TABLE_STRIPE_COLOR)
+
+        def add_continuation_page():
+            self.add_logo()
+            self.pdf.add_page()
+            self.pdf.set_y(20)
+            add_header()
+
+        # Don't leave the header alone at the bottom of the page
+        if self.pdf.get_y() + 2 * row_height > bottom:
+            add_continuation_page()
         else:
-            table = '<font face="Helvetica" size=11>No data found.</font>'
+            add_header()
+        # The rows are drawn with rect and text, cell measures every text again for its alignment
+        left = self.pdf.l_margin
+        offsets = (left, left + widths[0], left + widths[0] + widths[1])
+        baseline = row_height / 2 + self.pdf.font_size * 0.35
+        for (i, row) in enumerate(cells):
+            y = self.pdf.get_y()
+            if y + row_height > bottom:
+                add_continuation_page()
+                y = self.pdf.get_y()
+            for (x, w, txt) in zip(offsets, widths, row):
+                self.pdf.rect(x, y, w, row_height, 'DF' if i % 2 == 1 else 'D')
+                self.pdf.text(x + self.pdf.c_margin, y + baseline, txt=txt)
+            self.pdf.set_y(y + row_height)
 
-        self.pdf.image(self.get_resource(image), w=180)
-        # self.pdf.write_html('<center><font face="Helvetica" size=10>Assets by ' + str(page.title) + '</font></center>')
-        self.pdf.write_html(table)
-        self.pdf.image(self.get_resource('bd2020logoblue.png'), 166, 278, 33)
+    def output(self) -> bytearray:
+        """
+        :return: the pdf document.
+        """
+        return self.pdf.output()
 
     def save(self, filename: str):
         """
         Save the pdf file to a path.
 
-        :param filename: The filename to save to (should be relative to the resource directory).
+        :param filename: The filename to save to (relative to the resource directory, or absolute).
         :return:
         """
         self.pdf.output(self.get_resource(filename), 'F')
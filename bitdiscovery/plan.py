@@ -0,0 +1,175 @@
+import gzip
+import hashlib
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+from bitdiscovery.api import BitDiscoveryApi
+from bitdiscovery.asyncapi import AsyncBitDiscoveryApi, run_sync
+from bitdiscovery.journal import Journal
+
+PLAN_VERSION: int = 1
+
+
+class ChangePlan:
+    """
+    The writes that bring an inventory in line with a cloud account. A plan is computed without making any write, can
+    be saved to a file to be reviewed, and is then made by a PlanExecutor.
+    """
+    inventory: str
+    provider: str
+    created: float
+    add_ips: List[str]
+    add_sources: List[str]
+    archive_assets: List[str]
+    delete_sources: List[str]
+
+    def __init__(self, inventory: str, provider: str, add_ips: Optional[List[str]] = None,
+                 add_sources: Optional[List[str]] = None, archive_assets: Optional[List[str]] = None,
+                 delete_sources: Optional[List[str]] = None, created: Optional[float] = None):
+        """
+        :param inventory: The name of the inventory the plan was computed for.
+        :param provider: The name of the cloud provider.
+        :param add_ips: The IPs to add as sources.
+        :param add_sources: The other sources to add (e.g. S3 bucket URLs).
+        :param archive_assets: The IDs of the assets to archive.
+        :param delete_sources: The IDs of the sources to delete.
+        :param created: When the plan was computed, by default now.
+        """
+        self.inventory = inventory
+        self.provider = provider
+        self.add_ips = add_ips or []
+        self.add_sources = add_sources or []
+        self.archive_assets = archive_assets or []
+        self.delete_sources = delete_sources or []
+        self.created = created if created is not None else time.time()
+
+    def __len__(self) -> int:
+        return len(self.add_ips) + len(self.add_sources) + len(self.archive_assets) + len(self.delete_sources)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'version': PLAN_VERSION,
+            'inventory': self.inventory,
+            'provider': self.provider,
+            'created': self.created,
+            'add_ips': self.add_ips,
+            'add_sources': self.add_sources,
+            'archive_assets': self.archive_assets,
+            'delete_sources': self.delete_sources,
+        }
+
+    def digest(self) -> str:
+        """
+        :return: a hash of the plan, which identifies it e.g. in the journal of its apply run.
+        """
+        return hashlib.sha256(json.dumps(self.to_dict(), sort_keys=True).encode()).hexdigest()
+
+    def save(self, path: str) -> None:
+        with gzip.open(path, 'wt') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path: str) -> 'ChangePlan':
+        """
+        Read a plan written by save, ValueError is raised if it isn't a plan file.
+        """
+        try:
+            with gzip.open(path, 'rt') as f:
+                data = json.load(f)
+        except OSError as e:
+            raise ValueError(f"Can't read the plan: {str(e)}")
+        if not isinstance(data, dict) or data.get('version') != PLAN_VERSION:
+            raise ValueError("Not a plan file, or written by another version")
+        return cls(data['inventory'], data['provider'], data['add_ips'], data['add_sources'], data['archive_assets'],
+                   data['delete_sources'], data['created'])
+
+
+class StageResult:
+    """
+    The outcome of one kind of write of a plan.
+    """
+    name: str
+    done: int
+    failed: List[str]
+    seconds: float
+
+    def __init__(self, name: str, done: int, failed: List[str], seconds: float):
+        self.name = name
+        self.done = done
+        self.failed = failed
+        self.seconds = seconds
+
+    @property
+    def rate(self) -> float:
+        """
+        :return: the number of writes made per second.
+        """
+        return self.done / self.seconds if self.seconds > 0 else 0.0
+
+
+class PlanExecutor:
+    """
+    Makes the writes of a plan: single writes concurrently through an AsyncBitDiscoveryApi, archives in concurrent
+    batches, all paced by the rate limiter of the client.
+
+    With a journal, every completed write is recorded and skipped when the apply run is resumed.
+    """
+
+    def __init__(self, api: BitDiscoveryApi, async_api: AsyncBitDiscoveryApi, batch_size: int = 100,
+                 journal: Optional[Journal] = None, max_tries: int = 5):
+        """
+        :param api: The client of the inventory.
+        :param async_api: The concurrent client wrapping it.
+        :param batch_size: The number of assets archived with one request.
+        :param journal: Where completed writes are recorded.
+        :param max_tries: The number of tries for each write.
+        """
+        self.api = api
+        self.async_api = async_api
+        self.batch_size = batch_size
+        self.journal = journal
+        self.max_tries = max_tries
+
+    def _pending(self, stage: str, values: List[str]) -> List[str]:
+        if self.journal is None:
+            return values
+        done = self.journal.done(stage)
+        return [value for value in values if value not in done]
+
+    def _mark_done(self, stage: str, values: List[str]) -> None:
+        if self.journal is not None:
+            self.journal.mark_done(stage, values)
+
+    def _map(self, stage: str, fn: Callable[[str], Any], values: List[str]) -> StageResult:
+        start = time.monotonic()
+
+        def finished(value: str, result: Optional[Any]):
+            if result is not None:
+                self._mark_done(stage, [value])
+
+        results = run_sync(self.async_api.map(fn, self._pending(stage, values), self.max_tries, on_result=finished))
+        failed = [value for value in results if results[value] is None]
+        return StageResult(stage, len(results) - len(failed), failed, time.monotonic() - start)
+
+    def _archive(self, stage: str, ids: List[str]) -> StageResult:
+        start = time.monotonic()
+
+        def finished(batch: List[str], failed: List[str]):
+            self._mark_done(stage, list(set(batch) - set(failed)))
+
+        (archived, failed) = self.api.archive_assets(self._pending(stage, ids), self.batch_size,
+                                                     self.async_api.concurrency, self.max_tries, on_batch=finished)
+        return StageResult(stage, archived, failed, time.monotonic() - start)
+
+    def apply(self, plan: ChangePlan) -> List[StageResult]:
+        """
+        Make every write of the plan, additions before removals.
+
+        :return: the outcome of every kind of write.
+        """
+        return [
+            self._map('add_ips', self.api.add_ip, plan.add_ips),
+            self._map('add_sources', self.api.add_source, plan.add_sources),
+            self._archive('archive_assets', plan.archive_assets),
+            self._map('delete_sources', self.api.delete_source, plan.delete_sources),
+        ]
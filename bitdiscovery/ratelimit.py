@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks (Windows), the buckets are then only shared between the threads of a process
+    fcntl = None
+
+# Bit Discovery doesn't document a rate limit, so there is no client side budget unless one is set
+DEFAULT_READS_PER_SECOND: float = 0.0
+DEFAULT_WRITES_PER_SECOND: float = 0.0
+
+
+class RateLimiter:
+    """
+    Client side token buckets for one API key, with separate budgets for reads and writes.
+
+    The bucket state is kept in a small locked file in `state_dir`, so every thread and every process using the same
+    API key draws from the same budget.
+    """
+    rates: Dict[str, float]
+    burst: Dict[str, float]
+    path: Optional[str]
+
+    def __init__(self, apikey: str, reads_per_second: float = DEFAULT_READS_PER_SECOND,
+                 writes_per_second: float = DEFAULT_WRITES_PER_SECOND, state_dir: Optional[str] = None):
+        """
+        :param apikey: The API key the budget belongs to (only a hash of it is written to disk).
+        :param reads_per_second: The read budget, 0 for unlimited.
+        :param writes_per_second: The write budget, 0 for unlimited.
+        :param state_dir: Where the shared bucket file is kept, by default the temporary directory.
+        """
+        self.rates = {'read': reads_per_second, 'write': writes_per_second}
+        # Allow a burst of one second worth of calls
+        self.burst = {kind: max(rate, 1.0) for (kind, rate) in self.rates.items()}
+        self._lock = threading.Lock()
+        self._state: Dict[str, List[float]] = {}
+
+        if fcntl is not None:
+            keyhash = hashlib.sha256(apikey.encode()).hexdigest()[:16]
+            self.path = os.path.join(state_dir or tempfile.gettempdir(), f'bitdiscovery-ratelimit-{keyhash}.json')
+        else:
+            self.path = None
+
+    def _take(self, state: Dict[str, List[float]], kind: str, now: float) -> float:
+        # Refill the bucket and take a token, or return how long to wait for one
+        rate = self.rates[kind]
+        tokens, updated = state.get(kind, [self.burst[kind], now])
+        tokens = min(self.burst[kind], tokens + max(now - updated, 0.0) * rate)
+        if tokens >= 1.0:
+            state[kind] = [tokens - 1.0, now]
+            return 0.0
+        state[kind] = [tokens, now]
+        return (1.0 - tokens) / rate
+
+    def _take_shared(self, kind: str, now: float) -> float:
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or '{}')
+                except ValueError:
+                    state = {}
+                wait = self._take(state, kind, now)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return wait
+
+    def acquire(self, kind: str = 'read') -> float:
+        """
+        Block until the budget allows another call.
+
+        :param kind: The endpoint class, either 'read' or 'write'.
+        :return: the number of seconds waited.
+        """
+        if self.rates.get(kind, 0) <= 0:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.time()
+                if self.path is not None:
+                    wait = self._take_shared(kind, now)
+                else:
+                    wait = self._take(self._state, kind, now)
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
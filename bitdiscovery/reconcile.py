@@ -0,0 +1,91 @@
+from typing import Iterable, List, Optional, Set
+from bitdiscovery.ipindex import IntervalIndex, ip_key, key_to_ip, parse_range
+
+
+class ReconciliationPlan:
+    """
+    The outcome of comparing the cloud IPs with the Bit Discovery inventory, as IP address strings.
+    """
+    to_add: List[str]
+    unchanged: List[str]
+    covered: List[str]
+    stale: List[str]
+
+    def __init__(self, to_add: List[str], unchanged: List[str], covered: List[str], stale: List[str]):
+        """
+        :param to_add: Cloud IPs missing from Bit Discovery.
+        :param unchanged: Cloud IPs that already are IP sources or assets.
+        :param covered: Cloud IPs inside a CIDR or range source, which don't need their own source.
+        :param stale: IP sources in Bit Discovery that weren't found in the cloud.
+        """
+        self.to_add = to_add
+        self.unchanged = unchanged
+        self.covered = covered
+        self.stale = stale
+
+
+class Reconciler:
+    """
+    Compares cloud IPs with the IPs and ranges in Bit Discovery with hashed set operations over integer IP keys, and
+    interval lookups for the range sources.
+
+    Sources, inventory IPs and cloud IPs can be streamed in, in any order and as many times as needed, before
+    calling plan.
+    """
+
+    def __init__(self, scope: Optional[IntervalIndex] = None):
+        """
+        :param scope: Only IPs inside this index can be stale (e.g. the provider's IP space), by default every IP.
+        """
+        self.scope = scope
+        self.sources: Set[int] = set()
+        self.assets: Set[int] = set()
+        self.ranges = IntervalIndex()
+        self.cloud: Set[int] = set()
+        self.invalid: List[str] = []
+
+    def add_source(self, keyword: str) -> None:
+        """
+        Add an IP range source (a single IP, a CIDR or a dash range), other keywords are ignored.
+        """
+        span = parse_range(keyword)
+        if span is None:
+            return
+        if span[0] == span[1]:
+            self.sources.add(span[0])
+        else:
+            self.ranges.add(span[0], span[1])
+
+    def add_inventory_ips(self, ips: Iterable[str]) -> None:
+        """
+        Add the IPs of inventory assets, these don't have to be added but are never stale (they may be found through
+        other sources, like domain names hosted in the cloud).
+        """
+        for ip in ips:
+            key = ip_key(ip)
+            if key is not None:
+                self.assets.add(key)
+
+    def add_cloud_ips(self, ips: Iterable[str]) -> None:
+        for ip in ips:
+            key = ip_key(ip)
+            if key is not None:
+                self.cloud.add(key)
+            else:
+                self.invalid.append(ip)
+
+    def plan(self) -> ReconciliationPlan:
+        self.ranges.build()
+        known = self.sources | self.assets
+        missing = sorted(self.cloud - known)
+        inside = self.ranges.contains_keys(missing)
+        stale = sorted(self.sources - self.cloud)
+        if self.scope is not None:
+            stale = [key for (key, inscope) in zip(stale, self.scope.contains_keys(stale)) if inscope]
+
+        return ReconciliationPlan(
+            to_add=[key_to_ip(key) for (key, covered) in zip(missing, inside) if not covered],
+            unchanged=[key_to_ip(key) for key in sorted(self.cloud & known)],
+            covered=[key_to_ip(key) for (key, covered) in zip(missing, inside) if covered],
+            stale=[key_to_ip(key) for key in stale],
+        )
@@ -0,0 +1,233 @@
+import functools
+import io
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+from PyPDF2 import PageObject, PdfFileReader, PdfFileWriter
+from bitdiscovery.api import BitDiscoveryApi, try_multiple_times
+from bitdiscovery.pdf import PdfBuilder, PdfPage
+from bitdiscovery.ratelimit import RateLimiter
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+pages: List[PdfPage] = [
+    PdfPage('ports.ports', 'Listening Ports', "The most common listening ports on the Internet-accessible assets."),
+    PdfPage('own_header.responsecode', 'HTTP/S Response Codes',
+            'The HTTP/S response codes for websites which represent whether the site is OK (200-299 responses), the page is redirecting (300-399 responses), content is not found (400 responses), or an error is found (500 responses)'),
+    PdfPage('wtech.Content Management Systems', 'Content Management Systems',
+            "A content management system (CMS) is a software application that can be used to manage the creation and modification of digital content."),
+    PdfPage('wtech.Blogs', 'Blogs',
+            "A blog is a discussion or informational website published consisting of discrete, often informal diary-style text entries (posts)."),
+    PdfPage('ipgeo.asn', 'ASNs',
+            "The top Autonomous System Numbers (ASNs) where the Internet-accessible assets are located by IP-address range. ASNs are a unique number that's available globally to identify an autonomous system and which enables that system to exchange exterior routing information with other neighboring autonomous systems."),
+    PdfPage('ssl.issuer_CN', 'SSL/TLS Certificate Authorities',
+            "The top SSL/TLS Certificate Authorities (CAs) seen in use by the Internet-accessible assets. A CA is an entity that issues digital certificates."),
+    PdfPage('ssl.sslerror', 'SSL/TLS Errors',
+            'The SSL/TLS errors that are found on the website in question as seen by an Internet browser like Chrome.'),
+    PdfPage('rbls.rbls', 'Reputation Block Lists',
+            'Reputation Block Lists protect home and corporate users from visiting sites on the Internet that may have malware, or may be sending spam emails or advertising to users.'),
+    PdfPage('ipgeo.country', 'Hosting Countries',
+            "The top countries where the Internet-accessible assets are physically located as determined by third-party geolocation of IP-address ranges."),
+    PdfPage('wtech.Content Delivery Networks', 'Hosted by CDNs',
+            "The top Content Delivery Networks (Akamai, Cloudflare, Fastly, and others) where the Internetaccessible assets are being delivered, which is determined by their well-known and published IPaddress ranges. CDNs refers to a geographically distributed group of servers which work together to provide fast delivery of Internet content."),
+    PdfPage('own_header.server', 'Servers',
+            "The top web servers running on the Internet-accessible assets based upon their HTTP response headers. The following data may include software distribution, major version, and minor version."),
+]
+
+CHART_RENDERERS: List[str] = ['vector', 'matplotlib']
+BAR_COLORS: List[str] = ['#3C84C1', '#5DC3C7', '#53b006', '#EEAE68', '#DD6069']
+
+
+class BarChart:
+    """
+    Renders the bar charts of the report pages as PNG images in memory with matplotlib (imported on first use, it is
+    only needed by this renderer).
+
+    The same figure and axes are cleared and drawn again for every chart. The figure isn't registered with pyplot,
+    so nothing else keeps it alive, and close releases what it holds.
+    """
+    figure: 'Figure'
+
+    def __init__(self, width: float = 9, height: float = 5):
+        """
+        :param width: The width of the charts in inches.
+        :param height: The height of the charts in inches.
+        """
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.figure = Figure(figsize=(width, height))
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+
+    def __enter__(self) -> 'BarChart':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.figure.clear()
+
+    def render(self, values: Sequence[int]) -> io.BytesIO:
+        """
+        :param values: The height of every bar.
+        :return: the chart as a PNG image with a transparent background.
+        """
+        axes = self.axes
+        axes.clear()
+        for spine in axes.spines.values():
+            spine.set_visible(False)
+        axes.set_ylabel('Assets')
+        axes.grid()
+        axes.bar(list(range(len(values))), values, color=BAR_COLORS)
+        axes.set_xticks([])
+
+        image = io.BytesIO()
+        self.figure.savefig(image, format='png', transparent=True)
+        image.seek(0)
+        return image
+
+
+def fetch_dashboard(apiurl: str, apikey: str, reads_per_second: float, max_tries: int = 5) -> Optional[Dict[str, Any]]:
+    """
+    Query the dashboard aggregations of every report page of an inventory.
+
+    :param apiurl: The base URL of the API.
+    :param apikey: The inventory API key.
+    :param reads_per_second: The read budget of the API key, 0 for unlimited.
+    :param max_tries: The number of tries before giving up.
+    :return: the dashboard, or None if the call kept failing.
+    """
+    querytypes = "%2C".join(map(lambda page: page.key, pages))
+    with BitDiscoveryApi(apiurl, apikey, rate_limiter=RateLimiter(apikey, reads_per_second)) as api:
+        return try_multiple_times(lambda: api.get_dashboard(querytypes), max_tries=max_tries)
+
+
+def report_filename(entityname: str, report_date: str) -> str:
+    return f'{entityname.replace(" ", "_")}-{report_date}.pdf'
+
+
+@functools.lru_cache(maxsize=None)
+def static_pages(path: str) -> List[PageObject]:
+    """
+    The pages of a static PDF of the report (e.g. 2-6.pdf), parsed once per process and shared by every report.
+    """
+    return list(PdfFileReader(path).pages)
+
+
+def build_report(entityname: str, dashboard: Dict[str, Any], resource_directory: str, output_directory: str,
+                 report_date: str, charts: str = 'vector') -> str:
+    """
+    Render the report of an inventory from its dashboard.
+
+    The title and body pages are built as one document in memory, and written out with the static pages in one pass,
+    without intermediate files, so reports of several inventories can be built at the same time (see
+    start_renderers).
+
+    :param entityname: The name of the inventory.
+    :param dashboard: The dashboard of the inventory, as returned by fetch_dashboard.
+    :param resource_directory: The directory of the fonts, images and static PDF pages.
+    :param output_directory: Where the report is written.
+    :param report_date: The date in the report file name (YYYYMMDD).
+    :param charts: How the charts are drawn, one of CHART_RENDERERS.
+    :return: the path of the report.
+    """
+    pdf = PdfBuilder(entityname, resource_directory)
+
+    # Build title page
+    pdf.add_title_page()
+
+    # Build body of the document
+    totalsize: int = dashboard['stats']['total']
+    domaincount: int = dashboard['stats']['domaincount']
+    subdomaincount: int = dashboard['stats']['subdomaincount']
+
+    pagedata: Dict[str, List[Dict[str, Any]]] = {}
+    for aggregation in dashboard['aggregations']:
+        pagedata[aggregation['column']] = aggregation['data']
+
+    # Add asset page
+    pdf.add_count_page(
+        "asset",
+        """
+        "A domain name, subdomain, or IP address and/or combination thereof of a device connected to the Internet or
+        internal network. An asset may include but is not limited to web servers, name servers, IoT devices, network
+        printers, etc. Example: foo.tld, bar.foo.tld, x.x.x.x"
+        """,
+        totalsize
+    )
+
+    # Add domain page
+    pdf.add_count_page(
+        "domain",
+        """
+        A domain name is a label that identifies a network domain. Domain names are used to identify Internet resources,
+        such as computers, networks and services, with an easy-to-remember text label that is easier to memorize than the
+        numerical addresses used in Internet protocols.
+        """,
+        domaincount
+    )
+
+    # Add subdomain page
+    pdf.add_count_page(
+        "subdomain",
+        """
+        A subdomain is a domain name with a hostname appended, which is sometimes more accurately described as a fully
+        qualified domain name (FQDN).
+        """,
+        subdomaincount
+    )
+
+    # Build graph pages for each page type
+    with BarChart() if charts == 'matplotlib' else nullcontext() as chart:
+        for page in pages:
+            data = pagedata[page.key] if page.key in pagedata else []
+
+            # Generate graph, the vector charts are drawn by the builder from the data
+            image: Optional[io.BytesIO] = None
+            if chart is not None:
+                image = chart.render([row["value"] for row in data if str(row['name']) != "__missing__"])
+
+            # Generate page from page data and graph
+            pdf.add_graph_page(page, data, image, totalsize)
+
+    # Put the static pages after the title page and at the end
+    generated = PdfFileReader(io.BytesIO(pdf.output())).pages
+    writer = PdfFileWriter()
+    writer.add_page(generated[0])
+    for static_page in static_pages(os.path.join(resource_directory, '2-6.pdf')):
+        writer.add_page(static_page)
+    for body_page in generated[1:]:
+        writer.add_page(body_page)
+    for static_page in static_pages(os.path.join(resource_directory, '15-17.pdf')):
+        writer.add_page(static_page)
+
+    path = os.path.join(output_directory, report_filename(entityname, report_date))
+    with open(path, 'wb') as output:
+        writer.write(output)
+    return path
+
+
+def start_renderers(jobs: int) -> Executor:
+    """
+    Start the workers to run build_report in. With more than one job they are processes, so the reports of several
+    inventories are rendered in parallel, a single job renders in a thread of this process.
+
+    Where possible the processes are forked, so they start with the modules of the script already imported, and
+    they are all started right away, before the caller starts threads of its own. Elsewhere (Windows) they are
+    spawned, and import the script again, so its work has to be under a __main__ guard.
+
+    :param jobs: The number of workers.
+    """
+    if jobs <= 1:
+        return ThreadPoolExecutor(max_workers=1)
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('spawn'))
+    renderers = ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('fork'))
+    # With fork, the first task launches every worker
+    renderers.submit(os.getpid).result()
+    return renderers
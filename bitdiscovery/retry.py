@@ -0,0 +1,216 @@
+import random
+import re
+import threading
+import time
+import requests
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+# Timeouts, rate limiting and server side errors are worth another try, every other HTTP error is fatal
+RETRYABLE_STATUSES: Tuple[int, ...] = (408, 425, 429, 500, 502, 503, 504)
+
+
+class HttpStatusError(Exception):
+    """
+    Raised for an HTTP error response, with the status code and the Retry-After delay (in seconds) if one was sent.
+    """
+    status: int
+    endpoint: str
+    retry_after: Optional[float]
+
+    def __init__(self, status: int, endpoint: str, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status} from {endpoint}")
+        self.status = status
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header, which is either a number of seconds or an HTTP date.
+
+    :param value: The header value (or None).
+    :return: the number of seconds to wait, or None if missing or unparsable.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def endpoint_name(url: str) -> str:
+    """
+    Normalize a URL to an endpoint name for statistics, e.g. '/source/{id}/delete'.
+
+    :param url: The URL (or path) that was called.
+    :return: the path with numeric segments replaced.
+    """
+    path = urlparse(url).path
+    path = re.sub(r'^/api/[0-9.]+', '', path)
+    return re.sub(r'/\d+(?=/|$)', '/{id}', path) or '/'
+
+
+class RetryStats:
+    """
+    The retry counters of one endpoint.
+    """
+    retries: int
+    failures: int
+    waited: float
+
+    def __init__(self):
+        self.retries = 0
+        self.failures = 0
+        self.waited = 0.0
+
+
+class CircuitBreaker:
+    """
+    Pauses every caller sharing it for `cooldown` seconds when the error rate of the last `window` calls reaches
+    `threshold`, so concurrent workers back off together instead of producing a retry storm.
+    """
+    window: int
+    threshold: float
+    min_calls: int
+    cooldown: float
+
+    def __init__(self, window: int = 50, threshold: float = 0.5, min_calls: int = 10, cooldown: float = 30.0):
+        self.window = window
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.opened = 0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, success: bool) -> None:
+        with self._lock:
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.threshold:
+                self._open_until = time.monotonic() + self.cooldown
+                self._outcomes.clear()
+                self.opened += 1
+                print(f"ERROR: too many failing API calls, pausing for {self.cooldown:.0f} seconds.")
+
+    def wait(self) -> None:
+        """
+        Block while the breaker is open.
+        """
+        while True:
+            with self._lock:
+                remaining = self._open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+
+class RetryPolicy:
+    """
+    Retries failing calls with exponential backoff and full jitter, honoring Retry-After and giving up right away on
+    fatal HTTP errors. The policy, its circuit breaker and its statistics are meant to be shared by every worker.
+    """
+    max_tries: int
+    base_delay: float
+    max_delay: float
+    retry_statuses: Tuple[int, ...]
+    breaker: CircuitBreaker
+    stats: Dict[str, RetryStats]
+
+    def __init__(self, max_tries: int = 5, base_delay: float = 0.5, max_delay: float = 30.0,
+                 retry_statuses: Tuple[int, ...] = RETRYABLE_STATUSES, breaker: Optional[CircuitBreaker] = None):
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, HttpStatusError):
+            return error.status in self.retry_statuses
+        # Connection errors, timeouts and unparsable (e.g. truncated JSON) responses are assumed to be transient, any
+        # other error is a bug that another try won't fix
+        return isinstance(error, (requests.RequestException, ValueError))
+
+    def get_delay(self, attempt: int, error: Exception) -> float:
+        """
+        :param attempt: The number of the failed attempt, starting from 0.
+        :param error: The error of the failed attempt.
+        :return: the seconds to wait before the next attempt.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if isinstance(error, HttpStatusError) and error.retry_after is not None:
+            delay = max(delay, min(error.retry_after, self.max_delay * 4))
+        return delay
+
+    def _record(self, error: Exception, retried: bool, waited: float) -> None:
+        if isinstance(error, HttpStatusError):
+            endpoint = error.endpoint
+        else:
+            request = getattr(error, 'request', None)
+            endpoint = endpoint_name(request.url) if getattr(request, 'url', None) else 'other'
+        with self._lock:
+            stats = self.stats.setdefault(endpoint, RetryStats())
+            if retried:
+                stats.retries += 1
+                stats.waited += waited
+            else:
+                stats.failures += 1
+
+    def call(self, fn: Callable[[], Any], max_tries: Optional[int] = None) -> Any:
+        """
+        Run a function until it returns, at most `max_tries` times.
+
+        :param fn: The function to run (it should return on success, throw on failure).
+        :param max_tries: Overrides the number of tries of the policy.
+        :return: the returned value, the last error is raised if every try failed.
+        """
+        tries = max_tries if max_tries is not None else self.max_tries
+        attempt = 0
+        while True:
+            self.breaker.wait()
+            try:
+                result = fn()
+            except Exception as e:
+                retryable = self.is_retryable(e)
+                # Only failures of the API itself count, e.g. a 404 for a source that is already gone doesn't
+                if retryable:
+                    self.breaker.record(False)
+                attempt += 1
+                if attempt >= tries or not retryable:
+                    self._record(e, False, 0.0)
+                    raise
+                delay = self.get_delay(attempt - 1, e)
+                self._record(e, True, delay)
+                print(f"ERROR: {str(e)} (retrying in {delay:.1f}s)")
+                time.sleep(delay)
+                continue
+            self.breaker.record(True)
+            return result
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: the retries, failures and seconds waited per endpoint.
+        """
+        with self._lock:
+            return {endpoint: {'retries': s.retries, 'failures': s.failures, 'waited': round(s.waited, 1)}
+                    for (endpoint, s) in self.stats.items()}
+
+
+# The policy shared by try_multiple_times, so every worker of a process sees the same circuit breaker
+default_policy = RetryPolicy()
@@ -1,29 +1,108 @@
 #!/usr/bin/python3
 import sys
 from argparse import ArgumentParser
-from typing import Dict, Any, Optional, List
-from bitdiscovery.api import BitDiscoveryApi, try_multiple_times, get_lastid
+from typing import Dict, Any, Optional, List, Set, Iterator
+from bitdiscovery.api import BitDiscoveryApi, ApiError
+from bitdiscovery.mirror import InventoryMirror
+from bitdiscovery.journal import Journal, PageCheckpoint
+from bitdiscovery.ipindex import IntervalIndex, ip_key, parse_range
+from bitdiscovery.ratelimit import RateLimiter, DEFAULT_READS_PER_SECOND, DEFAULT_WRITES_PER_SECOND
+from bitdiscovery.retry import default_policy
+from bitdiscovery.asyncapi import AsyncBitDiscoveryApi, run_sync
 
 parser = ArgumentParser(description="Delete source or IP from inventory")
 parser.add_argument('apikey', metavar="APIKEY", type=str, help="Your Bit Discovery API key.")
 parser.add_argument('type', metavar="TYPE", type=str, choices=['ip', 'source'], help="The type of the item to delete.")
-parser.add_argument('value', metavar="IP/SOURCE", type=str, help="The IP or source to be deleted.")
+parser.add_argument('value', metavar="IP/SOURCE", type=str, nargs='?', help="The IP or source to be deleted.")
+parser.add_argument('--file', type=str,
+                    help="Delete every IP, CIDR, IP range and source keyword listed in this file, one per line "
+                         "('-' reads from the standard input).")
+parser.add_argument('--mirror', action='store_true',
+                    help="Look up the assets and sources in a local copy of the inventory, which is synced first.")
+parser.add_argument('--resume', action='store_true',
+                    help="Continue an interrupted or failed run with the same arguments where it stopped.")
 parser.add_argument('--env', choices=['dev', 'staging', 'prod'], default="dev",
                     help="The Bit Discovery environment (by default 'dev')")
 parser.add_argument('--offset', type=int, default=0, help="Offset to the API request data (by default 0).")
-parser.add_argument('--limit', type=int, default=5000, help="Limit to the API request data (by default 500).")
+parser.add_argument('--limit', type=int, default=5000, help="Limit to the API request data (by default 5000).")
+parser.add_argument('--batch-size', type=int, default=100,
+                    help="The number of assets archived with one API call (by default 100).")
+parser.add_argument('--concurrency', type=int, default=10,
+                    help="The number of API calls to run at the same time (by default 10).")
+parser.add_argument('--reads-per-second', type=float, default=DEFAULT_READS_PER_SECOND,
+                    help="Read API calls allowed per second and API key (by default 0, unlimited).")
+parser.add_argument('--writes-per-second', type=float, default=DEFAULT_WRITES_PER_SECOND,
+                    help="Write API calls allowed per second and API key (by default 0, unlimited).")
 args = parser.parse_args()
 
 APIKEY: str = args.apikey
 APIURL: str = "https://bitdiscovery.com/api/1.0"
 OFFSET: int = args.offset
 LIMIT: int = args.limit
+BATCH_SIZE: int = args.batch_size
+CONCURRENCY: int = args.concurrency
+READS_PER_SECOND: float = args.reads_per_second
+WRITES_PER_SECOND: float = args.writes_per_second
 IP_TYPE: str = args.type
-VALUE: str = args.value
+VALUE: Optional[str] = args.value
+FILE: Optional[str] = args.file
+MIRROR: bool = args.mirror
+RESUME: bool = args.resume
+
+if (VALUE is None) == (FILE is None):
+    parser.error("give either an IP/SOURCE or a --file")
+
+# Read the values to delete
+values: List[str] = [VALUE] if VALUE is not None else []
+if FILE is not None:
+    with (sys.stdin if FILE == '-' else open(FILE)) as f:
+        values = [line.split('#', 1)[0].strip() for line in f]
+
+# Index the values: exact IPs in a hash set, CIDRs and ranges as intervals, and every value as a source keyword
+exact_ips: Set[int] = set()
+ip_ranges = IntervalIndex()
+keywords: Set[str] = set()
+for value in values:
+    value = value.lower()
+    if value == '':
+        continue
+    keywords.add(value)
+    span = parse_range(value)
+    if span is None:
+        continue
+    if span[0] == span[1]:
+        exact_ips.add(span[0])
+    else:
+        ip_ranges.add(span[0], span[1])
+ip_ranges.build()
+
+# A single IP or keyword is searched for by the API, a CIDR or range can only be matched against every asset and source
+SEARCH: Optional[str] = VALUE
+if VALUE is not None:
+    value_span = parse_range(VALUE.lower())
+    if value_span is not None and value_span[0] != value_span[1]:
+        SEARCH = None
+
+
+def asset_matches(asset: Dict[str, Any]) -> bool:
+    key = ip_key(str(asset.get('bd.ip_address', '')))
+    return key is not None and (key in exact_ips or ip_ranges.contains_key(key))
+
+
+def source_matches(source: Dict[str, Any]) -> bool:
+    keyword = str(source.get('keyword', '')).lower()
+    if keyword in keywords:
+        return True
+    # IP and range sources also match when a listed CIDR or range covers them completely
+    span = parse_range(keyword)
+    return span is not None and ((span[0] == span[1] and span[0] in exact_ips) or ip_ranges.covers(span[0], span[1]))
+
 
 print("Initializing and pulling assets from Bit Discovery...")
 
-api = BitDiscoveryApi(APIURL, APIKEY)
+api = BitDiscoveryApi(APIURL, APIKEY, pool_size=CONCURRENCY,
+                      rate_limiter=RateLimiter(APIKEY, READS_PER_SECOND, WRITES_PER_SECOND))
+async_api = AsyncBitDiscoveryApi(api, CONCURRENCY)
 inventories_json: Dict[str, Any] = {}
 try:
     inventories_json = api.find_inventories(OFFSET, LIMIT)
@@ -34,100 +113,137 @@ except:
 # TODO: maybe remove iteration if we cannot delete from multiple inventories
 inventories: Dict[str, str] = {inventories_json['actualInventory']['inventory_name']: APIKEY}
 
+
+def show_progress(cursor: str, offset: int, total: int):
+    if offset < total:
+        print("\t\t{0:.0%} complete.".format(offset / float(total)))
+
+
+# Progress is journaled, so a failed run can be continued with --resume without repeating the deletions
+journal = Journal('delete-ip', '\n'.join([APIKEY, IP_TYPE] + values), resume=RESUME)
+if journal.resumed:
+    print("Resuming the previous run.")
+
+
 for entityname in inventories:
-    jsondata: List[Dict[str, Any]] = []
+    # Bring the local mirror up to date, only the changes since the last run are downloaded
+    mirror: Optional[InventoryMirror] = None
+    if MIRROR:
+        print("Syncing the local copy of: " + str(entityname) + ".")
+        mirror = InventoryMirror(api)
+        try:
+            # A single IP is searched for by the API either way, see below
+            newassets = mirror.sync_assets(LIMIT) if IP_TYPE == 'ip' and SEARCH is None else 0
+            newsources = mirror.sync_sources(LIMIT)
+        except ApiError:
+            print("\tAPI call failed too many times. Try again later.")
+            exit(1)
+        print(f"\t\tDownloaded {newassets} assets and {newsources} sources.")
 
     deletednum = 0
     if IP_TYPE == 'ip':
         print("Starting inventory: " + str(entityname) + ".")
 
-        # Collect the IP addresses from Bit Discovery inventory with pagination
-        lastid: str = ''
-        offset: int = OFFSET
-        while True:
-            result: Optional[Dict[str, Any]] = try_multiple_times(
-                lambda: api.search_for_ip_address(LIMIT, lastid, VALUE),
-                max_tries=5
-            )
-
-            if result is None:
+        # The cursor is only journaled once every asset before it was archived
+        checkpoint = PageCheckpoint(journal, 'assets')
+        archived_before = journal.done('assets')
+
+        def next_page(cursor: str, offset: int, total: int):
+            checkpoint.page_done(cursor)
+            show_progress(cursor, offset, total)
+
+        # Stream the IP addresses from Bit Discovery inventory once and archive the matching assets in batches
+        if SEARCH is not None:
+            assets: Iterator[Dict[str, Any]] = api.iter_ip_matches(SEARCH, LIMIT, journal.cursor('assets'),
+                                                                   on_page=next_page)
+        elif mirror is not None:
+            # The IPs of assets in the mirror are only updated by the daily full sync, so it only tells which IPs to
+            # look at, and their assets are searched for again before anything is archived
+            mirror_ips = sorted({str(asset['bd.ip_address']) for asset in mirror.assets() if asset_matches(asset)})
+            print(f"\t\tLooking up the assets of {len(mirror_ips)} IPs.")
+            current_assets: Dict[str, Optional[List[str]]] = run_sync(async_api.map(
+                lambda ip: [str(asset['id']) for asset in api.iter_ip_matches(ip, LIMIT)], mirror_ips, 1))
+            if None in current_assets.values():
                 print("\tAPI call failed too many times. Try again later.")
                 exit(1)
+            assets = ({'id': asset_id, 'bd.ip_address': ip} for ip in mirror_ips for asset_id in current_assets[ip])
+        else:
+            assets = api.iter_inventory(LIMIT, journal.cursor('assets'), on_page=next_page)
+        # Only kept to update the mirror, the IDs are streamed otherwise
+        matched_ids: List[str] = []
+
+        def matching_ids() -> Iterator[str]:
+            for asset in assets:
+                asset_id = str(asset['id'])
+                if asset_matches(asset) and asset_id not in archived_before:
+                    if mirror is not None:
+                        matched_ids.append(asset_id)
+                    checkpoint.add(asset_id)
+                    yield asset_id
+
+        def archived(batch: List[str], failed: List[str]):
+            checkpoint.complete(list(set(batch) - set(failed)))
+
+        try:
+            (archivednum, failed_ids) = api.archive_assets(matching_ids(), BATCH_SIZE, workers=CONCURRENCY,
+                                                           on_batch=archived)
+        except ApiError:
+            print("\tAPI call failed too many times. Try again later.")
+            exit(1)
+        deletednum += archivednum
 
-            # Append to results list if successfully found
-            jsondata.append(result)
-            lastid = get_lastid(result)
-            offset += LIMIT
-            total: int = int(jsondata[0]['total'])
-
-            if offset < total:
-                print("\t\t{0:.0%} complete.".format(offset / float(total)))
-            else:
-                # Exit when the total is reached
-                break
-
-        # Iterate over the returned assets and remove the matching assets
-        for assets in jsondata:
-            for asset in assets.get("assets", []):
-                if 'bd.ip_address' in asset and str(asset['bd.ip_address']) == VALUE:
-                    # Try to call to IP archivation API endpoint
-                    result: Optional[bool] = try_multiple_times(
-                        lambda: api.archive_ip(asset['id']),
-                        max_tries=5
-                    )
-
-                    if result is None:
-                        print("\tAPI call failed too many times. Try again later.")
-                        exit(1)
-
-                    # Increment deleted count
-                    deletednum += 1
+        if mirror is not None:
+            mirror.remove_assets(set(matched_ids) - set(failed_ids))
+
+        if len(failed_ids) > 0:
+            for failed_id in failed_ids:
+                print(f"\tCouldn't archive asset: {failed_id}")
+            print("\tAPI call failed too many times. Try again later.")
+            exit(1)
 
     # TODO: shouldn't we "else" here?
 
     print("Starting sources for: " + str(entityname) + ".")
 
-    sourcesdata: List[Dict[str, Any]] = []
-
-    # Collect the sources from Bit Discovery inventory with pagination
-    lastid: str = ''
-    offset: int = OFFSET
-    while True:
-        result: Optional[Dict[str, Any]] = try_multiple_times(
-            lambda: api.search_for_source(LIMIT, lastid, VALUE),
-            max_tries=5
-        )
+    # Stream the sources from Bit Discovery inventory once and collect all matching values
+    source_ids: List[str] = []
+    if mirror is not None:
+        sources: Iterator[Dict[str, Any]] = mirror.sources(SEARCH or '')
+    else:
+        sources = api.iter_sources(LIMIT, SEARCH or '', on_page=show_progress, max_tries=5)
+    try:
+        for source in sources:
+            if source_matches(source) and str(source['id']) not in journal.done('sources'):
+                source_ids.append(str(source['id']))
+    except ApiError:
+        print("\tAPI call failed too many times. Try again later.")
+        exit(1)
+
+    # Try to call to source delete API endpoint
+    def deleted(source_id: str, result: Optional[bool]):
+        if result is not None:
+            journal.mark_done('sources', [source_id])
+
+    removed: Dict[str, Optional[bool]] = run_sync(async_api.map(api.delete_source, source_ids, max_tries=5,
+                                                                on_result=deleted))
+    removednum = len([source_id for source_id in removed if removed[source_id] is not None])
+    deletednum += removednum
+
+    if mirror is not None:
+        mirror.remove_sources([source_id for source_id in removed if removed[source_id] is not None])
+        mirror.close()
+
+    if removednum < len(removed):
+        print("\tAPI call failed too many times. Try again later.")
+        exit(1)
 
-        if result is None:
-            print("\tAPI call failed too many times. Try again later.")
-            exit(1)
+    print("\tDeleted a total of " + str(deletednum) + " IPs.")
 
-        # Append to sources list if successfully found
-        sourcesdata.append(result)
-        lastid = get_lastid(result)
-        offset += LIMIT
-        total: int = int(sourcesdata[0]['total'])
-        if offset < total:
-            print("\t\t{} complete.".format('{0:.0%}'.format(offset / float(total))))
-        else:
-            # Exit when the total is reached
-            break
-
-    # Iterate over the sources and remove all matching values
-    for sources in sourcesdata:
-        for source in sources.get('searches', []):
-            if 'keyword' in source and str(source['keyword']).lower() == VALUE:
-                # Try to call to source delete API endpoint
-                result: Optional[bool] = try_multiple_times(
-                    lambda: api.delete_source(str(source['id'])),
-                    max_tries=5
-                )
-
-                if result is None:
-                    print("\tAPI call failed too many times. Try again later.")
-                    exit(1)
-
-                # Increment deleted count
-                deletednum += 1
+journal.finish()
 
-    print("\tDeleted a total of " + str(deletednum) + " IPs.")
+async_api.close()
+stats = api.connection_stats()
+print(f"\t{stats['requests']} API requests over {stats['connections']} connections ({stats['reused']} reused).")
+for (endpoint, retries) in default_policy.summary().items():
+    print(f"\t{endpoint}: {retries['retries']} retries ({retries['waited']}s waited), {retries['failures']} failures.")
+api.close()
@@ -0,0 +1,114 @@
+import json
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import parse_qs, urlparse
+import pytest
+from bitdiscovery.api import BitDiscoveryApi
+from bitdiscovery.retry import CircuitBreaker, HttpStatusError, default_policy
+
+
+class FakeResponse:
+    def __init__(self, body: Any):
+        self.body = body
+
+    def json(self) -> Any:
+        return self.body
+
+
+class FakeInventory:
+    """
+    Stands in for BitDiscoveryApi._request, answering from lists of assets and sources like the API does, and
+    recording every request.
+    """
+
+    def __init__(self, assets: List[Dict[str, Any]], sources: Optional[List[Dict[str, Any]]] = None,
+                 page_size: Optional[int] = None):
+        """
+        :param assets: The assets, with id and bd.ip_address, sorted by ID.
+        :param sources: The sources, with id, keyword and search_type.
+        :param page_size: The most records the server returns per page, whatever the limit asked for.
+        """
+        self.assets = assets
+        self.sources = sources or []
+        self.page_size = page_size
+        self.requests: List[str] = []
+        # Errors raised by the next requests instead of answering them
+        self.errors: List[Exception] = []
+        # IDs the server refuses to archive with a 400, failing the whole request
+        self.rejected: Set[str] = set()
+        self.hidden: List[str] = []
+        self.deleted: List[str] = []
+        self.added: List[str] = []
+
+    def page(self, records: List[Dict[str, Any]], start: int, limit: int) -> List[Dict[str, Any]]:
+        return records[start:start + min(limit, self.page_size or limit)]
+
+    def __call__(self, method: str, path: str, data: Optional[str] = None, kind: str = 'read') -> FakeResponse:
+        self.requests.append(f'{method} {path}')
+        if self.errors:
+            raise self.errors.pop(0)
+        url = urlparse(path)
+        query = {key: values[-1] for (key, values) in parse_qs(url.query, keep_blank_values=True).items()}
+
+        if url.path == '/inventory':
+            assets = self.assets
+            column = json.loads(data)[0]
+            if column['column'] == 'bd.ip_address':
+                assets = [asset for asset in assets if asset['bd.ip_address'] == column['value']]
+            start = 0
+            if 'after' in query:
+                start = next((i for (i, asset) in enumerate(assets) if int(asset['id']) > int(query['after'])),
+                             len(assets))
+            return FakeResponse({'total': len(assets), 'assets': self.page(assets, start, int(query['limit']))})
+
+        if url.path == '/sources':
+            sources = [source for source in self.sources if query['search'] in source['keyword']]
+            return FakeResponse({'total': len(sources),
+                                 'searches': self.page(sources, int(query['offset']), int(query['limit']))})
+
+        if url.path == '/asset/hide':
+            ids = [str(asset['id']) for asset in json.loads(data)]
+            if self.rejected.intersection(ids):
+                raise HttpStatusError(400, '/asset/hide')
+            self.hidden.extend(ids)
+            return FakeResponse({})
+
+        if url.path in ('/source/ip/add', '/source/add'):
+            self.added.append(next(iter(json.loads(data).values())))
+            return FakeResponse({})
+
+        if url.path.startswith('/source/') and url.path.endswith('/delete'):
+            self.deleted.append(url.path.split('/')[2])
+            return FakeResponse({})
+
+        if url.path == '/inventories/list':
+            return FakeResponse({'actualInventory': {'inventory_name': 'Test inventory'}, 'list': []})
+
+        raise HttpStatusError(404, url.path)
+
+
+def make_assets(count: int, first_ip: int = 1) -> List[Dict[str, Any]]:
+    return [{'id': i, 'bd.ip_address': f'10.0.{(first_ip + i - 1) // 256}.{(first_ip + i - 1) % 256}'}
+            for i in range(1, count + 1)]
+
+
+@pytest.fixture(autouse=True)
+def retry_policy(monkeypatch):
+    """
+    Retry without sleeping, and with a breaker of every test's own that doesn't pause.
+    """
+    monkeypatch.setattr(default_policy, 'base_delay', 0.0)
+    monkeypatch.setattr(default_policy, 'breaker', CircuitBreaker(cooldown=0.0))
+    monkeypatch.setattr(default_policy, 'stats', {})
+    return default_policy
+
+
+@pytest.fixture
+def make_api(monkeypatch):
+    """
+    Returns a function making a BitDiscoveryApi answered by a FakeInventory.
+    """
+    def make(inventory: FakeInventory) -> BitDiscoveryApi:
+        api = BitDiscoveryApi('https://bitdiscovery.com/api/1.0', 'KEY')
+        monkeypatch.setattr(api, '_request', inventory)
+        return api
+    return make
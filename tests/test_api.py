@@ -0,0 +1,100 @@
+import pytest
+import requests
+from conftest import FakeInventory, make_assets
+from bitdiscovery.api import ApiError
+from bitdiscovery.retry import HttpStatusError
+
+
+def archive_requests(inventory: FakeInventory) -> int:
+    return len([request for request in inventory.requests if request == 'POST /asset/hide'])
+
+
+def test_archive_assets_in_batches(make_api):
+    inventory = FakeInventory([])
+    batches = []
+    api = make_api(inventory)
+    ids = (str(i) for i in range(250))
+    assert api.archive_assets(ids, 100, workers=2, on_batch=lambda batch, failed: batches.append(len(batch))) \
+        == (250, [])
+    assert sorted(batches) == [50, 100, 100]
+    assert sorted(inventory.hidden, key=int) == [str(i) for i in range(250)]
+
+
+def test_archive_assets_finds_rejected_ids(make_api):
+    inventory = FakeInventory([])
+    inventory.rejected = {'7', '64'}
+    (archived, failed) = make_api(inventory).archive_assets([str(i) for i in range(100)], 100)
+    assert (archived, sorted(failed)) == (98, ['64', '7'])
+    assert len(inventory.hidden) == 98
+    # Bisecting takes a few requests per rejected ID, not one per ID
+    assert archive_requests(inventory) < 30
+
+
+def test_archive_assets_fails_whole_batches_on_fatal_errors(make_api):
+    for status in [401, 403, 404]:
+        inventory = FakeInventory([])
+        inventory.errors = [HttpStatusError(status, '/asset/hide') for _ in range(10)]
+        (archived, failed) = make_api(inventory).archive_assets([str(i) for i in range(200)], 100)
+        assert (archived, len(failed)) == (0, 200)
+        assert archive_requests(inventory) == 2
+
+
+def test_archive_assets_retries_without_bisecting(make_api):
+    inventory = FakeInventory([])
+    inventory.errors = [HttpStatusError(503, '/asset/hide') for _ in range(5)] + [requests.ConnectionError()] * 5
+    (archived, failed) = make_api(inventory).archive_assets([str(i) for i in range(200)], 100, max_tries=5)
+    assert (archived, len(failed)) == (0, 200)
+    assert archive_requests(inventory) == 10
+
+    inventory.errors = [HttpStatusError(503, '/asset/hide')]
+    assert make_api(inventory).archive_assets(['1', '2'], 100) == (2, [])
+
+
+def test_iter_sources_advances_by_the_records_returned(make_api):
+    sources = [{'id': i, 'keyword': f'example{i}.com', 'search_type': 'domain'} for i in range(25)]
+    # The server returns fewer sources than asked for
+    inventory = FakeInventory([], sources, page_size=7)
+    pages = []
+    found = list(make_api(inventory).iter_sources(10, on_page=lambda *page: pages.append(page)))
+    assert [source['id'] for source in found] == list(range(25))
+    assert pages == [('7', 7, 25), ('14', 14, 25), ('21', 21, 25), ('25', 25, 25)]
+    assert len(inventory.requests) == 4
+
+    resumed = list(make_api(inventory).iter_sources(10, after='14'))
+    assert [source['id'] for source in resumed] == list(range(14, 25))
+
+
+def test_iter_inventory_stops_on_a_short_page(make_api):
+    inventory = FakeInventory(make_assets(25))
+    pages = []
+    found = list(make_api(inventory).iter_inventory(10, on_page=lambda *page: pages.append(page)))
+    assert [asset['id'] for asset in found] == list(range(1, 26))
+    assert pages == [('10', 10, 25), ('20', 20, 25), ('25', 25, 25)]
+    assert len(inventory.requests) == 3
+
+
+def test_iter_inventory_resumed_after_an_id(make_api):
+    inventory = FakeInventory(make_assets(25))
+    pages = []
+    found = list(make_api(inventory).iter_inventory(10, after='10', on_page=lambda *page: pages.append(page)))
+    assert [asset['id'] for asset in found] == list(range(11, 26))
+    # The assets before the cursor aren't known, so there's no progress against the total
+    assert pages == [('20', 10, 0), ('25', 15, 0)]
+    assert len(inventory.requests) == 2
+
+
+def test_iter_ip_matches(make_api):
+    assets = make_assets(30)
+    for asset in assets[5:17]:
+        asset['bd.ip_address'] = '10.0.9.9'
+    inventory = FakeInventory(assets)
+    found = list(make_api(inventory).iter_ip_matches('10.0.9.9', 5))
+    assert [asset['id'] for asset in found] == list(range(6, 18))
+    assert len(inventory.requests) == 3
+
+
+def test_iter_pages_raise_api_error(make_api):
+    inventory = FakeInventory(make_assets(25))
+    inventory.errors = [HttpStatusError(401, '/inventory')]
+    with pytest.raises(ApiError):
+        list(make_api(inventory).iter_inventory(10))
@@ -0,0 +1,71 @@
+import threading
+import time
+from conftest import FakeInventory, make_assets
+from bitdiscovery.asyncapi import AsyncBitDiscoveryApi, run_sync
+from bitdiscovery.retry import HttpStatusError
+
+
+def collect(records) -> list:
+    async def consume():
+        return [record async for record in records]
+    return run_sync(consume())
+
+
+def test_map(make_api):
+    inventory = FakeInventory([])
+    async_api = AsyncBitDiscoveryApi(make_api(inventory), 4)
+    results = []
+    found = run_sync(async_api.map(async_api.api.add_ip, ['10.0.0.1', '10.0.0.2', '10.0.0.1'],
+                                   on_result=lambda value, result: results.append(value)))
+    assert found == {'10.0.0.1': True, '10.0.0.2': True}
+    assert sorted(results) == sorted(inventory.added) == ['10.0.0.1', '10.0.0.2']
+    async_api.close()
+
+
+def test_map_returns_none_for_failed_calls(make_api):
+    inventory = FakeInventory([])
+    inventory.errors = [HttpStatusError(404, '/source/{id}/delete')]
+    async_api = AsyncBitDiscoveryApi(make_api(inventory), 1)
+    assert run_sync(async_api.map(async_api.api.delete_source, ['1', '2'])) == {'1': None, '2': True}
+    async_api.close()
+
+
+def test_concurrency_is_bounded(make_api):
+    running = [0, 0]
+    lock = threading.Lock()
+
+    def call(value: str) -> str:
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return value
+
+    async_api = AsyncBitDiscoveryApi(make_api(FakeInventory([])), 3)
+    # Every run gets a loop of its own, the calls are bounded in each
+    for _ in range(2):
+        assert len(run_sync(async_api.map(call, [str(i) for i in range(20)]))) == 20
+    assert running[1] == 3
+    async_api.close()
+
+
+def test_iterators(make_api):
+    sources = [{'id': i, 'keyword': f'example{i}.com', 'search_type': 'domain'} for i in range(12)]
+    assets = make_assets(23)
+    assets[4]['bd.ip_address'] = assets[20]['bd.ip_address'] = '10.0.9.9'
+    async_api = AsyncBitDiscoveryApi(make_api(FakeInventory(assets, sources)), 2)
+    assert [asset['id'] for asset in collect(async_api.iter_inventory(5))] == list(range(1, 24))
+    assert [asset['id'] for asset in collect(async_api.iter_inventory(5, after='20'))] == [21, 22, 23]
+    assert [source['id'] for source in collect(async_api.iter_sources(5, 'example1'))] == [1, 10, 11]
+    assert [asset['id'] for asset in collect(async_api.iter_ip_matches('10.0.9.9', 5))] == [5, 21]
+    async_api.close()
+
+
+def test_archive_assets(make_api):
+    inventory = FakeInventory([])
+    inventory.rejected = {'3'}
+    async_api = AsyncBitDiscoveryApi(make_api(inventory), 2)
+    assert run_sync(async_api.archive_assets((str(i) for i in range(10)), 4, workers=2)) == (9, ['3'])
+    async_api.close()
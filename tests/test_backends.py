@@ -0,0 +1,102 @@
+import pytest
+from bitdiscovery.cloud import AWSProvider
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+# The moto AMI every region has
+IMAGE_ID = 'ami-12c6146b'
+
+
+@pytest.fixture
+def session(monkeypatch):
+    # Nothing may reach a real account, whatever is configured where the tests run
+    for name in ['AWS_PROFILE', 'AWS_SESSION_TOKEN', 'AWS_SECURITY_TOKEN']:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with moto.mock_aws():
+        yield boto3.session.Session(region_name='us-east-1')
+
+
+@pytest.fixture
+def backend(session):
+    from bitdiscovery.backends import AWSSdkBackend
+    return AWSSdkBackend(session=session)
+
+
+def run_instances(session, region: str, count: int):
+    ec2 = session.client('ec2', region_name=region)
+    return ec2.run_instances(ImageId=IMAGE_ID, MinCount=count, MaxCount=count)['Instances']
+
+
+def test_regions(backend):
+    regions = backend.regions()
+    assert 'us-east-1' in regions and 'eu-west-1' in regions
+
+
+def test_dynamic_ips(session, backend):
+    instances = run_instances(session, 'eu-west-1', 3)
+    ips = backend.dynamic_ips('eu-west-1')
+    assert set(ips) == {instance['PublicIpAddress'] for instance in instances}
+    assert backend.dynamic_ips('us-east-1') == {}
+
+
+def test_dynamic_ips_skip_stopped_instances(session, backend):
+    instances = run_instances(session, 'us-east-1', 2)
+    session.client('ec2', region_name='us-east-1').stop_instances(InstanceIds=[instances[0]['InstanceId']])
+    assert set(backend.dynamic_ips('us-east-1')) == {instances[1]['PublicIpAddress']}
+
+
+def test_dynamic_ips_are_paginated(session, backend):
+    # Pages are made of reservations, every instance gets one of its own
+    instances = [instance for _ in range(12) for instance in run_instances(session, 'us-west-2', 1)]
+    client = backend.client('ec2', 'us-west-2')
+    pages = []
+    # Five reservations per page, the smallest page EC2 allows
+    client.meta.events.register('before-parameter-build.ec2.DescribeInstances',
+                                lambda params, **kwargs: params.setdefault('MaxResults', 5))
+    client.meta.events.register('after-call.ec2.DescribeInstances', lambda **kwargs: pages.append(1))
+    assert set(backend.dynamic_ips('us-west-2')) == {instance['PublicIpAddress'] for instance in instances}
+    assert len(pages) == 3
+
+
+def test_elastic_ips(session, backend):
+    ec2 = session.client('ec2', region_name='eu-west-1')
+    addresses = [ec2.allocate_address(Domain='vpc')['PublicIp'] for _ in range(2)]
+    assert set(backend.elastic_ips('eu-west-1')) == set(addresses)
+    assert backend.elastic_ips('us-east-1') == {}
+
+
+def test_s3_buckets_and_regions(session, backend):
+    s3 = session.client('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket='bd-test-east')
+    s3.create_bucket(Bucket='bd-test-west', CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+    assert backend.s3_buckets() == {'bd-test-east': 1, 'bd-test-west': 1}
+    assert backend.s3_bucket_region('bd-test-east') is None
+    assert backend.s3_bucket_region('bd-test-west') == 'eu-west-1'
+
+
+def test_account(backend):
+    assert backend.account() == moto.core.DEFAULT_ACCOUNT_ID
+
+
+def test_clients_are_reused(backend):
+    assert backend.client('ec2', 'eu-west-1') is backend.client('ec2', 'eu-west-1')
+    assert backend.client('ec2', 'eu-west-1') is not backend.client('ec2', 'us-east-1')
+
+
+def test_provider(session, backend, tmp_path):
+    east = run_instances(session, 'us-east-1', 1)
+    west = run_instances(session, 'eu-west-1', 1)
+    address = session.client('ec2', region_name='ap-south-1').allocate_address(Domain='vpc')['PublicIp']
+    session.client('s3', region_name='us-east-1').create_bucket(
+        Bucket='bd-test-bucket', CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+
+    provider = AWSProvider(max_workers=4, backend=backend)
+    ips = provider.get_instance_ips()
+    assert set(ips) == {east[0]['PublicIpAddress'], west[0]['PublicIpAddress'], address}
+    assert not provider.incomplete
+    urls = provider.find_s3_urls(provider.find_s3_buckets(), str(tmp_path / 's3-regions.json'))
+    assert urls == {'bd-test-bucket': 'bd-test-bucket.s3.eu-west-1.amazonaws.com'}
+    assert provider.find_aws_acct() == 'AWS_ACCT_ID:' + moto.core.DEFAULT_ACCOUNT_ID
@@ -0,0 +1,74 @@
+import json
+import threading
+from typing import Dict, List, Optional
+from bitdiscovery.cache import save_json
+from bitdiscovery.cloud import AWSProvider, s3_url
+
+
+class FakeBuckets:
+    """
+    Stands in for an AWS backend, knowing the region of every bucket.
+    """
+
+    def __init__(self, regions: Dict[str, Optional[str]], during_lookup=None):
+        self.regions = regions
+        self.looked_up: List[str] = []
+        self.during_lookup = during_lookup
+        self._lock = threading.Lock()
+
+    def s3_bucket_region(self, bucket: str) -> Optional[str]:
+        with self._lock:
+            self.looked_up.append(bucket)
+        if self.during_lookup is not None:
+            self.during_lookup(bucket)
+        return self.regions[bucket]
+
+
+def test_s3_url():
+    assert s3_url('bucket', None) == 'bucket.s3.us-east-1.amazonaws.com'
+    assert s3_url('bucket', 'EU') == 'bucket.s3.eu-west-1.amazonaws.com'
+    assert s3_url('bucket', 'ap-south-1') == 'bucket.s3.ap-south-1.amazonaws.com'
+
+
+def test_find_s3_urls_caches_the_regions(tmp_path):
+    cache_path = str(tmp_path / 's3-regions.json')
+    backend = FakeBuckets({'east': None, 'west': 'eu-west-1'})
+    provider = AWSProvider(backend=backend)
+    expected = {'east': 'east.s3.us-east-1.amazonaws.com', 'west': 'west.s3.eu-west-1.amazonaws.com'}
+    assert provider.find_s3_urls(['east', 'west'], cache_path) == expected
+    assert provider.find_s3_urls(['east', 'west'], cache_path) == expected
+    assert sorted(backend.looked_up) == ['east', 'west']
+
+
+def test_find_s3_urls_skips_failed_lookups(tmp_path):
+    cache_path = str(tmp_path / 's3-regions.json')
+    provider = AWSProvider(backend=FakeBuckets({'east': None}))
+    assert provider.find_s3_urls(['east', 'gone'], cache_path) == {'east': 'east.s3.us-east-1.amazonaws.com'}
+    with open(cache_path) as f:
+        assert json.load(f) == {'east': None}
+
+
+def test_find_s3_urls_merges_buckets_saved_in_the_meantime(tmp_path):
+    cache_path = str(tmp_path / 's3-regions.json')
+    save_json(cache_path, {'old': 'us-west-2'})
+    # Another account saves its bucket while this one looks its buckets up
+    backend = FakeBuckets({'new': 'eu-west-1'}, lambda bucket: save_json(cache_path, {'old': 'us-west-2',
+                                                                                     'other': 'ap-south-1'}))
+    assert AWSProvider(backend=backend).find_s3_urls(['new', 'old'], cache_path) == {
+        'new': 'new.s3.eu-west-1.amazonaws.com', 'old': 'old.s3.us-west-2.amazonaws.com'}
+    with open(cache_path) as f:
+        assert json.load(f) == {'old': 'us-west-2', 'other': 'ap-south-1', 'new': 'eu-west-1'}
+
+
+def test_accounts_looking_up_at_once_keep_every_bucket(tmp_path):
+    cache_path = str(tmp_path / 's3-regions.json')
+    providers = [AWSProvider(max_workers=4, backend=FakeBuckets({f'{i}-{j}': 'eu-west-1' for j in range(10)}))
+                 for i in range(8)]
+    threads = [threading.Thread(target=provider.find_s3_urls, args=(list(provider.backend.regions), cache_path))
+               for provider in providers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with open(cache_path) as f:
+        assert len(json.load(f)) == 80
@@ -0,0 +1,43 @@
+import os
+import runpy
+import sys
+import pytest
+from conftest import FakeInventory, make_assets
+from bitdiscovery.api import BitDiscoveryApi
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'delete-ip.py')
+SOURCES = [{'id': i, 'keyword': keyword, 'search_type': 'iprange'}
+           for (i, keyword) in enumerate(['10.0.0.1', '10.0.0.0/30', '10.0.0.2-3', '10.0.0.0/24', '10.0.0.9'])] + \
+          [{'id': 5, 'keyword': 'example.com', 'search_type': 'domain'}]
+
+
+@pytest.fixture
+def inventory(monkeypatch, tmp_path):
+    inventory = FakeInventory(make_assets(20, first_ip=0), list(SOURCES), page_size=8)
+    monkeypatch.setattr(BitDiscoveryApi, '_request', lambda api, *args, **kwargs: inventory(*args, **kwargs))
+    monkeypatch.setenv('BITDISCOVERY_CACHE_DIR', str(tmp_path))
+    return inventory
+
+
+def delete_ip(monkeypatch, *args: str):
+    monkeypatch.setattr(sys, 'argv', ['delete-ip.py', 'KEY'] + list(args))
+    runpy.run_path(SCRIPT, run_name='__main__')
+
+
+@pytest.mark.parametrize('options', [[], ['--mirror']])
+def test_cidr_value_is_matched_against_every_asset_and_source(monkeypatch, inventory, options):
+    delete_ip(monkeypatch, 'ip', '10.0.0.0/30', '--limit', '10', *options)
+    # The assets of 10.0.0.0 to 10.0.0.3, and the sources inside the CIDR
+    assert sorted(inventory.hidden, key=int) == ['1', '2', '3', '4']
+    assert sorted(inventory.deleted) == ['0', '1', '2']
+    # The API can't search for a CIDR, so every asset is read, and with the mirror only its IPs are searched for
+    ip_searches = [request for request in inventory.requests if 'columns=id,bd.ip_address' in request]
+    assert len(ip_searches) == (4 if options else 0)
+
+
+def test_single_ip_value_is_searched_for(monkeypatch, inventory):
+    delete_ip(monkeypatch, 'ip', '10.0.0.1', '--limit', '10')
+    assert inventory.hidden == ['2']
+    assert inventory.deleted == ['0']
+    assert any('columns=id,bd.ip_address' in request for request in inventory.requests)
+    assert all('search=10.0.0.1' in request for request in inventory.requests if '/sources' in request)
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import pytest
+import requests
+from bitdiscovery.feeds import MAGIC, RangeFeedCache, format_prefix, pack_prefixes, parse_prefixes, unpack_prefixes
+
+FEED_URL = 'https://ip-ranges.amazonaws.com/ip-ranges.json'
+
+
+def parse_aws(r: requests.Response):
+    return [prefix['ip_prefix'] for prefix in r.json()['prefixes']]
+
+
+class FakeFeed:
+    """
+    Stands in for requests.request, answering with the given body, or with a 304 while it didn't change.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.calls = 0
+
+    def __call__(self, method, url, data=None, headers=None, timeout=None) -> requests.Response:
+        self.calls += 1
+        content = json.dumps(self.body).encode()
+        etag = '"' + hashlib.sha256(content).hexdigest()[:16] + '"'
+        r = requests.Response()
+        r.url = url
+        if headers.get('If-None-Match') == etag:
+            r.status_code = 304
+            return r
+        r.status_code = 200
+        r.headers['ETag'] = etag
+        r._content = content
+        return r
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    feed = FakeFeed({'prefixes': [{'ip_prefix': '52.95.110.0/24'}, {'ip_prefix': '3.5.140.0/22'}]})
+    monkeypatch.setattr('bitdiscovery.feeds.requests.request', feed)
+    return feed
+
+
+def test_pack_round_trip():
+    prefixes = parse_prefixes(['10.0.0.0/8', '52.95.110.0/24', '2600:1f00::/24', '::/0', '0.0.0.0/0',
+                               '255.255.255.255/32'])
+    data = pack_prefixes(prefixes)
+    assert data.startswith(MAGIC)
+    # 6 bytes per IPv4 and 18 bytes per IPv6 prefix
+    assert len(data) == len(MAGIC) + 4 + 4 * 6 + 2 * 18
+    assert unpack_prefixes(data) == prefixes
+    assert [format_prefix(prefix) for prefix in unpack_prefixes(data)] == [
+        '10.0.0.0/8', '52.95.110.0/24', '2600:1f00::/24', '::/0', '0.0.0.0/0', '255.255.255.255/32']
+
+
+def test_pack_empty():
+    assert unpack_prefixes(pack_prefixes([])) == []
+
+
+def test_unpack_rejects_other_data():
+    with pytest.raises(ValueError):
+        unpack_prefixes(b'{"prefixes": []}')
+
+
+def test_parse_prefixes_skips_non_cidrs():
+    assert [format_prefix(prefix) for prefix in parse_prefixes(['10.0.0.0/24', '10.0.0.1', 'x/24', '10.0.0.5/30'])] \
+        == ['10.0.0.0/24', '10.0.0.4/30']
+
+
+def test_fetch_keeps_a_snapshot(feed, tmp_path):
+    cache = RangeFeedCache(str(tmp_path))
+    expected = parse_prefixes(['52.95.110.0/24', '3.5.140.0/22'])
+    assert cache.fetch('aws', FEED_URL, parse_aws) == expected
+    # Younger than the TTL, the snapshot is used without asking
+    assert cache.fetch('aws', FEED_URL, parse_aws) == expected
+    assert feed.calls == 1
+    # Older, it is revalidated with its ETag
+    cache.ttl = 0
+    assert cache.fetch('aws', FEED_URL, parse_aws) == expected
+    assert feed.calls == 2
+    feed.body['prefixes'].append({'ip_prefix': '2.57.12.0/24'})
+    assert cache.fetch('aws', FEED_URL, parse_aws) == expected + parse_prefixes(['2.57.12.0/24'])
+    assert RangeFeedCache(str(tmp_path)).fetch('aws', FEED_URL, parse_aws) == \
+        expected + parse_prefixes(['2.57.12.0/24'])
+    assert feed.calls == 3
+
+
+def test_fetch_uses_the_snapshot_when_the_feed_changed_format(feed, tmp_path):
+    cache = RangeFeedCache(str(tmp_path), ttl=0)
+    expected = cache.fetch('aws', FEED_URL, parse_aws)
+    feed.body = {'ranges': []}
+    assert cache.fetch('aws', FEED_URL, parse_aws) == expected
+
+
+@pytest.mark.parametrize('body', [{'ranges': []}, {'prefixes': [None]}, ['52.95.110.0/24']])
+def test_fetch_raises_value_error_for_an_unknown_format(feed, tmp_path, body):
+    feed.body = body
+    with pytest.raises(ValueError):
+        RangeFeedCache(str(tmp_path)).fetch('aws', FEED_URL, parse_aws)
@@ -0,0 +1,107 @@
+from bitdiscovery.ipindex import IPV6_FLAG, IntervalIndex, ip_key, key_to_ip, parse_range
+
+
+def test_ip_key_round_trip():
+    for ip in ['0.0.0.0', '10.0.0.1', '255.255.255.255', '::1', '2001:db8::8a2e:370:7334']:
+        assert key_to_ip(ip_key(ip)) == ip
+    assert ip_key('10.0.0.256') is None
+    assert ip_key('example.com') is None
+
+
+def test_ipv4_and_ipv6_keys_dont_collide():
+    assert ip_key('::a00:1') == ip_key('10.0.0.1') | IPV6_FLAG
+
+
+def test_parse_range_single_ip():
+    assert parse_range('10.0.0.1') == (ip_key('10.0.0.1'), ip_key('10.0.0.1'))
+    assert parse_range(' ::1 ') == (ip_key('::1'), ip_key('::1'))
+
+
+def test_parse_range_cidr():
+    assert parse_range('10.0.0.0/24') == (ip_key('10.0.0.0'), ip_key('10.0.0.255'))
+    assert parse_range('10.0.0.0/32') == (ip_key('10.0.0.0'), ip_key('10.0.0.0'))
+    assert parse_range('0.0.0.0/0') == (ip_key('0.0.0.0'), ip_key('255.255.255.255'))
+    assert parse_range('2001:db8::/120') == (ip_key('2001:db8::'), ip_key('2001:db8::ff'))
+
+
+def test_parse_range_cidr_with_host_bits():
+    assert parse_range('10.0.0.77/24') == parse_range('10.0.0.0/24')
+
+
+def test_parse_range_dash():
+    assert parse_range('10.0.0.1-10.0.1.9') == (ip_key('10.0.0.1'), ip_key('10.0.1.9'))
+    assert parse_range('10.0.0.1 - 10.0.0.9') == (ip_key('10.0.0.1'), ip_key('10.0.0.9'))
+    assert parse_range('2001:db8::1-2001:db8::9') == (ip_key('2001:db8::1'), ip_key('2001:db8::9'))
+
+
+def test_parse_range_short_dash():
+    assert parse_range('10.0.0.1-9') == (ip_key('10.0.0.1'), ip_key('10.0.0.9'))
+    assert parse_range('10.0.0.1-256') is None
+
+
+def test_parse_range_invalid():
+    for text in ['', 'example.com', 'foo-bar.com', '10.0.0.0/33', '10.0.0.0/x', '::/129', '10.0.0.9-10.0.0.1',
+                 '10.0.0.9-1', '10.0.0.1-example.com']:
+        assert parse_range(text) is None, text
+
+
+def test_build_merges_overlapping_and_adjacent_ranges():
+    index = IntervalIndex.from_ranges(['10.0.0.0/25', '10.0.0.128/25', '10.0.0.100-10.0.1.5', '10.0.5.0/24',
+                                       'example.com'])
+    assert len(index) == 2
+    assert index.starts == [ip_key('10.0.0.0'), ip_key('10.0.5.0')]
+    assert index.ends == [ip_key('10.0.1.5'), ip_key('10.0.5.255')]
+
+
+def test_build_keeps_earlier_ranges():
+    index = IntervalIndex.from_ranges(['10.0.0.0/24'])
+    index.add(ip_key('10.0.2.0'), ip_key('10.0.2.255'))
+    index.build()
+    assert index.contains('10.0.0.1') and index.contains('10.0.2.1')
+    assert not index.contains('10.0.1.1')
+
+
+def test_from_prefixes():
+    index = IntervalIndex.from_prefixes([(ip_key('10.0.0.0'), 30), (ip_key('2001:db8::'), 127)])
+    assert index.contains_many(['10.0.0.3', '10.0.0.4', '2001:db8::1', '2001:db8::2']) == [True, False, True, False]
+
+
+def test_contains_keys():
+    index = IntervalIndex.from_ranges(['10.0.0.0/24', '192.168.0.1', '2001:db8::/64'])
+    ips = ['9.255.255.255', '10.0.0.0', '10.0.0.255', '10.0.1.0', '192.168.0.1', '192.168.0.2', '2001:db8::1',
+           '2001:db9::1', '::a00:1']
+    expected = [False, True, True, False, True, False, True, False, False]
+    assert index.contains_keys([ip_key(ip) for ip in ips]) == expected
+    assert [index.contains_key(ip_key(ip)) for ip in ips] == expected
+
+
+def test_contains_keys_empty():
+    index = IntervalIndex().build()
+    assert index.contains_keys([]) == []
+    assert index.contains_keys([ip_key('10.0.0.1'), ip_key('::1')]) == [False, False]
+    # Only IPv6 ranges, so there's nothing for the IPv4 keys to be found in
+    index = IntervalIndex.from_ranges(['::/0'])
+    assert index.contains_keys([ip_key('10.0.0.1'), ip_key('::1')]) == [False, True]
+
+
+def test_contains_many_skips_invalid_addresses():
+    index = IntervalIndex.from_ranges(['0.0.0.0/0'])
+    assert index.contains_many(['10.0.0.1', 'example.com', '']) == [True, False, False]
+
+
+def test_covers():
+    index = IntervalIndex.from_ranges(['10.0.0.0/24', '10.0.2.0/24'])
+    assert index.covers(*parse_range('10.0.0.0/24'))
+    assert index.covers(*parse_range('10.0.0.16/28'))
+    assert index.covers(*parse_range('10.0.2.255'))
+    assert not index.covers(*parse_range('10.0.0.0/23'))
+    assert not index.covers(*parse_range('10.0.0.255-10.0.2.0'))
+    assert not index.covers(*parse_range('9.255.255.255-10.0.0.1'))
+    assert not index.covers(*parse_range('10.0.1.0/28'))
+
+
+def test_contains_keys_without_numpy(monkeypatch):
+    monkeypatch.setattr('bitdiscovery.ipindex.numpy', None)
+    index = IntervalIndex.from_ranges(['10.0.0.0/24', '2001:db8::/64'])
+    ips = ['10.0.0.1', '10.0.1.1', '2001:db8::1', '::1']
+    assert index.contains_keys([ip_key(ip) for ip in ips]) == [True, False, True, False]
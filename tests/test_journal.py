@@ -0,0 +1,120 @@
+from bitdiscovery.journal import Journal, PageCheckpoint
+
+
+def reopen(journal: Journal, directory) -> Journal:
+    journal.close()
+    return Journal('test', 'key', resume=True, directory=str(directory))
+
+
+def test_replay(tmp_path):
+    journal = Journal('test', 'key', directory=str(tmp_path))
+    assert not journal.resumed
+    journal.set_cursor('assets', '10')
+    journal.set_cursor('assets', '20')
+    journal.mark_done('assets', ['1', 2])
+    journal.mark_done('sources', [])
+    journal.mark_done('sources', ['7'])
+
+    journal = reopen(journal, tmp_path)
+    assert journal.resumed
+    assert journal.cursor('assets') == '20'
+    assert journal.cursor('sources') == ''
+    assert journal.done('assets') == {'1', '2'}
+    assert journal.done('sources') == {'7'}
+    journal.close()
+
+
+def test_replay_stops_at_torn_record(tmp_path):
+    journal = Journal('test', 'key', directory=str(tmp_path))
+    journal.mark_done('assets', ['1'])
+    journal.close()
+    with open(journal.path, 'a') as f:
+        f.write('{"s":"assets","d":["2"')
+
+    journal = Journal('test', 'key', resume=True, directory=str(tmp_path))
+    assert journal.done('assets') == {'1'}
+    journal.close()
+
+
+def test_other_work_or_no_resume_starts_over(tmp_path):
+    journal = Journal('test', 'key', directory=str(tmp_path))
+    journal.mark_done('assets', ['1'])
+    journal.close()
+
+    other = Journal('test', 'other key', resume=True, directory=str(tmp_path))
+    assert not other.resumed and other.done('assets') == set()
+    other.close()
+
+    journal = Journal('test', 'key', directory=str(tmp_path))
+    assert not journal.resumed and journal.done('assets') == set()
+    journal = reopen(journal, tmp_path)
+    assert journal.done('assets') == set()
+    journal.close()
+
+
+def test_finish_removes_the_journal(tmp_path):
+    journal = Journal('test', 'key', directory=str(tmp_path))
+    journal.mark_done('assets', ['1'])
+    journal.finish()
+    journal = Journal('test', 'key', resume=True, directory=str(tmp_path))
+    assert not journal.resumed
+    journal.close()
+
+
+def test_checkpoint_waits_for_every_item_of_earlier_pages(tmp_path):
+    journal = Journal('test', 'key', directory=str(tmp_path))
+    checkpoint = PageCheckpoint(journal, 'assets')
+    checkpoint.add('1')
+    checkpoint.add('2')
+    checkpoint.page_done('2')
+    checkpoint.add('3')
+    checkpoint.page_done('3')
+    assert journal.cursor('assets') == ''
+
+    # The second page is written first, its cursor still has to wait for the first page
+    checkpoint.complete(['3'])
+    assert journal.cursor('assets') == ''
+    checkpoint.complete(['1'])
+    assert journal.cursor('assets') == ''
+    checkpoint.complete(['2'])
+    assert journal.cursor('assets') == '3'
+
+    journal = reopen(journal, tmp_path)
+    assert journal.cursor('assets') == '3'
+    assert journal.done('assets') == {'1', '2', '3'}
+    journal.close()
+
+
+def test_checkpoint_pages_without_items(tmp_path):
+    journal = Journal('test', 'key', directory=str(tmp_path))
+    checkpoint = PageCheckpoint(journal, 'assets')
+    checkpoint.page_done('100')
+    assert journal.cursor('assets') == '100'
+    checkpoint.add('101')
+    # The last page has no next cursor, the one before it is kept until the run finishes
+    checkpoint.page_done('')
+    checkpoint.complete(['101'])
+    assert journal.cursor('assets') == '100'
+
+    journal = reopen(journal, tmp_path)
+    assert journal.cursor('assets') == '100'
+    assert journal.done('assets') == {'101'}
+    journal.close()
+
+
+def test_resumed_checkpoint_skips_nothing_unwritten(tmp_path):
+    journal = Journal('test', 'key', directory=str(tmp_path))
+    checkpoint = PageCheckpoint(journal, 'assets')
+    for item in ['1', '2']:
+        checkpoint.add(item)
+    checkpoint.page_done('2')
+    checkpoint.add('3')
+    checkpoint.page_done('3')
+    # Crash with only the second page written
+    checkpoint.complete(['3'])
+
+    journal = reopen(journal, tmp_path)
+    # The scan starts over from the first page, and only skips what was written
+    assert journal.cursor('assets') == ''
+    assert journal.done('assets') == {'3'}
+    journal.close()
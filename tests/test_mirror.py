@@ -0,0 +1,41 @@
+import pytest
+import requests
+from conftest import FakeInventory, make_assets
+from bitdiscovery.api import ApiError
+from bitdiscovery.mirror import InventoryMirror
+from bitdiscovery.retry import HttpStatusError
+
+SOURCES = [{'id': 1, 'keyword': 'example.com', 'search_type': 'domain'},
+           {'id': 2, 'keyword': '10.0.0.0/24', 'search_type': 'iprange'}]
+
+
+@pytest.fixture
+def inventory():
+    return FakeInventory(make_assets(25), list(SOURCES), page_size=10)
+
+
+def test_sync(make_api, inventory, tmp_path):
+    with InventoryMirror(make_api(inventory), str(tmp_path)) as mirror:
+        assert mirror.sync(10) == (25, 2)
+        assert mirror.asset_ids_for_ip('10.0.0.7') == ['7']
+        assert [source['id'] for source in mirror.sources('10.0')] == ['2']
+
+        # Only the new assets are downloaded, and the sources only when their count changed
+        inventory.assets.extend(make_assets(30)[25:])
+        assert mirror.sync(10) == (5, 0)
+        assert len(list(mirror.assets())) == 30
+        inventory.sources.append({'id': 3, 'keyword': 'example.org', 'search_type': 'domain'})
+        assert mirror.sync_sources(10) == 3
+
+
+def test_sync_sources_retries_the_count(make_api, inventory, tmp_path):
+    inventory.errors = [HttpStatusError(503, '/sources'), requests.ConnectionError()]
+    with InventoryMirror(make_api(inventory), str(tmp_path)) as mirror:
+        assert mirror.sync_sources(10) == 2
+
+
+def test_sync_sources_fails_with_api_error(make_api, inventory, tmp_path):
+    inventory.errors = [HttpStatusError(503, '/sources') for _ in range(5)]
+    with InventoryMirror(make_api(inventory), str(tmp_path)) as mirror:
+        with pytest.raises(ApiError):
+            mirror.sync_sources(10)
@@ -0,0 +1,74 @@
+import os
+import pytest
+from bitdiscovery.pdf import PdfBuilder, ResourceCache, table_rows
+
+RESOURCES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pdf')
+# A real ASN name, without a dot and wider than the name column
+WIDE_NAME = 'MICROSOFT-CORP-MSN-AS-BLOCK - MICROSOFT CORPORATION UNITED STATES'
+
+
+@pytest.fixture(scope='module')
+def cache():
+    return ResourceCache()
+
+
+@pytest.fixture
+def builder(cache):
+    builder = PdfBuilder('Test inventory', RESOURCES, cache)
+    # Uncompressed, so the tests can find the drawn texts
+    builder.pdf.set_compression(False)
+    builder.pdf.add_page()
+    builder.pdf.set_font('Helvetica', '', 11)
+    return builder
+
+
+def test_fit_text_keeps_short_text(builder):
+    assert builder.fit_text('AS8075', 131) == 'AS8075'
+    assert builder.fit_text('example.com', 131) == 'example.com'
+
+
+def test_fit_text_cuts_wide_text_without_dot(builder):
+    assert '.' not in WIDE_NAME and len(WIDE_NAME) <= 75
+    text = builder.fit_text(WIDE_NAME, 131)
+    assert text.endswith('...')
+    assert WIDE_NAME.startswith(text[:-3])
+    assert builder.pdf.get_string_width(text) <= 131
+
+
+def test_fit_text_cuts_long_text(builder):
+    text = builder.fit_text('a' * 100, 1000)
+    assert text == 'a' * 75 + '...'
+
+
+def test_table_rows_adds_up_missing():
+    data = [{'name': 'nginx', 'value': 5}, {'name': '__missing__', 'value': 3}, {'name': '', 'value': 2},
+            {'name': 443, 'value': 1}]
+    assert table_rows(data) == [('nginx', 5), ('443', 1), ('__missing__', 5)]
+
+
+def test_add_table_continues_on_new_pages(builder):
+    builder.pdf.set_y(120)
+    rows = [(WIDE_NAME if i == 0 else f'server-{i}', 100 - i) for i in range(60)]
+    builder.add_table('Servers', rows, 5000)
+    # 21 rows fit below y=120, 35 on every continuation page
+    assert builder.pdf.page == 3
+    assert builder.pdf.get_y() <= 270
+    text = bytes(builder.output()).decode('latin-1')
+    assert text.count('(Percent)') == 3
+
+
+def test_add_table_moves_a_lone_header(builder):
+    builder.pdf.set_y(260)
+    builder.add_table('Servers', [('nginx', 1)], 1)
+    assert builder.pdf.page == 2
+
+
+def test_build_report_with_wide_names(tmp_path):
+    from PyPDF2 import PdfFileReader
+    from bitdiscovery.report import build_report, pages
+    data = [{'name': WIDE_NAME, 'value': 10}, {'name': '__missing__', 'value': 2}]
+    aggregations = [{'column': page.key, 'data': data} for page in pages]
+    dashboard = {'stats': {'total': 12, 'domaincount': 3, 'subdomaincount': 4}, 'aggregations': aggregations}
+    path = build_report('Test inventory', dashboard, RESOURCES, str(tmp_path), '20200101')
+    assert os.path.basename(path) == 'Test_inventory-20200101.pdf'
+    assert len(PdfFileReader(path).pages) > len(pages)
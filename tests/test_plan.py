@@ -0,0 +1,82 @@
+import gzip
+import json
+import pytest
+from conftest import FakeInventory
+from bitdiscovery.asyncapi import AsyncBitDiscoveryApi
+from bitdiscovery.journal import Journal
+from bitdiscovery.plan import ChangePlan, PlanExecutor
+
+
+def make_plan() -> ChangePlan:
+    return ChangePlan('Test inventory', 'AWS', add_ips=['10.0.0.1', '10.0.0.2'],
+                      add_sources=['bucket.s3.eu-west-1.amazonaws.com'], archive_assets=['5', '6', '7'],
+                      delete_sources=['1', '2'], created=1600000000.0)
+
+
+def test_save_and_load(tmp_path):
+    plan = make_plan()
+    plan.save(str(tmp_path / 'plan.json.gz'))
+    loaded = ChangePlan.load(str(tmp_path / 'plan.json.gz'))
+    assert loaded.to_dict() == plan.to_dict()
+    assert loaded.digest() == plan.digest()
+    assert len(loaded) == 8
+
+
+def test_digest_changes_with_the_plan():
+    plan = make_plan()
+    digest = plan.digest()
+    plan.delete_sources.append('3')
+    assert plan.digest() != digest
+
+
+def test_load_rejects_other_files(tmp_path):
+    with open(tmp_path / 'plain.json', 'w') as f:
+        json.dump(make_plan().to_dict(), f)
+    with pytest.raises(ValueError):
+        ChangePlan.load(str(tmp_path / 'plain.json'))
+
+    data = make_plan().to_dict()
+    data['version'] = 0
+    with gzip.open(tmp_path / 'old.json.gz', 'wt') as f:
+        json.dump(data, f)
+    with pytest.raises(ValueError):
+        ChangePlan.load(str(tmp_path / 'old.json.gz'))
+
+    with pytest.raises(ValueError):
+        ChangePlan.load(str(tmp_path / 'missing.json.gz'))
+
+
+def test_apply(make_api):
+    inventory = FakeInventory([])
+    api = make_api(inventory)
+    async_api = AsyncBitDiscoveryApi(api, 2)
+    results = PlanExecutor(api, async_api, batch_size=2).apply(make_plan())
+    assert [(result.name, result.done, result.failed) for result in results] == [
+        ('add_ips', 2, []), ('add_sources', 1, []), ('archive_assets', 3, []), ('delete_sources', 2, [])]
+    assert sorted(inventory.added) == ['10.0.0.1', '10.0.0.2', 'bucket.s3.eu-west-1.amazonaws.com']
+    assert sorted(inventory.hidden) == ['5', '6', '7']
+    assert sorted(inventory.deleted) == ['1', '2']
+    async_api.close()
+
+
+def test_resumed_apply_only_makes_the_failed_writes(make_api, tmp_path):
+    plan = make_plan()
+    inventory = FakeInventory([])
+    inventory.rejected = {'6'}
+    api = make_api(inventory)
+    async_api = AsyncBitDiscoveryApi(api, 1)
+    journal = Journal('auto-add-assets-apply', plan.digest(), directory=str(tmp_path))
+    results = PlanExecutor(api, async_api, batch_size=2, journal=journal).apply(plan)
+    assert results[2].failed == ['6']
+    journal.close()
+
+    inventory.rejected = set()
+    inventory.requests.clear()
+    journal = Journal('auto-add-assets-apply', plan.digest(), resume=True, directory=str(tmp_path))
+    results = PlanExecutor(api, async_api, batch_size=2, journal=journal).apply(plan)
+    assert [(result.name, result.done, result.failed) for result in results] == [
+        ('add_ips', 0, []), ('add_sources', 0, []), ('archive_assets', 1, []), ('delete_sources', 0, [])]
+    assert inventory.requests == ['POST /asset/hide']
+    assert sorted(inventory.hidden) == ['5', '6', '7']
+    journal.close()
+    async_api.close()
@@ -0,0 +1,75 @@
+import pytest
+from bitdiscovery.ratelimit import RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A clock that only moves when the limiter sleeps.
+    """
+    now = [0.0]
+    monkeypatch.setattr('bitdiscovery.ratelimit.time.time', lambda: now[0])
+    monkeypatch.setattr('bitdiscovery.ratelimit.time.sleep', lambda seconds: now.__setitem__(0, now[0] + seconds))
+    return now
+
+
+def test_take():
+    limiter = RateLimiter('KEY', 2.0, 0.5, state_dir='unused')
+    state = {}
+    # A full bucket allows a burst of one second worth of calls
+    assert limiter._take(state, 'read', 0.0) == 0.0
+    assert limiter._take(state, 'read', 0.0) == 0.0
+    assert limiter._take(state, 'read', 0.0) == pytest.approx(0.5)
+    # Half a token was refilled in 0.25 seconds
+    assert limiter._take(state, 'read', 0.25) == pytest.approx(0.25)
+    assert limiter._take(state, 'read', 0.5) == 0.0
+    # Budgets below one call per second still allow one call at once
+    assert limiter._take(state, 'write', 0.0) == 0.0
+    assert limiter._take(state, 'write', 0.0) == pytest.approx(2.0)
+    assert limiter._take(state, 'write', 1.0) == pytest.approx(1.0)
+
+
+def test_unlimited_by_default(tmp_path, clock):
+    limiter = RateLimiter('KEY', state_dir=str(tmp_path))
+    assert all(limiter.acquire('read') == 0.0 for _ in range(100))
+    assert all(limiter.acquire('write') == 0.0 for _ in range(100))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_acquire_paces_the_calls(tmp_path, clock):
+    limiter = RateLimiter('KEY', 4.0, 1.0, state_dir=str(tmp_path))
+    waited = [limiter.acquire('read') for _ in range(12)]
+    assert waited[:4] == [0.0] * 4
+    assert waited[4:] == [0.25] * 8
+    assert clock[0] == 2.0
+    # Reads and writes have budgets of their own
+    assert limiter.acquire('write') == 0.0
+    assert limiter.acquire('write') == pytest.approx(1.0)
+
+
+def test_limiters_of_one_key_share_the_budget(tmp_path, clock):
+    first = RateLimiter('KEY', 2.0, state_dir=str(tmp_path))
+    second = RateLimiter('KEY', 2.0, state_dir=str(tmp_path))
+    other = RateLimiter('OTHER KEY', 2.0, state_dir=str(tmp_path))
+    assert first.acquire() == 0.0
+    assert first.acquire() == 0.0
+    assert second.acquire() == pytest.approx(0.5)
+    assert other.acquire() == 0.0
+    # The key itself isn't written to disk
+    assert not any('KEY' in path.name for path in tmp_path.iterdir())
+
+
+def test_corrupt_state_file_is_started_over(tmp_path, clock):
+    limiter = RateLimiter('KEY', 1.0, state_dir=str(tmp_path))
+    with open(limiter.path, 'w') as f:
+        f.write('{"read": [0.0')
+    assert limiter.acquire() == 0.0
+    assert limiter.acquire() == pytest.approx(1.0)
+
+
+def test_without_file_locks(monkeypatch, tmp_path, clock):
+    monkeypatch.setattr('bitdiscovery.ratelimit.fcntl', None)
+    limiter = RateLimiter('KEY', 2.0, state_dir=str(tmp_path))
+    assert limiter.path is None
+    assert [limiter.acquire() for _ in range(3)] == [0.0, 0.0, pytest.approx(0.5)]
+    assert list(tmp_path.iterdir()) == []
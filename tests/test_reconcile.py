@@ -0,0 +1,50 @@
+from bitdiscovery.ipindex import IntervalIndex
+from bitdiscovery.reconcile import Reconciler
+
+
+def test_plan():
+    reconciler = Reconciler()
+    for keyword in ['10.0.0.1', '10.0.0.2', '10.0.1.0/24', '10.0.2.1-10.0.2.5', 'example.com']:
+        reconciler.add_source(keyword)
+    reconciler.add_inventory_ips(['10.0.0.3', 'not an ip'])
+    reconciler.add_cloud_ips(['10.0.0.1', '10.0.0.3', '10.0.1.7', '10.0.2.5', '10.0.2.6', '10.0.0.9', 'bad'])
+    plan = reconciler.plan()
+    assert plan.to_add == ['10.0.0.9', '10.0.2.6']
+    assert plan.unchanged == ['10.0.0.1', '10.0.0.3']
+    assert plan.covered == ['10.0.1.7', '10.0.2.5']
+    assert plan.stale == ['10.0.0.2']
+    assert reconciler.invalid == ['bad']
+
+
+def test_plan_sorts_by_address_and_normalizes():
+    reconciler = Reconciler()
+    reconciler.add_cloud_ips(['10.0.0.10', '2001:DB8::1', '10.0.0.9', ' 9.0.0.1'])
+    assert reconciler.plan().to_add == ['9.0.0.1', '10.0.0.9', '10.0.0.10', '2001:db8::1']
+
+
+def test_stale_only_inside_scope():
+    reconciler = Reconciler(scope=IntervalIndex.from_ranges(['10.0.0.0/8']))
+    for keyword in ['10.0.0.1', '192.168.0.1', '10.0.0.2']:
+        reconciler.add_source(keyword)
+    reconciler.add_cloud_ips(['10.0.0.2'])
+    assert reconciler.plan().stale == ['10.0.0.1']
+
+
+def test_inventory_ips_are_never_stale():
+    reconciler = Reconciler()
+    reconciler.add_inventory_ips(['10.0.0.1'])
+    reconciler.add_cloud_ips(['10.0.0.1'])
+    plan = reconciler.plan()
+    assert plan.stale == [] and plan.to_add == [] and plan.unchanged == ['10.0.0.1']
+
+
+def test_plan_can_be_made_again():
+    reconciler = Reconciler()
+    reconciler.add_source('10.0.0.0/24')
+    reconciler.add_cloud_ips(['10.0.0.1', '10.0.1.1'])
+    assert reconciler.plan().covered == ['10.0.0.1']
+    reconciler.add_source('10.0.1.0/24')
+    reconciler.add_cloud_ips(['10.0.2.1'])
+    plan = reconciler.plan()
+    assert plan.covered == ['10.0.0.1', '10.0.1.1']
+    assert plan.to_add == ['10.0.2.1']
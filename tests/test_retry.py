@@ -0,0 +1,114 @@
+import pytest
+import requests
+from bitdiscovery.retry import CircuitBreaker, HttpStatusError, RetryPolicy, endpoint_name, parse_retry_after
+
+
+class Flaky:
+    """
+    Raises the given errors in turn, then returns 'ok'.
+    """
+
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waited = []
+    monkeypatch.setattr('bitdiscovery.retry.time.sleep', waited.append)
+    return waited
+
+
+def make_policy(**kwargs) -> RetryPolicy:
+    return RetryPolicy(breaker=CircuitBreaker(min_calls=1000), **kwargs)
+
+
+def test_retries_transient_errors(sleeps):
+    policy = make_policy()
+    fn = Flaky(HttpStatusError(503, '/inventory'), requests.ConnectionError(), requests.Timeout(), ValueError('json'))
+    assert policy.call(fn) == 'ok'
+    assert fn.calls == 5
+    assert len(sleeps) == 4
+    assert policy.summary()['/inventory'] == {'retries': 1, 'failures': 0, 'waited': round(sleeps[0], 1)}
+
+
+@pytest.mark.parametrize('error', [HttpStatusError(404, '/source/{id}/delete'), HttpStatusError(401, '/inventory'),
+                                   KeyError('id'), TypeError()])
+def test_fatal_errors_are_raised_right_away(sleeps, error):
+    policy = make_policy()
+    fn = Flaky(error)
+    with pytest.raises(type(error)):
+        policy.call(fn)
+    assert fn.calls == 1
+    assert sleeps == []
+
+
+def test_gives_up_after_max_tries(sleeps):
+    policy = make_policy(max_tries=3)
+    fn = Flaky(*[HttpStatusError(500, '/inventory') for _ in range(10)])
+    with pytest.raises(HttpStatusError):
+        policy.call(fn)
+    assert fn.calls == 3
+    with pytest.raises(HttpStatusError):
+        policy.call(fn, max_tries=2)
+    assert fn.calls == 5
+    assert policy.summary()['/inventory']['failures'] == 2
+
+
+def test_delay_is_capped_and_honors_retry_after():
+    policy = make_policy(base_delay=1.0, max_delay=10.0)
+    for attempt in range(10):
+        assert 0 <= policy.get_delay(attempt, requests.ConnectionError()) <= min(10.0, 2 ** attempt)
+    assert policy.get_delay(0, HttpStatusError(429, '/inventory', retry_after=20.0)) == 20.0
+    # A Retry-After from a misbehaving server is capped too
+    assert policy.get_delay(0, HttpStatusError(429, '/inventory', retry_after=3600.0)) == 40.0
+
+
+def test_only_transient_failures_open_the_breaker(sleeps):
+    policy = RetryPolicy(max_tries=1, breaker=CircuitBreaker(window=10, threshold=0.5, min_calls=4, cooldown=0.0))
+    for _ in range(10):
+        with pytest.raises(HttpStatusError):
+            policy.call(Flaky(HttpStatusError(404, '/source/{id}/delete')))
+    assert policy.breaker.opened == 0
+
+    for _ in range(4):
+        with pytest.raises(HttpStatusError):
+            policy.call(Flaky(HttpStatusError(503, '/inventory')))
+    assert policy.breaker.opened == 1
+
+
+def test_open_breaker_pauses_callers(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('bitdiscovery.retry.time.monotonic', lambda: now[0])
+    monkeypatch.setattr('bitdiscovery.retry.time.sleep', lambda seconds: now.__setitem__(0, now[0] + seconds))
+    breaker = CircuitBreaker(window=4, threshold=0.5, min_calls=4, cooldown=30.0)
+    for success in [True, False, True, False]:
+        breaker.record(success)
+    assert breaker.opened == 1
+    breaker.wait()
+    assert now[0] == 130.0
+    # The window starts over after the pause
+    breaker.record(False)
+    assert breaker.opened == 1
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('') is None
+    assert parse_retry_after('120') == 120.0
+    assert parse_retry_after('-5') == 0.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after('soon') is None
+
+
+def test_endpoint_name():
+    assert endpoint_name('https://bitdiscovery.com/api/1.0/source/123/delete') == '/source/{id}/delete'
+    assert endpoint_name('https://bitdiscovery.com/api/1.0/inventory?limit=10&after=5') == '/inventory'
+    assert endpoint_name('https://bitdiscovery.com/api/1.0') == '/'